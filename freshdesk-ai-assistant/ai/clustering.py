@@ -0,0 +1,222 @@
+import re
+import zlib
+import logging
+import threading
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from database.db_operations import get_session, get_all_tickets
+from database.models import Ticket
+from utils.config import get_config
+from utils.text_processing import html_to_text
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Tickets in these states are no longer clustered; their incident is over
+CLOSED_STATUSES = ('resolved', 'closed')
+
+# Number of consecutive words per shingle
+SHINGLE_WORDS = 3
+
+# Prime just above 2**32, so hashed shingles fit below it
+HASH_PRIME = 4294967311
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text: str) -> Set[int]:
+    """Hash the overlapping word n-grams of a text into 32-bit integers."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        grams = [" ".join(words)] if words else []
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return {zlib.crc32(gram.encode('utf-8')) for gram in grams}
+
+
+class MinHashLSH:
+    """Incremental near-duplicate clustering of tickets with MinHash and LSH banding.
+
+    Each ticket gets a MinHash signature of its word shingles. Signatures are
+    split into bands, and tickets that share any band bucket are candidates;
+    candidates whose estimated Jaccard similarity reaches the threshold are
+    joined into the same cluster. Tickets can be added, replaced or removed
+    one at a time; clusters are recomputed from the buckets on the next read.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 32, threshold: float = 0.5):
+        """Initialize an empty index.
+
+        Args:
+            num_perm: Number of hash functions in a signature
+            bands: Number of LSH bands (num_perm is rounded down to a multiple of it)
+            threshold: Minimum estimated Jaccard similarity for two tickets to be clustered
+        """
+        self.bands = max(1, min(bands, num_perm))
+        self.rows = max(1, num_perm // self.bands)
+        self.num_perm = self.bands * self.rows
+        self.threshold = threshold
+
+        # Fixed seed so signatures are comparable across restarts
+        random_state = np.random.RandomState(1)
+        self._a = random_state.randint(1, 2 ** 31, size=self.num_perm).astype(np.uint64)
+        self._b = random_state.randint(0, 2 ** 31, size=self.num_perm).astype(np.uint64)
+
+        self._lock = threading.Lock()
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._buckets: Dict[tuple, Set[int]] = {}
+        self._clusters = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Compute the MinHash signature of a text, or None if it has no words."""
+        hashes = np.fromiter(shingles(text), dtype=np.uint64)
+        if not hashes.size:
+            return None
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % np.uint64(HASH_PRIME)
+        return permuted.min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[tuple]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+
+    def add(self, ticket_id: int, text: str) -> None:
+        """Add a ticket to the index, replacing its previous entry."""
+        signature = self.signature(text)
+
+        with self._lock:
+            self._remove(ticket_id)
+            if signature is None:
+                return
+            self._signatures[ticket_id] = signature
+            for key in self._band_keys(signature):
+                self._buckets.setdefault(key, set()).add(ticket_id)
+
+    def remove(self, ticket_id: int) -> None:
+        """Remove a ticket from the index, if it is there."""
+        with self._lock:
+            self._remove(ticket_id)
+
+    def _remove(self, ticket_id: int) -> None:
+        signature = self._signatures.pop(ticket_id, None)
+        if signature is None:
+            return
+        for key in self._band_keys(signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(ticket_id)
+                if not bucket:
+                    del self._buckets[key]
+        self._clusters = None
+
+    def similarity(self, first_id: int, second_id: int) -> float:
+        """Estimated Jaccard similarity of two indexed tickets."""
+        return float(np.mean(self._signatures[first_id] == self._signatures[second_id]))
+
+    def clusters(self) -> List[List[int]]:
+        """Get all clusters of two or more tickets, largest first.
+
+        Returns:
+            Lists of ticket IDs, each sorted so the oldest ticket comes first
+        """
+        with self._lock:
+            if self._clusters is None:
+                self._clusters = self._build_clusters()
+            return [list(members) for members in self._clusters]
+
+    def _build_clusters(self) -> List[List[int]]:
+        parent = {ticket_id: ticket_id for ticket_id in self._signatures}
+
+        def find(ticket_id):
+            while parent[ticket_id] != ticket_id:
+                parent[ticket_id] = parent[parent[ticket_id]]
+                ticket_id = parent[ticket_id]
+            return ticket_id
+
+        checked = set()
+        for bucket in self._buckets.values():
+            if len(bucket) < 2:
+                continue
+            members = sorted(bucket)
+            for i, first_id in enumerate(members):
+                for second_id in members[i + 1:]:
+                    if (first_id, second_id) in checked:
+                        continue
+                    checked.add((first_id, second_id))
+                    if find(first_id) != find(second_id) and self.similarity(first_id, second_id) >= self.threshold:
+                        parent[find(second_id)] = find(first_id)
+
+        groups: Dict[int, List[int]] = {}
+        for ticket_id in parent:
+            groups.setdefault(find(ticket_id), []).append(ticket_id)
+
+        clusters = [sorted(members) for members in groups.values() if len(members) > 1]
+        clusters.sort(key=lambda members: (-len(members), members[0]))
+        return clusters
+
+    def cluster_of(self, ticket_id: int) -> List[int]:
+        """Get the cluster containing a ticket (just the ticket itself if it has no near-duplicates)."""
+        for members in self.clusters():
+            if ticket_id in members:
+                return members
+        return [ticket_id]
+
+
+def cluster_text(ticket: Ticket) -> str:
+    """Get the text a ticket is clustered on."""
+    return "\n".join([ticket.subject or '', html_to_text(ticket.description)])
+
+
+# Process-wide index, loaded from the database on first use
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_cluster_index() -> MinHashLSH:
+    """Get the process-wide cluster index, building it from the open tickets in the database if needed."""
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            settings = get_config().app
+            _index = MinHashLSH(
+                int(settings.get('cluster_num_perm', 128)),
+                int(settings.get('cluster_bands', 32)),
+                float(settings.get('cluster_threshold', 0.5))
+            )
+        if not _index.loaded:
+            session = get_session()
+            try:
+                for ticket in get_all_tickets(session):
+                    if ticket.status not in CLOSED_STATUSES:
+                        _index.add(ticket.id, cluster_text(ticket))
+                _index.loaded = True
+                logger.info(f"Cluster index built with {len(_index)} tickets")
+            finally:
+                session.close()
+        return _index
+
+
+def cluster_ticket(session, ticket_id: int) -> None:
+    """Add, refresh or drop one ticket in the cluster index after it was imported."""
+    ticket = session.query(Ticket).filter(Ticket.id == ticket_id).first()
+    index = get_cluster_index()
+
+    if ticket is None or ticket.status in CLOSED_STATUSES:
+        index.remove(ticket_id)
+    else:
+        index.add(ticket.id, cluster_text(ticket))
+
+
+def get_ticket_clusters() -> List[List[int]]:
+    """Get the current clusters of near-duplicate open tickets, largest first."""
+    return get_cluster_index().clusters()
+
+
+def get_cluster_members(ticket_id: int) -> List[int]:
+    """Get the IDs of the tickets in the same cluster as a ticket, including the ticket itself."""
+    return get_cluster_index().cluster_of(ticket_id)
@@ -0,0 +1,192 @@
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from ai.generation_service import GENERATION_KINDS, generate_for_ticket
+from database.db_operations import (
+    get_session,
+    enqueue_generation_job,
+    get_generation_job,
+    get_generation_jobs,
+    get_queued_generation_jobs,
+    claim_generation_job,
+    finish_generation_job,
+    requeue_running_generation_jobs
+)
+from utils.config import get_config
+from utils.tracing import get_current_span, traced
+from database.query_profiler import profiled
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+def serialize_job(job) -> Dict[str, Any]:
+    """Convert a generation job to a JSON-serializable dictionary."""
+    return {
+        'id': job.id,
+        'ticket_id': job.ticket_id,
+        'kind': job.kind,
+        'status': job.status,
+        'result': json.loads(job.result) if job.result else None,
+        'error': job.error,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+
+class GenerationQueue:
+    """Persistent queue of generation jobs run by a bounded pool of worker threads.
+
+    Jobs are stored in the generation_jobs table, so their status survives the
+    request that created them and jobs left behind by a restart can be resumed
+    with recover(). A request for a ticket and kind that already has a pending
+    job returns that job instead of queueing another model call.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        """Initialize the queue.
+
+        Args:
+            max_workers: Maximum number of jobs that run at the same time
+        """
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='generation')
+            return self._executor
+
+    def resize(self, max_workers: int) -> None:
+        """Change the pool size; jobs already handed to the old pool still finish there."""
+        with self._lock:
+            if max_workers == self.max_workers:
+                return
+            self.max_workers = max_workers
+            old_executor, self._executor = self._executor, None
+
+        if old_executor is not None:
+            old_executor.shutdown(wait=False)
+
+    def submit(self, ticket_id: int, kind: str, regenerate: bool = False) -> Dict[str, Any]:
+        """Queue a generation job, or return the pending job for the same ticket and kind.
+
+        Args:
+            ticket_id: The database ID of the ticket
+            kind: One of GENERATION_KINDS
+            regenerate: Skip the response cache and ask the model again
+
+        Returns:
+            The serialized job, with 'deduplicated' set if an existing job was returned
+        """
+        if kind not in GENERATION_KINDS:
+            raise ValueError(f"Unknown generation kind: {kind}")
+
+        session = get_session()
+        try:
+            # Serialize the check-then-insert so concurrent clicks can't both create a job
+            with self._lock:
+                job, created = enqueue_generation_job(session, ticket_id, kind, regenerate)
+
+            if created:
+                logger.info(f"Queued {kind} generation job {job.id} for ticket {ticket_id}")
+                self._dispatch(job.id)
+            else:
+                logger.info(f"Reusing pending {kind} generation job {job.id} for ticket {ticket_id}")
+
+            return dict(serialize_job(job), deduplicated=not created)
+        finally:
+            session.close()
+
+    def get_job(self, job_id: int) -> Optional[Dict[str, Any]]:
+        """Get the serialized status of a job, or None if it doesn't exist."""
+        session = get_session()
+        try:
+            job = get_generation_job(session, job_id)
+            return serialize_job(job) if job else None
+        finally:
+            session.close()
+
+    def get_jobs(self, job_ids: List[int]) -> List[Dict[str, Any]]:
+        """Get the serialized status of several jobs; unknown IDs are left out."""
+        session = get_session()
+        try:
+            return [serialize_job(job) for job in get_generation_jobs(session, job_ids)]
+        finally:
+            session.close()
+
+    def recover(self) -> int:
+        """Requeue jobs interrupted by a restart and dispatch everything still queued.
+
+        Returns:
+            Number of jobs dispatched
+        """
+        session = get_session()
+        try:
+            requeued = requeue_running_generation_jobs(session)
+            if requeued:
+                logger.info(f"Requeued {requeued} interrupted generation jobs")
+
+            job_ids = [job.id for job in get_queued_generation_jobs(session)]
+        finally:
+            session.close()
+
+        for job_id in job_ids:
+            self._dispatch(job_id)
+        return len(job_ids)
+
+    def _dispatch(self, job_id: int) -> None:
+        self._get_executor().submit(self._run, job_id)
+
+    @traced('generation.job')
+    @profiled('generation.job')
+    def _run(self, job_id: int) -> None:
+        """Claim and run a single job in a worker thread."""
+        session = get_session()
+        try:
+            job = claim_generation_job(session, job_id)
+            if job is None:
+                # Another worker got there first, or the job already finished
+                return
+            get_current_span().set_attributes({'job.id': job_id, 'job.kind': job.kind, 'ticket.id': job.ticket_id})
+
+            try:
+                result = generate_for_ticket(session, job.ticket_id, job.kind, job.regenerate)
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Generation job {job_id} failed: {str(e)}")
+                finish_generation_job(session, job, error=str(e))
+                return
+
+            finish_generation_job(session, job, result=json.dumps(result))
+            logger.info(f"Generation job {job_id} finished")
+        except Exception as e:
+            logger.error(f"Error running generation job {job_id}: {str(e)}")
+        finally:
+            session.close()
+
+
+# Process-wide queue, shared by all requests
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_generation_queue() -> GenerationQueue:
+    """Get the process-wide generation queue, applying any reloaded worker count."""
+    global _queue
+
+    max_workers = int(get_config().app.get('generation_workers', 2))
+
+    with _queue_lock:
+        if _queue is None:
+            _queue = GenerationQueue(max_workers)
+        else:
+            _queue.resize(max_workers)
+        return _queue
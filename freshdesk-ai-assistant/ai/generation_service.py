@@ -0,0 +1,268 @@
+import re
+import logging
+from typing import Any, Dict, List
+
+from database.db_operations import (
+    get_conversations_for_ticket,
+    get_response,
+    get_responses_for_ticket,
+    create_response,
+    update_response_full,
+    save_generated_response,
+    mark_ticket_processed
+)
+from database.models import Ticket
+from utils.config import get_config
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Kinds of content that can be generated for a ticket
+GENERATION_KINDS = ('response', 'tech_instructions', 'follow_up_questions', 'summary', 'cluster_response', 'send')
+
+# Customer draft stored alongside tech instructions until an agent writes one
+PLACEHOLDER_RESPONSE = "This is a placeholder response. Please edit before sending to the customer."
+
+
+def readdress_greeting(content: str, from_ticket: Ticket, to_ticket: Ticket) -> str:
+    """Replace one customer's first name with another's in the first line of an answer."""
+    old_name = from_ticket.requester_name.split()[0] if from_ticket.requester_name else None
+    new_name = to_ticket.requester_name.split()[0] if to_ticket.requester_name else "there"
+    if not old_name or not content:
+        return content
+
+    first_line, _, rest = content.partition("\n")
+    first_line = re.sub(rf"\b{re.escape(old_name)}\b", new_name, first_line)
+    return first_line + ("\n" + rest if rest else "")
+
+
+def reuse_previous_answer(session, ticket_id: int, source_response_id: int):
+    """Copy an answer sent on another ticket into this ticket's draft, without a model call.
+
+    The greeting is re-addressed when it used the other customer's first name.
+
+    Args:
+        session: Database session
+        ticket_id: The database ID of the ticket receiving the answer
+        source_response_id: The sent response to reuse
+
+    Returns:
+        The stored draft response
+    """
+    ticket = session.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        raise ValueError(f"Ticket {ticket_id} not found")
+
+    source = get_response(session, source_response_id)
+    if source is None or not source.is_sent:
+        raise ValueError(f"Response {source_response_id} not found or not sent")
+
+    content = readdress_greeting(source.final_content or "", source.ticket, ticket)
+
+    response = save_generated_response(session, ticket.id, content, tech_instructions="", is_final_solution=False)
+    mark_ticket_processed(session, ticket.id)
+    logger.info(f"Reused response {source_response_id} for ticket {ticket.freshdesk_id}")
+    return response
+
+
+def fan_out_response(session, source_ticket: Ticket, content: str, follow_up_questions: str,
+                     member_ids: List[int]) -> List[int]:
+    """Copy a draft generated for one ticket of a cluster to the other members.
+
+    Each member gets the copy as a new draft, so a draft an agent is still
+    working on for that ticket is kept rather than overwritten.
+
+    Args:
+        session: Database session
+        source_ticket: The ticket the draft was generated for
+        content: The generated draft
+        follow_up_questions: JSON-encoded follow-up questions stored with the draft
+        member_ids: Database IDs of the tickets in the cluster
+
+    Returns:
+        IDs of the tickets that received a copy
+    """
+    copied = []
+    for member_id in member_ids:
+        if member_id == source_ticket.id:
+            continue
+        member = session.query(Ticket).filter(Ticket.id == member_id).first()
+        if member is None:
+            continue
+
+        create_response(
+            session,
+            member.id,
+            readdress_greeting(content, source_ticket, member),
+            tech_instructions="",
+            follow_up_questions=follow_up_questions,
+            is_final_solution=False
+        )
+        mark_ticket_processed(session, member.id)
+        copied.append(member.id)
+
+    logger.info(f"Copied the draft for ticket {source_ticket.freshdesk_id} to {len(copied)} clustered tickets")
+    return copied
+
+
+def send_draft(session, ticket: Ticket) -> Dict[str, Any]:
+    """Send a ticket's latest draft to Freshdesk through the outbox, as approved in a bulk action.
+
+    The reply is delivered right away on the calling worker; if that fails, the
+    outbox keeps retrying it in the background.
+
+    Args:
+        session: Database session
+        ticket: The ticket whose draft is sent
+
+    Returns:
+        Dictionary with the id and content of the sent response and its outbox message
+    """
+    from freshdesk.outbox import get_outbox_sender, reply_idempotency_key
+
+    responses = get_responses_for_ticket(session, ticket.id)
+    draft = responses[0] if responses else None
+    if draft is None or draft.is_sent:
+        raise ValueError(f"Ticket {ticket.freshdesk_id} has no unsent draft")
+    if not draft.final_content or draft.final_content.strip() == PLACEHOLDER_RESPONSE:
+        raise ValueError(f"The draft for ticket {ticket.freshdesk_id} hasn't been written yet")
+
+    sender = get_outbox_sender()
+    message = sender.enqueue(ticket.id, 'reply', {'body': draft.final_content}, reply_idempotency_key(draft.id),
+                             response_id=draft.id, kick=False)
+    if message['status'] == 'pending':
+        message = sender.deliver(message['id']) or sender.get_message(message['id'])
+    if message['status'] != 'sent':
+        raise RuntimeError(f"Reply for ticket {ticket.freshdesk_id} not delivered yet "
+                           f"({message['status']}): {message['last_error'] or 'in progress'}")
+
+    return {
+        'id': draft.id,
+        'content': draft.final_content,
+        'outbox_message': message
+    }
+
+
+def generate_for_ticket(session, ticket_id: int, kind: str, regenerate: bool = False) -> Dict[str, Any]:
+    """Generate content for a ticket and store it on the latest draft.
+
+    Args:
+        session: Database session
+        ticket_id: The database ID of the ticket
+        kind: One of GENERATION_KINDS
+        regenerate: Skip the response cache and ask the model again
+
+    Returns:
+        Dictionary describing the stored response (id, content and the generated fields),
+        or the updated summary for the 'summary' kind. 'cluster_response' generates a
+        response once and copies it to every ticket in the same cluster, and 'send'
+        sends the latest draft to Freshdesk instead of generating anything
+    """
+    from ai.response_generator import (
+        generate_ticket_response,
+        generate_tech_instructions,
+        generate_follow_up_questions,
+        generate_combined_response
+    )
+
+    if kind not in GENERATION_KINDS:
+        raise ValueError(f"Unknown generation kind: {kind}")
+
+    ticket = session.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        raise ValueError(f"Ticket {ticket_id} not found")
+
+    if kind == 'summary':
+        # Summaries are background upkeep; they don't produce a draft or mark the ticket processed
+        from ai.summarizer import update_ticket_summary
+
+        ticket_summary = update_ticket_summary(session, ticket)
+        return {
+            'summary': ticket_summary.summary if ticket_summary else None,
+            'conversation_count': ticket_summary.conversation_count if ticket_summary else 0
+        }
+
+    if kind == 'send':
+        return send_draft(session, ticket)
+
+    if kind == 'cluster_response':
+        from ai.clustering import get_cluster_members
+
+        # Members are looked up when the job runs, so tickets imported while it was queued are included
+        member_ids = get_cluster_members(ticket.id)
+        result = generate_for_ticket(session, ticket.id, 'response', regenerate)
+        response = get_response(session, result['id'])
+        result['fanned_out_to'] = fan_out_response(session, ticket, response.final_content,
+                                                   response.follow_up_questions, member_ids)
+        return result
+
+    conversations = get_conversations_for_ticket(session, ticket.id)
+    combined = get_config().openai.get('combined_generation', True)
+
+    if kind == 'response':
+        if combined:
+            # Draft and follow-up questions from a single structured call
+            result = generate_combined_response(ticket, conversations, regenerate=regenerate)
+            response_text = result['response']
+            follow_up_questions = result['follow_up_questions']
+        else:
+            response_text = generate_ticket_response(ticket, conversations, regenerate)
+            follow_up_questions = generate_follow_up_questions(ticket, conversations, regenerate)
+
+        response = save_generated_response(
+            session,
+            ticket.id,
+            response_text,
+            tech_instructions="", # No tech instructions
+            follow_up_questions=follow_up_questions,
+            is_final_solution=False # Default to false
+        )
+        result = {
+            'id': response.id,
+            'content': response.final_content,
+            'follow_up_questions': follow_up_questions
+        }
+    elif kind == 'tech_instructions':
+        if combined:
+            # Tech instructions and follow-up questions from a single structured call
+            result = generate_combined_response(ticket, conversations, include_response=False, include_tech_instructions=True,
+                                                regenerate=regenerate)
+            tech_instructions = result['tech_instructions']
+            follow_up_questions = result['follow_up_questions']
+        else:
+            tech_instructions = generate_tech_instructions(ticket, conversations, regenerate)
+            follow_up_questions = generate_follow_up_questions(ticket, conversations, regenerate)
+
+        response = save_generated_response(
+            session,
+            ticket.id,
+            PLACEHOLDER_RESPONSE,
+            tech_instructions=tech_instructions,
+            follow_up_questions=follow_up_questions,
+            is_final_solution=False
+        )
+        result = {
+            'id': response.id,
+            'content': PLACEHOLDER_RESPONSE,
+            'tech_instructions': tech_instructions,
+            'follow_up_questions': follow_up_questions
+        }
+    else:
+        follow_up_questions = generate_follow_up_questions(ticket, conversations, regenerate)
+
+        # Attach the questions to the current draft without touching its content
+        existing_responses = get_responses_for_ticket(session, ticket.id)
+        if existing_responses and not existing_responses[0].is_sent:
+            response = update_response_full(session, existing_responses[0].id, follow_up_questions=follow_up_questions or "")
+        else:
+            response = create_response(session, ticket.id, PLACEHOLDER_RESPONSE, follow_up_questions=follow_up_questions)
+        result = {
+            'id': response.id,
+            'content': response.final_content,
+            'follow_up_questions': follow_up_questions
+        }
+
+    # Mark the ticket as processed
+    mark_ticket_processed(session, ticket.id)
+
+    return result
@@ -0,0 +1,202 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from ai.openai_client import get_openai_client, DEFAULT_SYSTEM_MESSAGE
+from utils.config import get_config
+from utils.text_processing import estimate_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Default tier per task: 'small', 'large' or 'auto' (decided by the size of the ticket)
+TASK_TIERS = {
+    'response': 'auto',
+    'combined': 'auto',
+    'combined_tech_instructions': 'large',
+    'tech_instructions': 'large',
+    'follow_up_questions': 'small',
+    'summary': 'small',
+}
+
+# Approximate list prices in USD per million (input, output) tokens, used for cost stats
+MODEL_PRICES = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4.1-nano': (0.10, 0.40),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1': (2.00, 8.00),
+}
+
+
+class TaskStats:
+    """Per-task latency, token and cost counters for this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks: Dict[str, Dict[str, Any]] = {}
+
+    def _task(self, task: str) -> Dict[str, Any]:
+        if task not in self._tasks:
+            self._tasks[task] = {
+                'calls': 0,
+                'cache_hits': 0,
+                'escalations': 0,
+                'failures': 0,
+                'total_latency_ms': 0.0,
+                'max_latency_ms': 0.0,
+                'prompt_tokens': 0,
+                'completion_tokens': 0,
+                'cost_usd': 0.0,
+                'models': {}
+            }
+        return self._tasks[task]
+
+    def record_call(self, task: str, model: str, latency_ms: float, usage: Dict[str, Any], cached: bool) -> None:
+        """Record one completed model call."""
+        with self._lock:
+            stats = self._task(task)
+            stats['calls'] += 1
+            stats['models'][model] = stats['models'].get(model, 0) + 1
+            stats['total_latency_ms'] += latency_ms
+            stats['max_latency_ms'] = max(stats['max_latency_ms'], latency_ms)
+            if cached:
+                # Served from the response cache; no tokens were paid for
+                stats['cache_hits'] += 1
+                return
+
+            prompt_tokens = usage.get('prompt_tokens') or 0
+            completion_tokens = usage.get('completion_tokens') or 0
+            stats['prompt_tokens'] += prompt_tokens
+            stats['completion_tokens'] += completion_tokens
+            stats['cost_usd'] += estimate_cost(model, prompt_tokens, completion_tokens)
+
+    def record_escalation(self, task: str) -> None:
+        with self._lock:
+            self._task(task)['escalations'] += 1
+
+    def record_failure(self, task: str) -> None:
+        with self._lock:
+            self._task(task)['failures'] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Get a copy of the counters, with average latency per task."""
+        with self._lock:
+            result = {}
+            for task, stats in self._tasks.items():
+                stats = dict(stats, models=dict(stats['models']))
+                stats['avg_latency_ms'] = round(stats['total_latency_ms'] / stats['calls'], 1) if stats['calls'] else 0.0
+                stats['total_latency_ms'] = round(stats['total_latency_ms'], 1)
+                stats['max_latency_ms'] = round(stats['max_latency_ms'], 1)
+                stats['cost_usd'] = round(stats['cost_usd'], 6)
+                result[task] = stats
+            return result
+
+
+# Counters shared by all generations in the process
+task_stats = TaskStats()
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """Estimate the cost of a call in USD from openai.model_prices or the built-in price list."""
+    prices = get_config().openai.get('model_prices', {}).get(model) or MODEL_PRICES.get(model)
+    if not prices:
+        return 0.0
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1000000.0
+
+
+def select_model(task: str, prompt_tokens: int = 0, conversation_count: int = 0) -> Tuple[str, str]:
+    """Pick the model for a task.
+
+    Tasks routed 'auto' use the large model for long or busy threads
+    (openai.large_model_min_prompt_tokens / openai.large_model_min_messages)
+    and the small model otherwise. Both models default to openai.model.
+
+    Args:
+        task: Task name (see TASK_TIERS)
+        prompt_tokens: Estimated tokens in the prompt
+        conversation_count: Number of conversation entries on the ticket
+
+    Returns:
+        Tuple of (model, tier)
+    """
+    settings = get_config().openai
+    default_model = settings.get('model', "gpt-4o-mini")
+
+    tier = settings.get('task_tiers', {}).get(task) or TASK_TIERS.get(task, 'auto')
+    if tier == 'auto':
+        long_thread = prompt_tokens >= int(settings.get('large_model_min_prompt_tokens', 1500))
+        busy_thread = conversation_count >= int(settings.get('large_model_min_messages', 6))
+        tier = 'large' if long_thread or busy_thread else 'small'
+
+    model = settings.get(f'{tier}_model') or default_model
+    return model, tier
+
+
+def complete_task(task: str, prompt: str, system_message: str = DEFAULT_SYSTEM_MESSAGE,
+                  validate: Optional[Callable[[str], bool]] = None, conversation_count: int = 0, **kwargs) -> str:
+    """Run a completion on the model routed for the task, escalating if the output is unusable.
+
+    If validate() rejects the small model's output, the request is repeated once
+    on the large model. Small-model outputs are only cached once they pass
+    validation, so a retry of the same prompt doesn't replay a rejected output.
+    Latency, tokens and cost of every call are recorded per task.
+
+    Args:
+        task: Task name (see TASK_TIERS)
+        prompt: The user prompt
+        system_message: The system message to send before the prompt
+        validate: Returns True if the generated text is usable
+        conversation_count: Number of conversation entries on the ticket
+        **kwargs: Additional arguments for OpenAIClient.chat()
+
+    Returns:
+        The generated text (the last attempt's, even if it failed validation)
+
+    Raises:
+        OpenAIError: If the request fails after all retries
+    """
+    prompt_tokens = estimate_tokens(system_message) + estimate_tokens(prompt)
+    model, tier = select_model(task, prompt_tokens, conversation_count)
+
+    cache_if = None if validate is None else (lambda data: validate(_content(data)))
+    text = _call(task, model, prompt, system_message, cache_if=cache_if, **kwargs)
+    if validate is None or validate(text):
+        return text
+
+    large_model = get_config().openai.get('large_model') or get_config().openai.get('model', "gpt-4o-mini")
+    if tier == 'large' or large_model == model:
+        return text
+
+    logger.info(f"Output of {model} for '{task}' failed validation, escalating to {large_model}")
+    task_stats.record_escalation(task)
+    return _call(task, large_model, prompt, system_message, cache_if=cache_if, **kwargs)
+
+
+def _call(task: str, model: str, prompt: str, system_message: str, **kwargs) -> str:
+    """Make one completion call and record its stats."""
+    start = time.monotonic()
+    try:
+        data = get_openai_client().chat([
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt}
+        ], model=model, **kwargs)
+    except Exception:
+        task_stats.record_failure(task)
+        raise
+
+    latency_ms = (time.monotonic() - start) * 1000.0
+    task_stats.record_call(task, model, latency_ms, data.get('usage') or {}, bool(data.get('from_cache')))
+    logger.debug(f"'{task}' on {model} took {latency_ms:.0f} ms")
+    return _content(data)
+
+
+def _content(data: Dict[str, Any]) -> str:
+    """Get the generated text of a chat completion response."""
+    return data['choices'][0]['message']['content']
+
+
+def get_task_stats() -> Dict[str, Dict[str, Any]]:
+    """Get per-task latency, token and cost stats for this process."""
+    return task_stats.snapshot()
@@ -1,63 +1,469 @@
-import os
 import json
+import time
+import random
 import logging
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Callable, Dict, Any, Iterator, List, Optional
+
 import requests
-from typing import Dict, Any
+from requests.adapters import HTTPAdapter
+
+from utils.config import get_config
+from utils.rate_limiter import RateLimiter
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from utils.metrics import counter, histogram
+from utils.tracing import get_current_span, start_as_current_span, traced
+from utils.text_processing import estimate_tokens
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def generate_response(prompt: str) -> str:
-    """Generate a response using the OpenAI API directly with requests.
-    
-    Args:
-        prompt: The prompt to send to the API
-        
-    Returns:
-        The generated response text
+# API endpoint
+OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
+
+# Default system message for ticket generations
+DEFAULT_SYSTEM_MESSAGE = "You are an experienced IT support specialist with excellent communication skills. You excel at explaining technical concepts in simple terms and providing empathetic, human-like responses that make customers feel valued and understood. IMPORTANT: Format your responses as plain text only, not markdown."
+
+# Status codes that are worth retrying
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Request metrics; streamed requests are timed to the response headers
+REQUEST_SECONDS = histogram('openai_request_seconds', 'Latency of OpenAI chat completion requests', ('model', 'stream'))
+REQUEST_FAILURES = counter('openai_request_failures_total', 'Failed OpenAI request attempts by cause', ('model', 'reason'))
+TOKENS = counter('openai_tokens_total', 'Tokens reported by the OpenAI API', ('model', 'type'))
+
+
+class OpenAIError(Exception):
+    """Raised when a chat completion fails after all retries."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class OpenAIClient:
+    """Client for the OpenAI chat completions API.
+
+    One instance is shared by the whole process (see get_openai_client), so
+    all callers reuse the same connection pool and rate limiter.
     """
-    try:
-        # Get API key from config
-        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
-        with open(config_path, 'r') as f:
-            config = json.load(f)
-        api_key = config['openai']['api_key']
-        
-        # API endpoint
-        url = "https://api.openai.com/v1/chat/completions"
-        
-        # Request headers
-        headers = {
+
+    def __init__(self, api_key: str, model: str = "gpt-4o-mini", connect_timeout: float = 5.0,
+                 read_timeout: float = 60.0, max_retries: int = 3, backoff_base: float = 1.0,
+                 backoff_max: float = 30.0, rate_limiter: Optional[RateLimiter] = None, response_cache=None):
+        """Initialize the OpenAI client.
+
+        Args:
+            api_key: OpenAI API key
+            model: Default model for completions
+            connect_timeout: Seconds to wait for a connection
+            read_timeout: Seconds to wait for the response after connecting
+            max_retries: Maximum number of retries for failed requests
+            backoff_base: Base delay for exponential backoff, in seconds
+            backoff_max: Maximum delay between retries, in seconds
+            rate_limiter: Shared requests/tokens per minute limiter
+            response_cache: Optional ResponseCache consulted before calling the API
+        """
+        self.api_key = api_key
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.response_cache = response_cache
+
+        # Token usage reported by the API, for verifying prompt cache savings
+        self._usage_lock = threading.Lock()
+        self.usage_totals = {'requests': 0, 'prompt_tokens': 0, 'cached_tokens': 0, 'completion_tokens': 0}
+
+        # Pooled keep-alive connections shared by every caller
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10)
+        self.session.mount("https://", adapter)
+
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
+            "Authorization": f"Bearer {self.api_key}"
         }
-        
-        # Get model from config or use default
-        model = config.get('openai', {}).get('model', "gpt-4o-mini")
-        
-        # Request payload with improved system message
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Get the delay before the next retry.
+
+        Honors the Retry-After header when the server sends one, otherwise uses
+        exponential backoff with full jitter.
+
+        Args:
+            attempt: Zero-based retry number
+            response: The failed response, if there was one
+
+        Returns:
+            Delay in seconds
+        """
+        if response is not None:
+            retry_after_ms = response.headers.get('retry-after-ms')
+            retry_after = response.headers.get('Retry-After')
+            try:
+                if retry_after_ms:
+                    return min(float(retry_after_ms) / 1000.0, self.backoff_max)
+                if retry_after:
+                    return min(max(float(retry_after), 0.0), self.backoff_max)
+            except (TypeError, ValueError):
+                # Retry-After may also be an HTTP date
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+                    return min(max(delay, 0.0), self.backoff_max)
+                except (TypeError, ValueError):
+                    pass
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @traced('openai.chat')
+    def chat(self, messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.7,
+             max_tokens: int = 1000, regenerate: bool = False,
+             cache_if: Optional[Callable[[Dict[str, Any]], bool]] = None, **params) -> Dict[str, Any]:
+        """Create a chat completion, using the response cache when one is configured.
+
+        Args:
+            messages: Chat messages to send
+            model: Model to use (defaults to the client's model)
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens in the completion
+            regenerate: Skip the cache lookup and always call the API
+            cache_if: Only cache (and only reuse cached) responses for which this returns True
+            **params: Additional request parameters (e.g. response_format)
+
+        Returns:
+            The decoded API response
+
+        Raises:
+            OpenAIError: If the request fails after all retries
+        """
         payload = {
-            "model": model,
-            "messages": [
-                {"role": "system", "content": "You are an experienced IT support specialist with excellent communication skills. You excel at explaining technical concepts in simple terms and providing empathetic, human-like responses that make customers feel valued and understood. IMPORTANT: Format your responses as plain text only, not markdown."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7,  # Slightly higher temperature for more human-like responses
-            "max_tokens": 1000   # Allow for longer, more detailed responses
+            "model": model or self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
         }
+        payload.update(params)
+        get_current_span().set_attributes({'openai.model': payload['model'], 'openai.max_tokens': max_tokens})
+
+        cache = self.response_cache
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(payload)
+            if regenerate:
+                cache.record_bypass()
+            else:
+                cached = cache.get(cache_key)
+                if cached is not None and (cache_if is None or cache_if(cached)):
+                    logger.info("Using cached OpenAI response")
+                    get_current_span().set_attribute('openai.cache_hit', True)
+                    cached['from_cache'] = True
+                    return cached
+
+        data = self._post(payload)
+
+        # A regenerated response replaces the cached one
+        if cache is not None and (cache_if is None or cache_if(data)):
+            cache.set(cache_key, data)
+
+        return data
+
+    @staticmethod
+    def _estimate_request_tokens(payload: Dict[str, Any]) -> int:
+        """Budget for the prompt plus the largest possible completion."""
+        return sum(estimate_tokens(m.get('content')) for m in payload['messages']) + payload.get('max_tokens', 0)
+
+    def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send a completion request, retrying transient failures.
+
+        Args:
+            payload: The request body
+
+        Returns:
+            The decoded API response
+
+        Raises:
+            OpenAIError: If the request fails after all retries
+        """
+        estimated_tokens = self._estimate_request_tokens(payload)
+        data = self._send(payload, estimated_tokens).json()
+
+        usage = data.get('usage') or {}
+        self._record_usage(payload, usage)
+        if usage.get('total_tokens'):
+            self.rate_limiter.record_usage(estimated_tokens, usage['total_tokens'])
+        return data
+
+    def _record_usage(self, payload: Dict[str, Any], usage: Dict[str, Any]) -> None:
+        """Log and count the tokens sent for a request.
+
+        Prompt tokens served from the provider's prompt cache are reported in
+        usage.prompt_tokens_details.cached_tokens.
+        """
+        prompt_estimate = sum(estimate_tokens(m.get('content')) for m in payload['messages'])
+        if usage.get('prompt_tokens') is None:
+            logger.info(f"OpenAI {payload['model']}: ~{prompt_estimate} prompt tokens sent")
+            return
+
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+        logger.info(f"OpenAI {payload['model']}: {usage['prompt_tokens']} prompt tokens sent "
+                    f"({cached_tokens} cached, ~{prompt_estimate} estimated), "
+                    f"{usage.get('completion_tokens', 0)} completion tokens")
+
+        TOKENS.inc(usage['prompt_tokens'] - cached_tokens, model=payload['model'], type='prompt')
+        TOKENS.inc(cached_tokens, model=payload['model'], type='cached_prompt')
+        TOKENS.inc(usage.get('completion_tokens') or 0, model=payload['model'], type='completion')
+
+        with self._usage_lock:
+            self.usage_totals['requests'] += 1
+            self.usage_totals['prompt_tokens'] += usage['prompt_tokens']
+            self.usage_totals['cached_tokens'] += cached_tokens
+            self.usage_totals['completion_tokens'] += usage.get('completion_tokens') or 0
+
+    def get_usage_stats(self) -> Dict[str, Any]:
+        """Get token usage reported by the API for this process."""
+        with self._usage_lock:
+            stats = dict(self.usage_totals)
+        prompt_tokens = stats['prompt_tokens']
+        stats['cached_ratio'] = round(stats['cached_tokens'] / prompt_tokens, 3) if prompt_tokens else 0.0
+        return stats
+
+    def _send(self, payload: Dict[str, Any], estimated_tokens: int, stream: bool = False) -> requests.Response:
+        """POST a request until it succeeds or the retries run out.
+
+        Args:
+            payload: The request body
+            estimated_tokens: Tokens to reserve from the rate limiter for the request (once, however many attempts it takes)
+            stream: Whether to stream the response body
+
+        Returns:
+            The successful HTTP response
+
+        Raises:
+            OpenAIError: If the request fails after all retries, or at once while the circuit breaker is open
+        """
+        breaker = get_circuit_breaker('openai')
+        attempt = 0
+        acquired = False
+        try:
+            while True:
+                # Fail fast instead of retrying against an API that is down
+                try:
+                    breaker.before_call()
+                except CircuitOpenError as e:
+                    REQUEST_FAILURES.inc(model=payload['model'], reason='circuit_open')
+                    raise OpenAIError(str(e), 503)
+
+                # The token budget is reserved once per request, not again for every retry
+                if not acquired:
+                    with start_as_current_span('openai.rate_limit_wait', {'openai.estimated_tokens': estimated_tokens}):
+                        self.rate_limiter.acquire(estimated_tokens)
+                    acquired = True
+
+                response = None
+                started = time.perf_counter()
+                try:
+                    with start_as_current_span('openai.request', {'openai.model': payload['model'], 'openai.attempt': attempt,
+                                                                  'openai.stream': stream}) as span:
+                        response = self.session.post(
+                            OPENAI_CHAT_URL,
+                            headers=self._headers(),
+                            json=payload,
+                            timeout=(self.connect_timeout, self.read_timeout),
+                            stream=stream
+                        )
+                        span.set_attribute('http.status_code', response.status_code)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    breaker.record_failure()
+                    reason = 'timeout' if isinstance(e, requests.exceptions.Timeout) else 'connection'
+                    REQUEST_FAILURES.inc(model=payload['model'], reason=reason)
+                    error = OpenAIError(f"OpenAI request failed: {str(e)}")
+                else:
+                    REQUEST_SECONDS.observe(time.perf_counter() - started, model=payload['model'], stream=str(stream).lower())
+
+                    # Server errors and timeouts count against the breaker; anything else means OpenAI is up
+                    if response.status_code >= 500 or response.status_code == 408:
+                        breaker.record_failure()
+                    else:
+                        breaker.record_success()
+
+                    if response.status_code == 200:
+                        return response
+
+                    REQUEST_FAILURES.inc(model=payload['model'], reason=str(response.status_code))
+                    error = OpenAIError(f"OpenAI API error: {response.status_code} - {response.text}", response.status_code)
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        raise error
+
+                if attempt >= self.max_retries:
+                    raise error
+
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"{str(error)[:200]}. Retrying in {delay:.2f} seconds (retry {attempt + 1}/{self.max_retries})")
+                with start_as_current_span('openai.retry_sleep', {'delay': delay}):
+                    time.sleep(delay)
+                attempt += 1
+        except OpenAIError:
+            if acquired:
+                # A failed request used no tokens; give the reservation back
+                self.rate_limiter.record_usage(estimated_tokens, 0)
+            raise
+
+    def complete(self, prompt: str, system_message: str = DEFAULT_SYSTEM_MESSAGE, **kwargs) -> str:
+        """Generate a completion for a single user prompt.
+
+        Args:
+            prompt: The user prompt
+            system_message: The system message to send before the prompt
+            **kwargs: Additional arguments for chat()
+
+        Returns:
+            The generated text
+
+        Raises:
+            OpenAIError: If the request fails after all retries
+        """
+        data = self.chat([
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": prompt}
+        ], **kwargs)
+        return data['choices'][0]['message']['content']
+
+    def stream_chat(self, messages: List[Dict[str, str]], model: Optional[str] = None, temperature: float = 0.7,
+                    max_tokens: int = 1000, regenerate: bool = False, **params) -> Iterator[str]:
+        """Create a chat completion and yield its text as it is generated.
+
+        Failures before the first byte are retried like chat(); once tokens are
+        flowing, a broken stream raises. A completed stream is stored in the
+        response cache, and a cached completion is yielded in one piece.
+
+        Args:
+            messages: Chat messages to send
+            model: Model to use (defaults to the client's model)
+            temperature: Sampling temperature
+            max_tokens: Maximum tokens in the completion
+            regenerate: Skip the cache lookup and always call the API
+            **params: Additional request parameters
+
+        Yields:
+            Chunks of generated text
+
+        Raises:
+            OpenAIError: If the request fails
+        """
+        payload = {
+            "model": model or self.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        payload.update(params)
+
+        # The cache key is the same as for the equivalent non-streaming request
+        cache = self.response_cache
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(payload)
+            if regenerate:
+                cache.record_bypass()
+            else:
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.info("Using cached OpenAI response")
+                    yield cached['choices'][0]['message']['content']
+                    return
+
+        estimated_tokens = self._estimate_request_tokens(payload)
+        stream_payload = dict(payload, stream=True, stream_options={"include_usage": True})
+        response = self._send(stream_payload, estimated_tokens, stream=True)
+
+        parts = []
+        usage = {}
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+
+                chunk = json.loads(data)
+                if chunk.get('usage'):
+                    usage = chunk['usage']
+                for choice in chunk.get('choices') or []:
+                    delta = (choice.get('delta') or {}).get('content')
+                    if delta:
+                        parts.append(delta)
+                        yield delta
+        except (requests.exceptions.RequestException, ValueError) as e:
+            raise OpenAIError(f"OpenAI stream failed: {str(e)}")
+        finally:
+            response.close()
+            # Settle the reservation however the stream ended, including a client that
+            # disconnected mid-stream; without reported usage, count the prompt and the text so far
+            used_tokens = usage.get('total_tokens') or (
+                estimated_tokens - payload.get('max_tokens', 0) + estimate_tokens(''.join(parts)))
+            self.rate_limiter.record_usage(estimated_tokens, used_tokens)
+
+        self._record_usage(payload, usage)
+
+        if cache is not None:
+            cache.set(cache_key, {
+                'choices': [{'message': {'role': 'assistant', 'content': ''.join(parts)}}],
+                'usage': usage
+            })
+
+
+def _apply_config_settings(client: OpenAIClient, config) -> None:
+    """Apply the OpenAI settings from the configuration to a client."""
+    settings = config['openai']
+    client.api_key = settings['api_key']
+    client.model = settings.get('model', "gpt-4o-mini")
+    client.connect_timeout = float(settings.get('connect_timeout', 5.0))
+    client.read_timeout = float(settings.get('read_timeout', 60.0))
+    client.max_retries = int(settings.get('max_retries', 3))
+    client.rate_limiter.configure(
+        settings.get('requests_per_minute', 500),
+        settings.get('tokens_per_minute', 200000)
+    )
+    
+    # Persistent response cache; imported here to keep this module free of the DB layer at import time
+    if settings.get('cache_enabled', True):
+        from ai.response_cache import ResponseCache
         
-        # Make the API request
-        response = requests.post(url, headers=headers, json=payload)
-        
-        # Check for successful response
-        if response.status_code == 200:
-            response_data = response.json()
-            return response_data['choices'][0]['message']['content']
-        else:
-            logger.error(f"OpenAI API error: {response.status_code} - {response.text}")
-            return "I apologize, but I'm currently unable to generate a response for your ticket. A support representative will review your ticket manually as soon as possible."
-            
-    except Exception as e:
-        logger.error(f"Error calling OpenAI API: {str(e)}")
-        return "I apologize, but I'm currently unable to generate a response for your ticket. A support representative will review your ticket manually as soon as possible."
+        if client.response_cache is None:
+            client.response_cache = ResponseCache()
+        client.response_cache.ttl_seconds = float(settings.get('cache_ttl_seconds', 86400))
+        client.response_cache.max_entries = int(settings.get('cache_max_entries', 1000))
+    else:
+        client.response_cache = None
+
+
+# Shared client instance and the config version its settings came from
+_client = None
+_client_config_version = None
+_client_lock = threading.Lock()
+
+def get_openai_client() -> OpenAIClient:
+    """Get the process-wide OpenAI client, applying any reloaded configuration."""
+    global _client, _client_config_version
+
+    config = get_config()
+
+    with _client_lock:
+        if _client is None:
+            _client = OpenAIClient(config['openai']['api_key'])
+
+        if _client_config_version != config.version:
+            _apply_config_settings(_client, config)
+            _client_config_version = config.version
+
+        return _client
+
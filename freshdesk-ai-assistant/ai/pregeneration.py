@@ -0,0 +1,122 @@
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Optional
+
+from database.db_operations import get_session, get_conversations_for_ticket, get_tickets_for_pregeneration
+from utils.config import get_config
+from utils.circuit_breaker import OPEN, get_circuit_breaker
+from utils.rate_limiter import TokenBucket
+from utils.text_processing import estimate_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Completion tokens reserved per draft (the max_tokens of a combined response call)
+COMPLETION_TOKENS = 1500
+
+# Hourly token budget shared by all pre-generation runs in the process
+_budget = None
+_budget_lock = threading.Lock()
+
+
+def _get_budget(tokens_per_hour: float) -> TokenBucket:
+    """Get the pre-generation token budget, resized to the configured limit.
+
+    The bucket holds a full hour of tokens and refills at tokens_per_hour/3600
+    per second, so a run can spend the hour's budget at once and the next run
+    gets what has refilled since.
+    """
+    global _budget
+
+    with _budget_lock:
+        if _budget is None:
+            _budget = TokenBucket(tokens_per_hour, tokens_per_hour / 3600.0)
+        else:
+            _budget.capacity = float(tokens_per_hour)
+            _budget.refill_per_second = tokens_per_hour / 3600.0
+            _budget.level = min(_budget.level, _budget.capacity)
+        return _budget
+
+
+def _take_from_budget(budget: TokenBucket, tokens: int) -> bool:
+    """Take tokens out of the budget if they are available now."""
+    with _budget_lock:
+        now = time.monotonic()
+        if budget.wait_time(tokens, now) > 0:
+            return False
+        budget.consume(tokens, now)
+        return True
+
+
+def within_allowed_hours(start_hour: int, end_hour: int, now: Optional[datetime] = None) -> bool:
+    """Check whether the current local hour falls in [start_hour, end_hour).
+
+    A window that ends before it starts (for example 22 to 6) wraps past midnight.
+    """
+    hour = (now or datetime.now()).hour
+    if start_hour <= end_hour:
+        return start_hour <= hour < end_hour
+    return hour >= start_hour or hour < end_hour
+
+
+def estimate_draft_tokens(ticket, conversations) -> int:
+    """Estimate the tokens a combined draft generation will use for a ticket."""
+    from ai.response_generator import create_combined_prompt, combined_system_message
+
+    prompt_tokens = estimate_tokens(combined_system_message()) + estimate_tokens(create_combined_prompt(ticket, conversations))
+    return prompt_tokens + COMPLETION_TOKENS
+
+
+def run_pregeneration() -> int:
+    """Queue draft generation for new tickets while the budget and schedule allow.
+
+    Tickets that still need processing and have never had generation requested
+    are queued highest priority first. Each run stops at the batch size or as
+    soon as the next draft would exceed the hourly token budget. A ticket whose
+    job fails is not retried automatically; the agent can still generate on demand.
+
+    Returns:
+        Number of jobs queued
+    """
+    from ai.generation_queue import get_generation_queue
+
+    app_config = get_config().app
+    if not app_config.get('pregenerate_enabled', False):
+        return 0
+
+    start_hour = int(app_config.get('pregenerate_start_hour', 0))
+    end_hour = int(app_config.get('pregenerate_end_hour', 24))
+    if not within_allowed_hours(start_hour, end_hour):
+        logger.debug("Outside pre-generation hours, skipping")
+        return 0
+
+    if get_circuit_breaker('openai').state == OPEN:
+        # Jobs would only fail fast; pick the tickets up once OpenAI is back
+        logger.info("OpenAI circuit is open, skipping pre-generation")
+        return 0
+
+    budget = _get_budget(float(app_config.get('pregenerate_tokens_per_hour', 100000)))
+    batch_size = int(app_config.get('pregenerate_batch_size', 5))
+
+    queued = 0
+    session = get_session()
+    try:
+        for ticket in get_tickets_for_pregeneration(session, batch_size):
+            conversations = get_conversations_for_ticket(session, ticket.id)
+            tokens = estimate_draft_tokens(ticket, conversations)
+
+            if not _take_from_budget(budget, tokens):
+                logger.info(f"Pre-generation token budget exhausted, {queued} drafts queued this run")
+                break
+
+            get_generation_queue().submit(ticket.id, 'response')
+            queued += 1
+            logger.info(f"Queued draft pre-generation for ticket {ticket.freshdesk_id} (~{tokens} tokens)")
+    except Exception as e:
+        logger.error(f"Error during draft pre-generation: {str(e)}")
+    finally:
+        session.close()
+
+    return queued
@@ -0,0 +1,130 @@
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from database.db_operations import (
+    get_session,
+    get_llm_cache_entry,
+    touch_llm_cache_entry,
+    save_llm_cache_entry,
+    delete_llm_cache_entry,
+    evict_llm_cache_entries
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+
+class ResponseCache:
+    """Persistent cache of OpenAI completions, stored in the app database.
+
+    Entries are keyed by a fingerprint of the full request (model, messages and
+    sampling parameters), expire after a TTL and are evicted least recently
+    used first once the cache grows beyond max_entries.
+    """
+
+    def __init__(self, ttl_seconds: float = 86400, max_entries: int = 1000):
+        """Initialize the cache.
+
+        Args:
+            ttl_seconds: How long a cached completion stays valid
+            max_entries: Maximum number of cached completions
+        """
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """Fingerprint a request payload.
+
+        Args:
+            payload: The chat completion request (model, messages and parameters)
+
+        Returns:
+            Hex SHA-256 digest of the canonical JSON encoding of the payload
+        """
+        canonical = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def _count(self, counter: str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_bypass(self) -> None:
+        """Count a lookup that was skipped because the caller asked to regenerate."""
+        self._count('bypasses')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached response.
+
+        Args:
+            key: Cache key from make_key()
+
+        Returns:
+            The cached API response, or None on a miss or an expired entry
+        """
+        session = get_session()
+        try:
+            entry = get_llm_cache_entry(session, key)
+            if entry is None:
+                self._count('misses')
+                return None
+
+            if entry.created_at < datetime.utcnow() - timedelta(seconds=self.ttl_seconds):
+                delete_llm_cache_entry(session, entry)
+                self._count('misses')
+                return None
+
+            touch_llm_cache_entry(session, entry)
+            self._count('hits')
+            return json.loads(entry.response)
+        except Exception as e:
+            # A broken cache must never break generation
+            logger.error(f"Error reading LLM cache: {str(e)}")
+            self._count('misses')
+            return None
+        finally:
+            session.close()
+
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        """Store a response and evict expired or excess entries.
+
+        Args:
+            key: Cache key from make_key()
+            response: The API response to cache
+        """
+        session = get_session()
+        try:
+            save_llm_cache_entry(session, key, json.dumps(response))
+            removed = evict_llm_cache_entries(
+                session,
+                datetime.utcnow() - timedelta(seconds=self.ttl_seconds),
+                self.max_entries
+            )
+            if removed:
+                logger.debug(f"Evicted {removed} LLM cache entries")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error writing LLM cache: {str(e)}")
+        finally:
+            session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters for this process."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'ttl_seconds': self.ttl_seconds,
+                'max_entries': self.max_entries
+            }
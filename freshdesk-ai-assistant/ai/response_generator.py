@@ -1,11 +1,106 @@
 import logging
 import re
 import json
-from ai.openai_client import generate_response
+from sqlalchemy.orm import object_session
+from ai.openai_client import get_openai_client, DEFAULT_SYSTEM_MESSAGE
+from ai.model_router import complete_task, select_model
+from utils.config import get_config
+from utils.text_processing import html_to_text, is_customer_sender, estimate_tokens, strip_quoted_text, truncate_to_tokens
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Token limits for conversation entries that don't fit the prompt budget in full
+CONDENSED_MESSAGE_TOKENS = 150
+MIN_MESSAGE_TOKENS = 50
+
+# Token limit for each answer from a similar ticket included as reference
+SIMILAR_ANSWER_TOKENS = 300
+
+# Guideline blocks shared by the single-purpose and combined prompts
+RESPONSE_GUIDELINES = """RESPONSE GUIDELINES:
+1. Start with a warm, personalized greeting using the customer's first name (given in the ticket details)
+2. Show genuine empathy by acknowledging their specific issue and any frustration they might be experiencing
+3. If this is a follow-up conversation, reference previous interactions to show continuity
+4. Provide a clear, concise explanation of the issue in non-technical language when possible
+5. Offer a comprehensive solution with step-by-step instructions that are easy to follow
+6. If multiple solutions are possible, present options and explain the pros/cons of each
+7. Anticipate follow-up questions and address them proactively
+8. End with a friendly closing that invites further questions if needed
+9. Use a conversational, natural tone throughout - write as a helpful human would, not as a formal or robotic response"""
+
+TECH_INSTRUCTIONS_GUIDELINES = """TECHNICAL INSTRUCTIONS GUIDELINES:
+1. Start with a brief summary of the issue from a technical perspective
+2. Provide a detailed technical analysis of the likely root cause(s)
+3. List specific diagnostic steps the agent should take to confirm the issue
+4. Provide step-by-step technical resolution instructions with commands or settings where applicable
+5. Include any relevant system requirements, dependencies, or compatibility issues
+6. Mention potential complications or edge cases to watch out for
+7. Suggest follow-up actions to prevent similar issues in the future
+8. Include any relevant documentation links or internal knowledge base references that would be helpful"""
+
+FOLLOW_UP_QUESTIONS_GUIDELINES = """FOLLOW-UP QUESTIONS GUIDELINES:
+1. Analyze the ticket to identify what critical information is missing to properly diagnose and resolve the issue
+2. Focus on technical details, environment information, or steps to reproduce that would help resolve the issue
+3. Generate 3-5 specific, clear follow-up questions that would help gather the missing information
+4. Questions should be direct, concise, and focused on one piece of information each
+5. Avoid yes/no questions - ask open-ended questions that elicit detailed responses
+6. Prioritize questions based on their importance for resolving the issue"""
+
+FORMATTING_INSTRUCTIONS = """IMPORTANT FORMATTING INSTRUCTIONS:
+- DO NOT use markdown formatting (no *, #, -, >, etc.)
+- Use plain text only with standard punctuation
+- For lists, use simple numbers or letters followed by a period or parenthesis
+- For emphasis, use capitalization or quotation marks instead of bold or italic formatting
+- Separate paragraphs with blank lines
+- For step-by-step instructions, use simple numbered lists (1., 2., 3., etc.)"""
+
+# Static instructions go in the system message and the ticket goes in the user
+# message, so every request for a task starts with the same bytes and the
+# provider can serve that prefix from its prompt cache. Nothing ticket-specific
+# may be added to these strings.
+RESPONSE_SYSTEM_MESSAGE = f"""{DEFAULT_SYSTEM_MESSAGE}
+
+You are responding to a customer support ticket. Your goal is to provide a helpful, friendly, and professional response that resolves the customer's issue while making them feel valued and understood.
+
+{RESPONSE_GUIDELINES}
+
+{FORMATTING_INSTRUCTIONS}
+
+Write a response that sounds like it comes from a real person who cares about solving the customer's problem. Be friendly but professional, and focus on being genuinely helpful."""
+
+TECH_INSTRUCTIONS_SYSTEM_MESSAGE = f"""{DEFAULT_SYSTEM_MESSAGE}
+
+You are creating internal technical instructions for another support agent who needs to solve a customer issue. Provide detailed technical steps and explanations that would help a fellow IT professional resolve the ticket efficiently.
+
+{TECH_INSTRUCTIONS_GUIDELINES}
+
+{FORMATTING_INSTRUCTIONS}
+
+Write detailed technical instructions that would be helpful for another IT professional. Focus on technical accuracy and thoroughness rather than customer-friendly language."""
+
+FOLLOW_UP_QUESTIONS_SYSTEM_MESSAGE = f"""{DEFAULT_SYSTEM_MESSAGE}
+
+You are analyzing a customer support ticket. Your task is to identify what information is missing to properly resolve the issue, and generate specific follow-up questions to ask the customer.
+
+{FOLLOW_UP_QUESTIONS_GUIDELINES}
+7. Format your response as a JSON array of strings, with each string being a follow-up question
+
+EXAMPLE RESPONSE FORMAT:
+[
+  "What version of the operating system are you currently using?",
+  "When did you first notice this issue occurring?",
+  "Have you made any recent changes to your system before the problem started?",
+  "Can you describe the exact error message you're receiving?",
+  "Have you already attempted any troubleshooting steps? If so, what were they?"
+]
+
+Generate only the JSON array of follow-up questions, nothing else."""
+
+def _has_text(text):
+    """Check that a generated text has usable content."""
+    return bool(text and remove_markdown(text).strip())
+
 def remove_markdown(text):
     """Remove markdown formatting from text.
     
@@ -45,12 +140,173 @@ def remove_markdown(text):
     
     return text
 
-def create_prompt(ticket, conversations):
-    """Create a prompt for OpenAI based on ticket details and conversation history.
+class MarkdownStreamCleaner:
+    """Apply remove_markdown to streamed text one complete line at a time.
+    
+    Markdown markers can only be recognised once a line is complete, so text is
+    buffered up to the next newline. Code fence lines are dropped, matching
+    what remove_markdown does with fenced blocks.
+    """
+    
+    def __init__(self):
+        self.buffer = ""
+    
+    def _clean_line(self, line):
+        if line.lstrip().startswith("```"):
+            return None
+        return remove_markdown(line)
+    
+    def feed(self, text):
+        """Add streamed text and return the cleaned text of any completed lines."""
+        self.buffer += text
+        if "\n" not in self.buffer:
+            return ""
+        
+        complete, self.buffer = self.buffer.rsplit("\n", 1)
+        cleaned = [self._clean_line(line) for line in complete.split("\n")]
+        return "".join(line + "\n" for line in cleaned if line is not None)
+    
+    def finish(self):
+        """Return the cleaned text of the final, unterminated line."""
+        line, self.buffer = self.buffer, ""
+        if not line:
+            return ""
+        return self._clean_line(line) or ""
+
+def history_token_budget(*prompt_parts):
+    """Work out how many tokens are left for conversation history.
+    
+    Args:
+        *prompt_parts: The rest of the request (system message, ticket details)
+        
+    Returns:
+        Tokens available for history within openai.max_prompt_tokens
+    """
+    max_prompt_tokens = int(get_config().openai.get('max_prompt_tokens', 6000))
+    used = sum(estimate_tokens(part) for part in prompt_parts)
+    return max(0, max_prompt_tokens - used)
+
+def conversation_entries(ticket, conversations):
+    """Get the (label, text) pair of each conversation entry as it appears in prompts.
+    
+    Quoted earlier messages and signatures are stripped from the text.
+    """
+    entries = []
+    for conv in conversations:
+        sender = conv.from_email or 'Unknown'
+        is_customer = conv.is_customer
+        if is_customer is None:
+            is_customer = is_customer_sender(conv.from_email, ticket.requester_email)
+        body_text = conv.body_text if conv.body_text is not None else html_to_text(conv.body)
+        role = "Customer" if is_customer else "Support Agent"
+        entries.append((f"--- {role} ({sender}) ---\n", strip_quoted_text(body_text) or 'No content'))
+    return entries
+
+def format_conversation_history(ticket, conversations, max_tokens=None):
+    """Format the conversation history section shared by all prompts.
+    
+    Uses the plain-text body and sender role stored at import time. Rows
+    imported before those columns existed are normalized on the fly. Quoted
+    earlier messages and signatures are stripped from every entry, and entries
+    covered by the ticket's rolling summary are replaced by the summary.
+    
+    With a token budget, messages are added newest first: the most recent
+    ones (openai.prompt_keep_recent_messages) are kept verbatim where they fit,
+    older ones are condensed to a short excerpt when they don't, and whatever
+    still doesn't fit is dropped. The newest message is always included.
+    
+    Args:
+        ticket: The ticket the conversations belong to
+        conversations: List of conversations for the ticket
+        max_tokens: Token budget for the whole section (None for no limit)
+        
+    Returns:
+        The conversation history section, or an empty string if there is none
+    """
+    if not conversations:
+        return ""
+    
+    entries = conversation_entries(ticket, conversations)
+    header = "CONVERSATION HISTORY (most recent last):\n"
+    
+    # Entries covered by the rolling summary are replaced by the summary itself
+    summary = getattr(ticket, 'summary', None)
+    if summary is not None and summary.last_conversation_id is not None:
+        conversation_ids = [conv.id for conv in conversations]
+        if summary.last_conversation_id in conversation_ids:
+            covered = conversation_ids.index(summary.last_conversation_id) + 1
+            header += f"[Summary of the first {covered} messages]\n{summary.summary}\n\n"
+            entries = entries[covered:]
+    
+    if max_tokens is None:
+        return header + "".join(f"{label}{text}\n\n" for label, text in entries)
+    
+    keep_recent = int(get_config().openai.get('prompt_keep_recent_messages', 2))
+    # Leave room for the note that says how many messages were left out
+    remaining = max_tokens - estimate_tokens(header) - estimate_tokens(f"[{len(entries)} earlier messages omitted]\n\n")
+    selected = []
+    for position, (label, text) in enumerate(reversed(entries)):
+        available = remaining - estimate_tokens(label) - 1
+        if estimate_tokens(text) > available:
+            # Recent messages are cut to the room that is left, older ones to a short excerpt
+            limit = available if position < keep_recent else min(available, CONDENSED_MESSAGE_TOKENS)
+            if position == 0:
+                limit = max(limit, MIN_MESSAGE_TOKENS)
+            elif limit < MIN_MESSAGE_TOKENS:
+                break
+            text = truncate_to_tokens(text, limit)
+        
+        entry = f"{label}{text}\n\n"
+        selected.append(entry)
+        remaining -= estimate_tokens(entry)
+    
+    omitted = len(entries) - len(selected)
+    if omitted:
+        logger.info(f"Omitted {omitted} of {len(entries)} conversation entries to fit the prompt budget")
+        header += f"[{omitted} earlier messages omitted]\n\n"
+    
+    return header + "".join(reversed(selected))
+
+def format_similar_answers(ticket):
+    """Format answers sent for similar resolved tickets as reference material.
+    
+    Controlled by openai.similar_context_count (0 disables it).
+    
+    Args:
+        ticket: The ticket being answered (must be attached to a session)
+        
+    Returns:
+        The reference section, or an empty string if there is nothing to add
+    """
+    count = int(get_config().openai.get('similar_context_count', 0))
+    if not count:
+        return ""
+    
+    try:
+        from ai.similarity_index import find_similar_tickets
+        
+        session = object_session(ticket)
+        similar = find_similar_tickets(session, ticket, count) if session is not None else []
+    except Exception as e:
+        logger.warning(f"Could not look up similar tickets: {str(e)}")
+        return ""
+    
+    if not similar:
+        return ""
+    
+    parts = ["ANSWERS SENT FOR SIMILAR RESOLVED TICKETS (for reference only; adapt them, don't copy):\n"]
+    for item in similar:
+        content = truncate_to_tokens(item['response']['content'], SIMILAR_ANSWER_TOKENS)
+        parts.append(f"--- {item['subject']} ---\n{content}\n\n")
+    return "".join(parts)
+
+def create_ticket_prompt(ticket, conversations, system_message):
+    """Create the ticket-specific user message that follows a static system message.
     
     Args:
         ticket: The ticket to create a prompt for
         conversations: List of conversations for the ticket
+        system_message: The system message the prompt will be sent with
         
     Returns:
         Prompt string for OpenAI
@@ -59,52 +315,26 @@ def create_prompt(ticket, conversations):
     first_name = ticket.requester_name.split()[0] if ticket.requester_name else "there"
     
     # Basic ticket information with context
-    prompt = f"""You are an experienced, empathetic IT support specialist responding to a customer support ticket. Your goal is to provide a helpful, friendly, and professional response that resolves the customer's issue while making them feel valued and understood.
-
-TICKET DETAILS:
+    prompt = f"""TICKET DETAILS:
 Subject: {ticket.subject}
 Description: {ticket.description or 'No description provided'}
 Customer: {ticket.requester_name} ({ticket.requester_email})
+Customer first name: {first_name}
 
 """
     
-    # Add conversation history if available with better formatting
-    if conversations:
-        prompt += "CONVERSATION HISTORY (most recent last):\n"
-        for i, conv in enumerate(conversations):
-            sender = conv.from_email or 'Unknown'
-            is_customer = sender.lower() == ticket.requester_email.lower() if ticket.requester_email else False
-            role = "Customer" if is_customer else "Support Agent"
-            prompt += f"--- {role} ({sender}) ---\n{conv.body or 'No content'}\n\n"
-    
-    # Add detailed instructions for a more human-like response
-    prompt += f"""
-RESPONSE GUIDELINES:
-1. Start with a warm, personalized greeting using the customer's first name ({first_name})
-2. Show genuine empathy by acknowledging their specific issue and any frustration they might be experiencing
-3. If this is a follow-up conversation, reference previous interactions to show continuity
-4. Provide a clear, concise explanation of the issue in non-technical language when possible
-5. Offer a comprehensive solution with step-by-step instructions that are easy to follow
-6. If multiple solutions are possible, present options and explain the pros/cons of each
-7. Anticipate follow-up questions and address them proactively
-8. End with a friendly closing that invites further questions if needed
-9. Use a conversational, natural tone throughout - write as a helpful human would, not as a formal or robotic response
-
-IMPORTANT FORMATTING INSTRUCTIONS:
-- DO NOT use markdown formatting (no *, #, -, >, etc.)
-- Use plain text only with standard punctuation
-- For lists, use simple numbers or letters followed by a period or parenthesis
-- For emphasis, use capitalization or quotation marks instead of bold or italic formatting
-- Separate paragraphs with blank lines
-- For step-by-step instructions, use simple numbered lists (1., 2., 3., etc.)
-
-Write a response that sounds like it comes from a real person who cares about solving the customer's problem. Be friendly but professional, and focus on being genuinely helpful.
-"""
+    # Add answers that were sent for similar tickets, if enabled
+    prompt += format_similar_answers(ticket)
+    
+    # Add conversation history, fitted into what is left of the prompt token budget
+    prompt += format_conversation_history(ticket, conversations, history_token_budget(system_message, prompt))
     
     return prompt
 
-def create_tech_instructions_prompt(ticket, conversations):
-    """Create a prompt for generating technical instructions for support agents.
+def create_prompt(ticket, conversations):
+    """Create a prompt for OpenAI based on ticket details and conversation history.
+    
+    Sent with RESPONSE_SYSTEM_MESSAGE.
     
     Args:
         ticket: The ticket to create a prompt for
@@ -113,56 +343,29 @@ def create_tech_instructions_prompt(ticket, conversations):
     Returns:
         Prompt string for OpenAI
     """
-    # Basic ticket information with context
-    prompt = f"""You are an experienced IT support specialist creating internal technical instructions for another support agent who needs to solve this customer issue. Provide detailed technical steps and explanations that would help a fellow IT professional resolve this ticket efficiently.
-
-TICKET DETAILS:
-Subject: {ticket.subject}
-Description: {ticket.description or 'No description provided'}
-Customer: {ticket.requester_name} ({ticket.requester_email})
+    return create_ticket_prompt(ticket, conversations, RESPONSE_SYSTEM_MESSAGE)
 
-"""
+def create_tech_instructions_prompt(ticket, conversations):
+    """Create a prompt for generating technical instructions for support agents.
     
-    # Add conversation history if available with better formatting
-    if conversations:
-        prompt += "CONVERSATION HISTORY (most recent last):\n"
-        for i, conv in enumerate(conversations):
-            sender = conv.from_email or 'Unknown'
-            is_customer = sender.lower() == ticket.requester_email.lower() if ticket.requester_email else False
-            role = "Customer" if is_customer else "Support Agent"
-            prompt += f"--- {role} ({sender}) ---\n{conv.body or 'No content'}\n\n"
-    
-    # Add detailed instructions for technical guidance
-    prompt += """
-TECHNICAL INSTRUCTIONS GUIDELINES:
-1. Start with a brief summary of the issue from a technical perspective
-2. Provide a detailed technical analysis of the likely root cause(s)
-3. List specific diagnostic steps the agent should take to confirm the issue
-4. Provide step-by-step technical resolution instructions with commands or settings where applicable
-5. Include any relevant system requirements, dependencies, or compatibility issues
-6. Mention potential complications or edge cases to watch out for
-7. Suggest follow-up actions to prevent similar issues in the future
-8. Include any relevant documentation links or internal knowledge base references that would be helpful
-
-IMPORTANT FORMATTING INSTRUCTIONS:
-- DO NOT use markdown formatting (no *, #, -, >, etc.)
-- Use plain text only with standard punctuation
-- For lists, use simple numbers or letters followed by a period or parenthesis
-- For emphasis, use capitalization or quotation marks instead of bold or italic formatting
-- Separate paragraphs with blank lines
-- For step-by-step instructions, use simple numbered lists (1., 2., 3., etc.)
-
-Write detailed technical instructions that would be helpful for another IT professional. Focus on technical accuracy and thoroughness rather than customer-friendly language.
-"""
+    Sent with TECH_INSTRUCTIONS_SYSTEM_MESSAGE.
     
-    return prompt
+    Args:
+        ticket: The ticket to create a prompt for
+        conversations: List of conversations for the ticket
+        
+    Returns:
+        Prompt string for OpenAI
+    """
+    return create_ticket_prompt(ticket, conversations, TECH_INSTRUCTIONS_SYSTEM_MESSAGE)
 
-def generate_tech_instructions(ticket, conversations):
+def generate_tech_instructions(ticket, conversations, regenerate=False):
     """Generate technical instructions for a ticket.
     
     Args:
         ticket: The ticket to generate instructions for
         conversations: List of conversations for the ticket
+        regenerate: Bypass the response cache and always call the API
         
     Returns:
         The generated technical instructions text
@@ -172,7 +375,9 @@ def generate_tech_instructions(ticket, conversations):
         prompt = create_tech_instructions_prompt(ticket, conversations)
         
         # Generate response
-        response_text = generate_response(prompt)
+        response_text = complete_task('tech_instructions', prompt, TECH_INSTRUCTIONS_SYSTEM_MESSAGE, validate=_has_text,
+                                      conversation_count=len(conversations), temperature=0.7, max_tokens=1000,
+                                      regenerate=regenerate)
         
         # Remove any markdown formatting that might still be present
         clean_response = remove_markdown(response_text)
@@ -185,6 +390,8 @@ def generate_tech_instructions(ticket, conversations):
 def create_follow_up_questions_prompt(ticket, conversations):
     """Create a prompt for generating follow-up questions when ticket lacks clarity.
     
+    Sent with FOLLOW_UP_QUESTIONS_SYSTEM_MESSAGE.
+    
     Args:
         ticket: The ticket to create a prompt for
         conversations: List of conversations for the ticket
@@ -192,49 +399,7 @@ def create_follow_up_questions_prompt(ticket, conversations):
     Returns:
         Prompt string for OpenAI
     """
-    # Basic ticket information with context
-    prompt = f"""You are an experienced IT support specialist analyzing a customer support ticket. Your task is to identify what information is missing to properly resolve this issue, and generate specific follow-up questions to ask the customer.
-
-TICKET DETAILS:
-Subject: {ticket.subject}
-Description: {ticket.description or 'No description provided'}
-Customer: {ticket.requester_name} ({ticket.requester_email})
-
-"""
-    
-    # Add conversation history if available with better formatting
-    if conversations:
-        prompt += "CONVERSATION HISTORY (most recent last):\n"
-        for i, conv in enumerate(conversations):
-            sender = conv.from_email or 'Unknown'
-            is_customer = sender.lower() == ticket.requester_email.lower() if ticket.requester_email else False
-            role = "Customer" if is_customer else "Support Agent"
-            prompt += f"--- {role} ({sender}) ---\n{conv.body or 'No content'}\n\n"
-    
-    # Add detailed instructions for generating follow-up questions
-    prompt += """
-FOLLOW-UP QUESTIONS GUIDELINES:
-1. Analyze the ticket to identify what critical information is missing to properly diagnose and resolve the issue
-2. Focus on technical details, environment information, or steps to reproduce that would help resolve the issue
-3. Generate 3-5 specific, clear follow-up questions that would help gather the missing information
-4. Questions should be direct, concise, and focused on one piece of information each
-5. Avoid yes/no questions - ask open-ended questions that elicit detailed responses
-6. Prioritize questions based on their importance for resolving the issue
-7. Format your response as a JSON array of strings, with each string being a follow-up question
-
-EXAMPLE RESPONSE FORMAT:
-[
-  "What version of the operating system are you currently using?",
-  "When did you first notice this issue occurring?",
-  "Have you made any recent changes to your system before the problem started?",
-  "Can you describe the exact error message you're receiving?",
-  "Have you already attempted any troubleshooting steps? If so, what were they?"
-]
-
-Generate only the JSON array of follow-up questions, nothing else.
-"""
-    
-    return prompt
+    return create_ticket_prompt(ticket, conversations, FOLLOW_UP_QUESTIONS_SYSTEM_MESSAGE)
 
 def extract_follow_up_questions(response_text):
     """Extract follow-up questions from the AI response.
@@ -273,12 +438,13 @@ def extract_follow_up_questions(response_text):
         logger.error(f"Error extracting follow-up questions: {str(e)}")
         return None
 
-def generate_follow_up_questions(ticket, conversations):
+def generate_follow_up_questions(ticket, conversations, regenerate=False):
     """Generate follow-up questions for a ticket that lacks clarity.
     
     Args:
         ticket: The ticket to generate questions for
         conversations: List of conversations for the ticket
+        regenerate: Bypass the response cache and always call the API
         
     Returns:
         A JSON string containing an array of follow-up questions, or None if generation fails
@@ -288,7 +454,10 @@ def generate_follow_up_questions(ticket, conversations):
         prompt = create_follow_up_questions_prompt(ticket, conversations)
         
         # Generate response
-        response_text = generate_response(prompt)
+        response_text = complete_task('follow_up_questions', prompt, FOLLOW_UP_QUESTIONS_SYSTEM_MESSAGE,
+                                      validate=lambda text: extract_follow_up_questions(text) is not None,
+                                      conversation_count=len(conversations), temperature=0.7, max_tokens=1000,
+                                      regenerate=regenerate)
         
         # Extract follow-up questions
         follow_up_questions = extract_follow_up_questions(response_text)
@@ -298,12 +467,13 @@ def generate_follow_up_questions(ticket, conversations):
         logger.error(f"Error generating follow-up questions: {str(e)}")
         return None
 
-def generate_ticket_response(ticket, conversations):
+def generate_ticket_response(ticket, conversations, regenerate=False):
     """Generate a response for a ticket.
     
     Args:
         ticket: The ticket to generate a response for
         conversations: List of conversations for the ticket
+        regenerate: Bypass the response cache and always call the API
         
     Returns:
         The generated response text
@@ -313,7 +483,9 @@ def generate_ticket_response(ticket, conversations):
         prompt = create_prompt(ticket, conversations)
         
         # Generate response
-        response_text = generate_response(prompt)
+        response_text = complete_task('response', prompt, RESPONSE_SYSTEM_MESSAGE, validate=_has_text,
+                                      conversation_count=len(conversations), temperature=0.7, max_tokens=1000,
+                                      regenerate=regenerate)
         
         # Remove any markdown formatting that might still be present
         clean_response = remove_markdown(response_text)
@@ -322,3 +494,222 @@ def generate_ticket_response(ticket, conversations):
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         return "I apologize, but I'm currently unable to generate a response for your ticket. A support representative will review your ticket manually as soon as possible."
+
+def combined_system_message(include_response=True, include_tech_instructions=False):
+    """Build the static system message for a combined generation.
+    
+    The text depends only on the requested tasks, so each combination is
+    byte-identical across tickets.
+    
+    Args:
+        include_response: Whether to ask for a customer response draft
+        include_tech_instructions: Whether to ask for technical instructions for agents
+        
+    Returns:
+        System message string for OpenAI
+    """
+    message = f"""{DEFAULT_SYSTEM_MESSAGE}
+
+You are handling a customer support ticket. Complete each of the tasks below and return all results together as a single JSON object.
+"""
+    
+    keys = []
+    if include_response:
+        keys.append("response")
+        message += f"""
+TASK "response": Write a reply to the customer that resolves their issue and makes them feel valued and understood.
+{RESPONSE_GUIDELINES}
+"""
+    
+    keys.append("follow_up_questions")
+    message += f"""
+TASK "follow_up_questions": List the questions to ask the customer to get any information that is still missing.
+{FOLLOW_UP_QUESTIONS_GUIDELINES}
+7. Return an empty array if no information is missing
+"""
+    
+    if include_tech_instructions:
+        keys.append("tech_instructions")
+        message += f"""
+TASK "tech_instructions": Write internal technical instructions for another support agent who needs to solve this issue. Focus on technical accuracy and thoroughness rather than customer-friendly language.
+{TECH_INSTRUCTIONS_GUIDELINES}
+"""
+    
+    message += f"""
+{FORMATTING_INSTRUCTIONS}
+(These formatting rules apply to the text inside each JSON string value.)
+
+Return only a JSON object with exactly these keys: {", ".join(keys)}. "follow_up_questions" must be an array of strings; every other value must be a string."""
+    
+    return message
+
+def create_combined_prompt(ticket, conversations, include_response=True, include_tech_instructions=False):
+    """Create a prompt that asks for several generation tasks in one structured response.
+    
+    Sent with combined_system_message() for the same tasks.
+    
+    Args:
+        ticket: The ticket to create a prompt for
+        conversations: List of conversations for the ticket
+        include_response: Whether to ask for a customer response draft
+        include_tech_instructions: Whether to ask for technical instructions for agents
+        
+    Returns:
+        Prompt string for OpenAI
+    """
+    return create_ticket_prompt(ticket, conversations,
+                                combined_system_message(include_response, include_tech_instructions))
+
+def combined_response_format(include_response=True, include_tech_instructions=False):
+    """Build the JSON-schema response_format for a combined generation.
+    
+    Args:
+        include_response: Whether the schema includes the customer response
+        include_tech_instructions: Whether the schema includes tech instructions
+        
+    Returns:
+        A response_format dict for the chat completions API
+    """
+    properties = {}
+    if include_response:
+        properties["response"] = {"type": "string"}
+    properties["follow_up_questions"] = {"type": "array", "items": {"type": "string"}}
+    if include_tech_instructions:
+        properties["tech_instructions"] = {"type": "string"}
+    
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "ticket_generation",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": properties,
+                "required": list(properties.keys()),
+                "additionalProperties": False
+            }
+        }
+    }
+
+def parse_combined_response(response_text, include_response=True, include_tech_instructions=False):
+    """Parse and validate the JSON returned by a combined generation.
+    
+    Unlike extract_follow_up_questions, nothing is guessed: the text must be a
+    JSON object with exactly the requested keys and value types.
+    
+    Args:
+        response_text: The raw response from the AI
+        include_response: Whether a customer response is expected
+        include_tech_instructions: Whether tech instructions are expected
+        
+    Returns:
+        A dict with 'response', 'follow_up_questions' (JSON string or None) and
+        'tech_instructions' keys, or None if the output is invalid
+    """
+    try:
+        data = json.loads(response_text)
+    except (TypeError, ValueError) as e:
+        logger.warning(f"Combined generation returned invalid JSON: {str(e)}")
+        return None
+    
+    expected_keys = {"follow_up_questions"}
+    if include_response:
+        expected_keys.add("response")
+    if include_tech_instructions:
+        expected_keys.add("tech_instructions")
+    
+    if not isinstance(data, dict) or set(data.keys()) != expected_keys:
+        logger.warning("Combined generation returned an unexpected JSON structure")
+        return None
+    
+    for key in expected_keys - {"follow_up_questions"}:
+        if not isinstance(data[key], str) or not data[key].strip():
+            logger.warning(f"Combined generation returned an empty or invalid '{key}'")
+            return None
+    
+    questions = data["follow_up_questions"]
+    if not isinstance(questions, list) or not all(isinstance(q, str) for q in questions):
+        logger.warning("Combined generation returned invalid follow-up questions")
+        return None
+    questions = [q.strip() for q in questions if q.strip()]
+    
+    return {
+        "response": remove_markdown(data["response"]) if include_response else None,
+        "follow_up_questions": json.dumps(questions) if questions else None,
+        "tech_instructions": remove_markdown(data["tech_instructions"]) if include_tech_instructions else None
+    }
+
+def generate_combined_response(ticket, conversations, include_response=True, include_tech_instructions=False,
+                                regenerate=False):
+    """Generate a response, follow-up questions and optionally tech instructions in one call.
+    
+    Falls back to the single-purpose generators if the structured call fails or
+    returns output that doesn't validate.
+    
+    Args:
+        ticket: The ticket to generate for
+        conversations: List of conversations for the ticket
+        include_response: Whether to generate a customer response
+        include_tech_instructions: Whether to generate tech instructions
+        regenerate: Bypass the response cache and always call the API
+        
+    Returns:
+        A dict with 'response', 'follow_up_questions' and 'tech_instructions' keys
+    """
+    try:
+        prompt = create_combined_prompt(ticket, conversations, include_response, include_tech_instructions)
+        response_text = complete_task(
+            'combined_tech_instructions' if include_tech_instructions else 'combined',
+            prompt,
+            combined_system_message(include_response, include_tech_instructions),
+            validate=lambda text: parse_combined_response(text, include_response, include_tech_instructions) is not None,
+            conversation_count=len(conversations),
+            temperature=0.7,
+            max_tokens=2000 if include_tech_instructions else 1500,
+            response_format=combined_response_format(include_response, include_tech_instructions),
+            regenerate=regenerate
+        )
+        result = parse_combined_response(response_text, include_response, include_tech_instructions)
+        if result is not None:
+            return result
+    except Exception as e:
+        logger.warning(f"Combined generation failed: {str(e)}")
+    
+    logger.info("Falling back to separate generation calls")
+    return {
+        "response": generate_ticket_response(ticket, conversations, regenerate) if include_response else None,
+        "follow_up_questions": generate_follow_up_questions(ticket, conversations, regenerate),
+        "tech_instructions": generate_tech_instructions(ticket, conversations, regenerate) if include_tech_instructions else None
+    }
+
+def stream_ticket_response(ticket, conversations, regenerate=False):
+    """Generate a response for a ticket, yielding cleaned text as it arrives.
+    
+    Args:
+        ticket: The ticket to generate a response for
+        conversations: List of conversations for the ticket
+        regenerate: Bypass the response cache and always call the API
+        
+    Yields:
+        Chunks of plain-text response
+        
+    Raises:
+        OpenAIError: If the completion fails
+    """
+    prompt = create_prompt(ticket, conversations)
+    cleaner = MarkdownStreamCleaner()
+    
+    # Streamed text can't be validated before it is shown, so there is no escalation here
+    model, _ = select_model('response', estimate_tokens(RESPONSE_SYSTEM_MESSAGE) + estimate_tokens(prompt), len(conversations))
+    
+    for delta in get_openai_client().stream_chat([
+        {"role": "system", "content": RESPONSE_SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ], model=model, temperature=0.7, max_tokens=1000, regenerate=regenerate):
+        text = cleaner.feed(delta)
+        if text:
+            yield text
+    
+    text = cleaner.finish()
+    if text:
+        yield text
@@ -0,0 +1,250 @@
+import re
+import zlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from database.db_operations import (
+    get_session,
+    get_all_tickets,
+    get_sent_responses_by_ticket,
+    get_latest_sent_response
+)
+from database.models import Ticket
+from utils.config import get_config
+from utils.text_processing import html_to_text
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Words too common in support tickets to say anything about similarity
+STOP_WORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'can', 'could', 'do', 'does', 'for', 'from',
+    'had', 'has', 'have', 'hello', 'hi', 'how', 'i', 'if', 'in', 'is', 'it', 'its', 'me', 'my', 'no', 'not',
+    'of', 'on', 'or', 'our', 'please', 'regards', 'so', 'thank', 'thanks', 'that', 'the', 'their', 'them',
+    'there', 'this', 'to', 'was', 'we', 'were', 'what', 'when', 'will', 'with', 'would', 'you', 'your'
+}
+
+WORD_PATTERN = re.compile(r"[a-z0-9][a-z0-9'._-]*[a-z0-9]|[a-z0-9]")
+
+
+def tokenize(text: str) -> List[str]:
+    """Split text into lowercase terms: words without stop words, plus adjacent word pairs."""
+    words = [word for word in WORD_PATTERN.findall(text.lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class SimilarityIndex:
+    """In-memory TF-IDF index of tickets using the hashing trick.
+
+    Each ticket is a row of log-scaled term counts hashed into a fixed number
+    of dimensions (with a sign hash to cancel out collisions). Document
+    frequencies are kept per dimension, so tickets can be added or replaced
+    one at a time; the IDF-weighted, normalized matrix is rebuilt lazily on the
+    next query after a change.
+    """
+
+    def __init__(self, dimensions: int = 2048):
+        """Initialize an empty index.
+
+        Args:
+            dimensions: Number of hash buckets per vector
+        """
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self._counts = np.zeros((0, dimensions), dtype=np.float32)
+        self._resolved = np.zeros(0, dtype=bool)
+        self._ticket_ids: List[int] = []
+        self._rows: Dict[int, int] = {}
+        self._doc_freq = np.zeros(dimensions, dtype=np.float32)
+        self._weighted = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        return len(self._ticket_ids)
+
+    def vectorize(self, text: str) -> np.ndarray:
+        """Hash the terms of a text into a log-scaled term count vector."""
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term in tokenize(text):
+            digest = zlib.crc32(term.encode('utf-8'))
+            sign = 1.0 if digest & 0x80000000 else -1.0
+            vector[digest % self.dimensions] += sign
+        # Sublinear term frequency, keeping the sign of each bucket
+        return np.sign(vector) * np.log1p(np.abs(vector))
+
+    def add(self, ticket_id: int, text: str, resolved: bool) -> None:
+        """Add a ticket to the index, replacing its previous entry.
+
+        Args:
+            ticket_id: The database ID of the ticket
+            text: Subject, description and sent answer of the ticket
+            resolved: Whether the ticket has a sent answer that could be reused
+        """
+        vector = self.vectorize(text)
+
+        with self._lock:
+            row = self._rows.get(ticket_id)
+            if row is None:
+                row = len(self._ticket_ids)
+                self._rows[ticket_id] = row
+                self._ticket_ids.append(ticket_id)
+                if row >= self._counts.shape[0]:
+                    # Grow the storage geometrically so adds stay cheap
+                    capacity = max(64, self._counts.shape[0] * 2)
+                    counts = np.zeros((capacity, self.dimensions), dtype=np.float32)
+                    counts[:row] = self._counts[:row]
+                    resolved_flags = np.zeros(capacity, dtype=bool)
+                    resolved_flags[:row] = self._resolved[:row]
+                    self._counts, self._resolved = counts, resolved_flags
+            else:
+                self._doc_freq -= self._counts[row] != 0
+
+            self._counts[row] = vector
+            self._resolved[row] = resolved
+            self._doc_freq += vector != 0
+            self._weighted = None
+
+    def _idf(self) -> np.ndarray:
+        count = len(self._ticket_ids)
+        return np.log((1.0 + count) / (1.0 + self._doc_freq)) + 1.0
+
+    def query(self, text: str, k: int = 5, exclude_ticket_id: Optional[int] = None,
+              resolved_only: bool = True, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """Find the tickets most similar to a text.
+
+        Args:
+            text: Text to compare against the index
+            k: Maximum number of results
+            exclude_ticket_id: Ticket to leave out (usually the one being viewed)
+            resolved_only: Only return tickets with a sent answer
+            min_score: Minimum cosine similarity
+
+        Returns:
+            List of {'ticket_id', 'score'} dicts, best match first
+        """
+        query_vector = self.vectorize(text)
+
+        with self._lock:
+            count = len(self._ticket_ids)
+            if not count or not query_vector.any():
+                return []
+
+            idf = self._idf()
+            if self._weighted is None:
+                weighted = self._counts[:count] * idf
+                norms = np.linalg.norm(weighted, axis=1)
+                norms[norms == 0] = 1.0
+                self._weighted = weighted / norms[:, None]
+            weighted = self._weighted
+            resolved = self._resolved[:count].copy()
+            ticket_ids = list(self._ticket_ids)
+            exclude_row = self._rows.get(exclude_ticket_id)
+
+        query_vector = query_vector * idf
+        norm = np.linalg.norm(query_vector)
+        if norm == 0:
+            return []
+        scores = weighted @ (query_vector / norm)
+
+        if resolved_only:
+            scores[~resolved] = -1.0
+        if exclude_row is not None:
+            scores[exclude_row] = -1.0
+
+        k = min(k, count)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {'ticket_id': ticket_ids[row], 'score': round(float(scores[row]), 4)}
+            for row in top
+            if scores[row] > max(min_score, 0.0)
+        ]
+
+
+def ticket_text(ticket: Ticket, sent_content: Optional[str] = None) -> str:
+    """Get the text a ticket is indexed under."""
+    parts = [ticket.subject or '', html_to_text(ticket.description)]
+    if sent_content:
+        parts.append(sent_content)
+    return "\n".join(parts)
+
+
+def query_text(ticket: Ticket) -> str:
+    """Get the text used to look up tickets similar to this one."""
+    return "\n".join([ticket.subject or '', html_to_text(ticket.description)])
+
+
+# Process-wide index, loaded from the database on first use
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_similarity_index() -> SimilarityIndex:
+    """Get the process-wide similarity index, building it from the database if needed."""
+    global _index
+
+    with _index_lock:
+        if _index is None:
+            _index = SimilarityIndex(int(get_config().app.get('similarity_dimensions', 2048)))
+        if not _index.loaded:
+            session = get_session()
+            try:
+                sent_responses = get_sent_responses_by_ticket(session)
+                for ticket in get_all_tickets(session):
+                    response = sent_responses.get(ticket.id)
+                    _index.add(ticket.id, ticket_text(ticket, response.final_content if response else None),
+                               response is not None)
+                _index.loaded = True
+                logger.info(f"Similarity index built with {len(_index)} tickets")
+            finally:
+                session.close()
+        return _index
+
+
+def index_ticket(session, ticket_id: int) -> None:
+    """Add or refresh one ticket in the similarity index (after an import or a send)."""
+    ticket = session.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if ticket is None:
+        return
+
+    response = get_latest_sent_response(session, ticket.id)
+    get_similarity_index().add(ticket.id, ticket_text(ticket, response.final_content if response else None),
+                               response is not None)
+
+
+def find_similar_tickets(session, ticket: Ticket, k: int = 5) -> List[Dict[str, Any]]:
+    """Find resolved tickets similar to a ticket, with the answer that was sent for each.
+
+    Args:
+        session: Database session
+        ticket: The ticket to find matches for
+        k: Maximum number of results
+
+    Returns:
+        List of dicts with ticket_id, freshdesk_id, subject, score and the sent response
+    """
+    min_score = float(get_config().app.get('similarity_min_score', 0.2))
+    matches = get_similarity_index().query(query_text(ticket), k, exclude_ticket_id=ticket.id, min_score=min_score)
+
+    results = []
+    for match in matches:
+        similar = session.query(Ticket).filter(Ticket.id == match['ticket_id']).first()
+        response = get_latest_sent_response(session, match['ticket_id']) if similar else None
+        if response is None:
+            continue
+        results.append({
+            'ticket_id': similar.id,
+            'freshdesk_id': similar.freshdesk_id,
+            'subject': similar.subject,
+            'requester_name': similar.requester_name,
+            'score': match['score'],
+            'response': {
+                'id': response.id,
+                'content': response.final_content,
+                'sent_at': response.sent_at.isoformat() if response.sent_at else None
+            }
+        })
+    return results
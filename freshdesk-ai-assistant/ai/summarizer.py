@@ -0,0 +1,127 @@
+import logging
+from typing import List, Optional
+
+from ai.model_router import complete_task
+from database.db_operations import get_conversations_for_ticket, get_ticket_summary, save_ticket_summary
+from utils.config import get_config
+from utils.text_processing import estimate_tokens, truncate_to_tokens
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Maximum tokens of new messages folded into the summary per model call
+SUMMARY_INPUT_TOKENS = 3000
+
+
+def create_summary_prompt(ticket, previous_summary: Optional[str], new_messages: str, max_words: int) -> str:
+    """Create a prompt that folds new conversation entries into the running summary.
+
+    Args:
+        ticket: The ticket being summarized
+        previous_summary: The current summary, or None for the first one
+        new_messages: Formatted conversation entries not yet covered by the summary
+        max_words: Length limit for the updated summary
+
+    Returns:
+        Prompt string for OpenAI
+    """
+    prompt = f"""You are maintaining a running summary of a customer support ticket, so that later replies can be written without re-reading the whole thread.
+
+TICKET DETAILS:
+Subject: {ticket.subject}
+Customer: {ticket.requester_name} ({ticket.requester_email})
+
+"""
+
+    if previous_summary:
+        prompt += f"""SUMMARY SO FAR:
+{previous_summary}
+
+"""
+
+    prompt += f"""NEW MESSAGES:
+{new_messages}
+Write an updated summary that covers the summary so far and the new messages. Keep the customer's problem, their environment and any error messages, what has been tried or suggested and with what result, open questions and any commitments made by either side. Drop greetings, pleasantries and repetition.
+
+Use plain text only, at most {max_words} words.
+"""
+
+    return prompt
+
+
+def _batches(entries: List[str], max_tokens: int) -> List[List[str]]:
+    """Group formatted entries into batches of at most max_tokens each."""
+    batches = []
+    current = []
+    current_tokens = 0
+    for entry in entries:
+        entry = truncate_to_tokens(entry, max_tokens)
+        tokens = estimate_tokens(entry)
+        if current and current_tokens + tokens > max_tokens:
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(entry)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def update_ticket_summary(session, ticket):
+    """Fold conversation entries that have aged out of the recent window into the ticket summary.
+
+    Only entries the summary doesn't cover yet are sent, together with the
+    previous summary, so the cost of an update depends on what was added since
+    the last one rather than on the length of the thread.
+
+    Args:
+        session: Database session
+        ticket: The ticket to summarize
+
+    Returns:
+        The ticket's TicketSummary, or None if the ticket is too short to need one
+
+    Raises:
+        OpenAIError: If a summarization call fails
+    """
+    from ai.response_generator import conversation_entries
+
+    openai_config = get_config().openai
+    summarize_after = int(openai_config.get('summarize_after_messages', 6))
+    keep_recent = int(openai_config.get('prompt_keep_recent_messages', 2))
+    max_tokens = int(openai_config.get('summary_max_tokens', 400))
+
+    ticket_summary = get_ticket_summary(session, ticket.id)
+    conversations = get_conversations_for_ticket(session, ticket.id)
+    if not summarize_after or len(conversations) <= summarize_after:
+        return ticket_summary
+
+    # The most recent messages are always sent verbatim, so they are never summarized
+    older = conversations[:-keep_recent] if keep_recent else conversations
+    older_ids = [conv.id for conv in older]
+
+    previous_summary = None
+    start = 0
+    if ticket_summary is not None:
+        if ticket_summary.last_conversation_id in older_ids:
+            previous_summary = ticket_summary.summary
+            start = older_ids.index(ticket_summary.last_conversation_id) + 1
+        elif ticket_summary.last_conversation_id in {conv.id for conv in conversations}:
+            # Covers more than the current window (keep_recent was lowered); still usable
+            return ticket_summary
+        else:
+            logger.info(f"Summary of ticket {ticket.freshdesk_id} no longer matches its conversations, rebuilding")
+
+    new_conversations = older[start:]
+    if not new_conversations:
+        return ticket_summary
+
+    summary = previous_summary
+    entries = [f"{label}{text}\n\n" for label, text in conversation_entries(ticket, new_conversations)]
+    for batch in _batches(entries, SUMMARY_INPUT_TOKENS):
+        prompt = create_summary_prompt(ticket, summary, "".join(batch), max_tokens * 3 // 4)
+        summary = complete_task('summary', prompt, temperature=0.3, max_tokens=max_tokens).strip()
+
+    logger.info(f"Summarized {len(new_conversations)} new conversation entries for ticket {ticket.freshdesk_id}")
+    return save_ticket_summary(session, ticket.id, summary, new_conversations[-1].id, start + len(new_conversations))
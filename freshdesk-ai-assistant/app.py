@@ -2,6 +2,8 @@
 import os
 import sys
 import json
+import time
+import importlib
 import logging
 from datetime import datetime
 
@@ -13,27 +15,38 @@ if sys.version_info >= (3, 13):
     print("Warning: Python 3.13 may have compatibility issues with SQLAlchemy.")
     print("Proceeding anyway for testing purposes, but expect errors.")
 
-from flask import Flask, render_template, flash, redirect, url_for
-from markupsafe import Markup
-
-from database.models import init_db
-from web.routes import bp as main_bp
-from utils.scheduler import setup_ticket_processing_jobs
 from utils.logger import setup_logger
+from utils.config import get_config
+
+logger = logging.getLogger(__name__)
 
-# Set up logging
-logger = setup_logger(__name__)
+# Modules that register metrics at import time but are otherwise only imported on first use
+METRICS_MODULES = ('ai.openai_client', 'freshdesk.api_client', 'freshdesk.ticket_importer')
 
 def create_app():
-    """Create and configure the Flask application."""
+    """Create and configure the Flask application.
+    
+    Flask, the database layer and the routes are imported here rather than at
+    module level, so importing this module stays cheap for CLI tools and workers.
+    """
+    from flask import Flask, render_template, request, g
+    from markupsafe import Markup
+    
+    from database.models import init_db
+    from web.routes import bp as main_bp
+    from utils.metrics import histogram
+    from utils.tracing import ERROR, attach_span, detach_span, get_tracer
+    from database.query_profiler import current_profile, end_profile, profiling_enabled, report_profile, start_profile
+    
+    # Set up console and file logging
+    setup_logger()
+    
     app = Flask(__name__, 
                 template_folder='web/templates',
                 static_folder='static')
     
     # Load configuration
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-    with open(config_path, 'r') as f:
-        config = json.load(f)
+    config = get_config()
     
     # Configure Flask
     app.config['SECRET_KEY'] = config['app'].get('secret_key', 'dev-key-change-this')
@@ -45,6 +58,54 @@ def create_app():
     # Initialize the database
     init_db()
     
+    # Metrics are registered when their module is imported; load the ones the routes import lazily,
+    # so /metrics lists them from the first scrape
+    for module in METRICS_MODULES:
+        importlib.import_module(module)
+    
+    # Route latency, labelled by endpoint name so URL parameters don't multiply the series
+    request_seconds = histogram('http_request_seconds', 'Latency of web requests', ('method', 'endpoint', 'status'))
+    
+    # Requests that aren't traced or query-profiled: static files, the monitoring pages themselves and long-lived streams
+    untraced_endpoints = {'static', 'main.metrics', 'main.admin_traces', 'main.traces_api', 'main.trace_api',
+                          'main.job_stream_api', 'main.stream_response_api'}
+    
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        if request.endpoint not in untraced_endpoints:
+            rule = request.url_rule.rule if request.url_rule else request.path
+            span = get_tracer().start_span(f"{request.method} {rule}", {'http.method': request.method, 'http.target': request.full_path})
+            g.request_span = (span, attach_span(span))
+            if profiling_enabled():
+                g.query_profile_token = start_profile(f"{request.method} {rule}")
+    
+    @app.after_request
+    def record_request_latency(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            request_seconds.observe(time.perf_counter() - started, method=request.method,
+                                    endpoint=request.endpoint or 'unmatched', status=response.status_code)
+        if 'request_span' in g:
+            g.request_span[0].set_attribute('http.status_code', response.status_code)
+        if 'query_profile_token' in g:
+            response.headers['X-Query-Count'] = str(current_profile().queries)
+        return response
+    
+    @app.teardown_request
+    def end_request_span(exc):
+        request_span = g.pop('request_span', None)
+        if request_span is not None:
+            span, token = request_span
+            if exc is not None:
+                span.record_exception(exc)
+                span.set_status(ERROR, str(exc))
+            detach_span(token)
+            span.end()
+        profile_token = g.pop('query_profile_token', None)
+        if profile_token is not None:
+            report_profile(end_profile(profile_token))
+    
     # Set up Jinja2 template filters
     @app.template_filter('format_datetime')
     def format_datetime_filter(value, format='%Y-%m-%d %H:%M %Z'):
@@ -117,7 +178,11 @@ def create_app():
                 return current_time.strftime(format_string)
             return current_time
         
-        return dict(now=now)
+        # Upstreams that are currently failing fast, for the outage banner
+        from utils.circuit_breaker import CLOSED, get_breaker_states
+        unavailable = [breaker for breaker in get_breaker_states() if breaker['state'] != CLOSED]
+        
+        return dict(now=now, unavailable_services=unavailable)
     
     # Error handlers
     @app.errorhandler(404)
@@ -132,12 +197,34 @@ def create_app():
 
 def start_scheduler():
     """Start the background scheduler for ticket processing."""
+    from utils.scheduler import setup_ticket_processing_jobs
+    
     try:
         setup_ticket_processing_jobs()
         logger.info("Background scheduler started successfully")
     except Exception as e:
         logger.error(f"Failed to start background scheduler: {str(e)}")
 
+def start_generation_workers():
+    """Start the generation worker pool and resume jobs left over from a previous run."""
+    from ai.generation_queue import get_generation_queue
+    
+    try:
+        resumed = get_generation_queue().recover()
+        logger.info(f"Generation workers started ({resumed} queued jobs resumed)")
+    except Exception as e:
+        logger.error(f"Failed to start generation workers: {str(e)}")
+
+def start_outbox_sender():
+    """Resume delivery of replies and notes that were still in the outbox when the app stopped."""
+    from freshdesk.outbox import get_outbox_sender
+    
+    try:
+        requeued = get_outbox_sender().recover()
+        logger.info(f"Outbox sender started ({requeued} interrupted messages requeued)")
+    except Exception as e:
+        logger.error(f"Failed to start outbox sender: {str(e)}")
+
 if __name__ == '__main__':
     # Create the Flask app
     app = create_app()
@@ -145,5 +232,11 @@ if __name__ == '__main__':
     # Start the background scheduler
     start_scheduler()
     
+    # Resume queued AI generation jobs
+    start_generation_workers()
+    
+    # Resume delivery of queued Freshdesk replies
+    start_outbox_sender()
+    
     # Run the app
     app.run(host='0.0.0.0', port=8004)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for the application and CLI entry points.
+
+Runs each entry module in a fresh interpreter with ``python -X importtime``
+and reports the total import time plus the slowest individual imports, so
+that cold starts of the web app, the importer and the scheduler stay fast.
+
+Usage:
+    python benchmarks/startup_benchmark.py
+    python benchmarks/startup_benchmark.py --runs 5 --top 15
+    python benchmarks/startup_benchmark.py --max-ms 250   # exit 1 if any module is slower
+"""
+
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List, Tuple
+
+# Project root, so that the entry modules can be imported by name
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that are imported on a cold start of a process
+DEFAULT_MODULES = [
+    'app',
+    'web.routes',
+    'freshdesk.ticket_importer',
+    'utils.scheduler',
+    'database.db_operations',
+    'ai.response_generator',
+]
+
+# Line format: "import time:       123 |        456 | package.module"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def measure_import(module: str) -> Tuple[float, List[Tuple[str, int, int]]]:
+    """Import a module in a fresh interpreter and parse the -X importtime output.
+
+    Args:
+        module: Dotted module name to import
+
+    Returns:
+        Tuple of (cumulative import time of the module in ms, list of
+        (module, self_us, cumulative_us) entries for every import)
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    entries = []
+    total_us = 0
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, name = int(match.group(1)), int(match.group(2)), match.group(4)
+        entries.append((name, self_us, cumulative_us))
+        if name == module:
+            total_us = cumulative_us
+
+    return total_us / 1000.0, entries
+
+
+def slowest_imports(entries: List[Tuple[str, int, int]], top: int) -> List[Tuple[str, int]]:
+    """Get the imports with the highest self time."""
+    return sorted(((name, self_us) for name, self_us, _ in entries), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the entry points.")
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES, help="Modules to measure")
+    parser.add_argument('--runs', type=int, default=3, help="Runs per module; the median is reported")
+    parser.add_argument('--top', type=int, default=10, help="Number of slowest imports to list per module")
+    parser.add_argument('--max-ms', type=float, default=None, help="Fail if any module takes longer than this")
+    args = parser.parse_args()
+
+    failures = []
+    results: Dict[str, float] = {}
+
+    for module in args.modules:
+        timings = []
+        entries = []
+        for _ in range(max(1, args.runs)):
+            try:
+                total_ms, entries = measure_import(module)
+            except RuntimeError as e:
+                print(str(e))
+                failures.append(module)
+                break
+            timings.append(total_ms)
+        if not timings:
+            continue
+
+        results[module] = statistics.median(timings)
+        print(f"\n{module}: {results[module]:.1f} ms (median of {len(timings)})")
+        for name, self_us in slowest_imports(entries, args.top):
+            print(f"    {self_us / 1000.0:8.1f} ms  {name}")
+
+        if args.max_ms is not None and results[module] > args.max_ms:
+            failures.append(module)
+
+    print("\nSummary:")
+    for module, total_ms in results.items():
+        print(f"    {total_ms:8.1f} ms  {module}")
+
+    if failures:
+        print(f"\nOver budget or failed: {', '.join(failures)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
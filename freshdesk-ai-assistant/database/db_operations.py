@@ -1,11 +1,17 @@
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Set, Tuple
 
-from .models import Ticket, Response, Conversation, Session as DBSession
+from .models import (
+    Ticket, Response, Conversation, TicketSummary, LLMCacheEntry, HTTPCacheEntry, GenerationJob, OutboxMessage,
+    Session as DBSession, get_engine
+)
+from utils.text_processing import html_to_text, estimate_tokens, is_customer_sender
 
 def get_session() -> Session:
     """Get a new database session."""
+    get_engine()
     return DBSession()
 
 # Ticket operations
@@ -40,6 +46,20 @@ def get_tickets_needing_processing(session: Session) -> List[Ticket]:
     """Get all tickets that need AI processing."""
     return session.query(Ticket).filter(Ticket.needs_processing == True).all()
 
+def get_tickets_for_pregeneration(session: Session, limit: int) -> List[Ticket]:
+    """Get tickets awaiting a first draft that have never had a draft requested.
+    
+    Tickets are ordered by priority (highest first), then oldest first.
+    """
+    return session.query(Ticket).filter(
+        Ticket.needs_processing == True,
+        ~Ticket.responses.any(),
+        ~session.query(GenerationJob).filter(
+            GenerationJob.ticket_id == Ticket.id,
+            GenerationJob.kind == 'response'
+        ).exists()
+    ).order_by(Ticket.priority.desc(), Ticket.created_at).limit(limit).all()
+
 def update_ticket(session: Session, ticket: Ticket, ticket_data: Dict[str, Any]) -> Ticket:
     """Update an existing ticket with new data."""
     for key, value in ticket_data.items():
@@ -87,6 +107,30 @@ def get_responses_for_ticket(session: Session, ticket_id: int) -> List[Response]
     """Get all responses for a specific ticket."""
     return session.query(Response).filter(Response.ticket_id == ticket_id).order_by(Response.created_at.desc()).all()
 
+def get_latest_responses_by_ticket(session: Session) -> Dict[int, Response]:
+    """Get the most recently created response of every ticket, keyed by ticket ID.
+    
+    IDs increase with creation, so the newest response of a ticket is the one
+    with the highest ID; only those rows are loaded.
+    """
+    latest_ids = session.query(func.max(Response.id).label('id')).group_by(Response.ticket_id).subquery()
+    responses = session.query(Response).join(latest_ids, Response.id == latest_ids.c.id)
+    return {response.ticket_id: response for response in responses}
+
+def get_latest_sent_response(session: Session, ticket_id: int) -> Optional[Response]:
+    """Get the most recently sent response of a ticket."""
+    return session.query(Response).filter(
+        Response.ticket_id == ticket_id,
+        Response.is_sent == True
+    ).order_by(Response.sent_at.desc()).first()
+
+def get_sent_responses_by_ticket(session: Session) -> Dict[int, Response]:
+    """Get the most recently sent response of every ticket, keyed by ticket ID."""
+    latest = {}
+    for response in session.query(Response).filter(Response.is_sent == True).order_by(Response.sent_at):
+        latest[response.ticket_id] = response
+    return latest
+
 def update_response(session: Session, response_id: int, final_content: str) -> Optional[Response]:
     """Update the final content of a response."""
     response = session.query(Response).filter(Response.id == response_id).first()
@@ -117,6 +161,29 @@ def update_response_full(session: Session, response_id: int, final_content: str
         session.refresh(response)
     return response
 
+def save_generated_response(session: Session, ticket_id: int, final_content: str, tech_instructions: str = None,
+                            follow_up_questions: str = None, is_final_solution: bool = False) -> Response:
+    """Store newly generated content, replacing the latest draft if it hasn't been sent yet."""
+    existing_responses = get_responses_for_ticket(session, ticket_id)
+    if existing_responses and not existing_responses[0].is_sent:
+        return update_response_full(
+            session,
+            existing_responses[0].id,
+            final_content=final_content,
+            tech_instructions=tech_instructions,
+            follow_up_questions=follow_up_questions,
+            is_final_solution=is_final_solution
+        )
+    
+    return create_response(
+        session,
+        ticket_id,
+        final_content,
+        tech_instructions=tech_instructions,
+        follow_up_questions=follow_up_questions,
+        is_final_solution=is_final_solution
+    )
+
 def mark_response_sent(session: Session, response_id: int) -> Optional[Response]:
     """Mark a response as sent to Freshdesk."""
     response = session.query(Response).filter(Response.id == response_id).first()
@@ -128,13 +195,26 @@ def mark_response_sent(session: Session, response_id: int) -> Optional[Response]
     return response
 
 # Conversation operations
-def add_conversation(session: Session, ticket_id: int, conversation_data: Dict[str, Any]) -> Conversation:
-    """Add a conversation entry for a ticket."""
+def add_conversation(session: Session, ticket_id: int, conversation_data: Dict[str, Any],
+                     requester_email: str = None) -> Conversation:
+    """Add a conversation entry for a ticket.
+
+    The plain-text body, sender role and token estimate are computed here once
+    so that prompt assembly doesn't have to repeat the work on every generation.
+    """
+    body = conversation_data.get('body', '')
+    # Freshdesk sends a plain-text copy alongside the HTML body; prefer it when present
+    body_text = conversation_data.get('body_text') or html_to_text(body)
+    from_email = conversation_data.get('from_email', '')
+    
     conversation = Conversation(
         ticket_id=ticket_id,
         freshdesk_id=conversation_data.get('id'),
-        body=conversation_data.get('body', ''),
-        from_email=conversation_data.get('from_email', ''),
+        body=body,
+        body_text=body_text,
+        is_customer=is_customer_sender(from_email, requester_email, conversation_data.get('incoming')),
+        token_count=estimate_tokens(body_text),
+        from_email=from_email,
         user_id=conversation_data.get('user_id'),
         created_at=datetime.fromisoformat(conversation_data['created_at'].replace('Z', '+00:00')) if 'created_at' in conversation_data else datetime.utcnow()
     )
@@ -153,3 +233,307 @@ def get_conversation_by_freshdesk_id(session: Session, ticket_id: int, freshdesk
         Conversation.ticket_id == ticket_id,
         Conversation.freshdesk_id == freshdesk_id
     ).first()
+
+def get_conversation_freshdesk_ids(session: Session, ticket_id: int) -> Set[int]:
+    """Get the Freshdesk IDs of the conversation entries already stored for a ticket."""
+    rows = session.query(Conversation.freshdesk_id).filter(Conversation.ticket_id == ticket_id)
+    return {row.freshdesk_id for row in rows if row.freshdesk_id is not None}
+
+# Ticket summary operations
+def get_ticket_summary(session: Session, ticket_id: int) -> Optional[TicketSummary]:
+    """Get the rolling conversation summary of a ticket."""
+    return session.query(TicketSummary).filter(TicketSummary.ticket_id == ticket_id).first()
+
+def save_ticket_summary(session: Session, ticket_id: int, summary: str, last_conversation_id: int,
+                        conversation_count: int) -> TicketSummary:
+    """Create or replace the rolling conversation summary of a ticket."""
+    ticket_summary = get_ticket_summary(session, ticket_id)
+    if ticket_summary is None:
+        ticket_summary = TicketSummary(ticket_id=ticket_id)
+        session.add(ticket_summary)
+    
+    ticket_summary.summary = summary
+    ticket_summary.last_conversation_id = last_conversation_id
+    ticket_summary.conversation_count = conversation_count
+    ticket_summary.token_count = estimate_tokens(summary)
+    ticket_summary.updated_at = datetime.utcnow()
+    session.commit()
+    session.refresh(ticket_summary)
+    return ticket_summary
+
+# LLM cache operations
+def get_llm_cache_entry(session: Session, cache_key: str) -> Optional[LLMCacheEntry]:
+    """Get a cached completion by its key."""
+    return session.query(LLMCacheEntry).filter(LLMCacheEntry.cache_key == cache_key).first()
+
+def touch_llm_cache_entry(session: Session, entry: LLMCacheEntry) -> None:
+    """Record a cache hit, moving the entry to the front of the LRU order."""
+    entry.hit_count = (entry.hit_count or 0) + 1
+    entry.last_accessed_at = datetime.utcnow()
+    session.commit()
+
+def save_llm_cache_entry(session: Session, cache_key: str, response: str) -> LLMCacheEntry:
+    """Store a completion in the cache, replacing any existing entry with the same key."""
+    entry = get_llm_cache_entry(session, cache_key)
+    now = datetime.utcnow()
+    if entry:
+        entry.response = response
+        entry.created_at = now
+        entry.last_accessed_at = now
+    else:
+        entry = LLMCacheEntry(cache_key=cache_key, response=response, hit_count=0, created_at=now, last_accessed_at=now)
+        session.add(entry)
+    session.commit()
+    return entry
+
+def delete_llm_cache_entry(session: Session, entry: LLMCacheEntry) -> None:
+    """Remove a single cache entry."""
+    session.delete(entry)
+    session.commit()
+
+def evict_llm_cache_entries(session: Session, created_before: datetime, max_entries: int) -> int:
+    """Remove expired entries, then the least recently used ones beyond max_entries.
+    
+    Returns:
+        Number of entries removed
+    """
+    removed = session.query(LLMCacheEntry).filter(LLMCacheEntry.created_at < created_before).delete(synchronize_session=False)
+    
+    excess = session.query(LLMCacheEntry).count() - max_entries
+    if excess > 0:
+        oldest_ids = [row.id for row in session.query(LLMCacheEntry.id).order_by(LLMCacheEntry.last_accessed_at).limit(excess)]
+        removed += session.query(LLMCacheEntry).filter(LLMCacheEntry.id.in_(oldest_ids)).delete(synchronize_session=False)
+    
+    session.commit()
+    return removed
+
+# HTTP cache operations
+def get_http_cache_entry(session: Session, url: str) -> Optional[HTTPCacheEntry]:
+    """Get the cached response for a URL."""
+    return session.query(HTTPCacheEntry).filter(HTTPCacheEntry.url == url).first()
+
+def touch_http_cache_entry(session: Session, entry: HTTPCacheEntry) -> None:
+    """Record that Freshdesk confirmed a cached response is unchanged."""
+    entry.hit_count = (entry.hit_count or 0) + 1
+    entry.last_validated_at = datetime.utcnow()
+    session.commit()
+
+def save_http_cache_entry(session: Session, url: str, etag: Optional[str], last_modified: Optional[str], body: str) -> HTTPCacheEntry:
+    """Store a downloaded response, replacing any existing entry for the URL."""
+    entry = get_http_cache_entry(session, url)
+    now = datetime.utcnow()
+    if entry:
+        entry.etag = etag
+        entry.last_modified = last_modified
+        entry.body = body
+        entry.fetched_at = now
+        entry.last_validated_at = now
+    else:
+        entry = HTTPCacheEntry(url=url, etag=etag, last_modified=last_modified, body=body, hit_count=0,
+                               fetched_at=now, last_validated_at=now)
+        session.add(entry)
+    session.commit()
+    return entry
+
+def delete_http_cache_entry(session: Session, url: str) -> None:
+    """Remove the cached response for a URL, if there is one."""
+    session.query(HTTPCacheEntry).filter(HTTPCacheEntry.url == url).delete(synchronize_session=False)
+    session.commit()
+
+def count_http_cache_entries(session: Session) -> int:
+    """Count the responses stored in the HTTP cache."""
+    return session.query(HTTPCacheEntry).count()
+
+def evict_http_cache_entries(session: Session, max_entries: int) -> int:
+    """Remove the least recently validated entries beyond max_entries.
+    
+    Returns:
+        Number of entries removed
+    """
+    removed = 0
+    excess = session.query(HTTPCacheEntry).count() - max_entries
+    if excess > 0:
+        oldest_ids = [row.id for row in session.query(HTTPCacheEntry.id).order_by(HTTPCacheEntry.last_validated_at, HTTPCacheEntry.id).limit(excess)]
+        removed = session.query(HTTPCacheEntry).filter(HTTPCacheEntry.id.in_(oldest_ids)).delete(synchronize_session=False)
+        session.commit()
+    return removed
+
+# Generation job operations
+def enqueue_generation_job(session: Session, ticket_id: int, kind: str, regenerate: bool = False) -> Tuple[GenerationJob, bool]:
+    """Queue a generation job, reusing a pending job of the same kind for the ticket.
+    
+    Returns:
+        Tuple of (job, created), where created is False for a de-duplicated request
+    """
+    job = session.query(GenerationJob).filter(
+        GenerationJob.ticket_id == ticket_id,
+        GenerationJob.kind == kind,
+        GenerationJob.status.in_(['queued', 'running'])
+    ).order_by(GenerationJob.id.desc()).first()
+    if job:
+        return job, False
+    
+    job = GenerationJob(ticket_id=ticket_id, kind=kind, status='queued', regenerate=regenerate,
+                        attempts=0, created_at=datetime.utcnow())
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+    return job, True
+
+def get_generation_job(session: Session, job_id: int) -> Optional[GenerationJob]:
+    """Get a generation job by ID."""
+    return session.query(GenerationJob).filter(GenerationJob.id == job_id).first()
+
+def get_generation_jobs(session: Session, job_ids: List[int]) -> List[GenerationJob]:
+    """Get several generation jobs by ID, in ID order."""
+    return session.query(GenerationJob).filter(GenerationJob.id.in_(job_ids)).order_by(GenerationJob.id).all()
+
+def get_queued_generation_jobs(session: Session) -> List[GenerationJob]:
+    """Get all jobs waiting to run, oldest first."""
+    return session.query(GenerationJob).filter(GenerationJob.status == 'queued').order_by(GenerationJob.id).all()
+
+def claim_generation_job(session: Session, job_id: int) -> Optional[GenerationJob]:
+    """Move a queued job to running.
+    
+    The status check is part of the UPDATE, so only one worker can claim a job.
+    
+    Returns:
+        The claimed job, or None if it was not queued (already claimed or finished)
+    """
+    claimed = session.query(GenerationJob).filter(
+        GenerationJob.id == job_id,
+        GenerationJob.status == 'queued'
+    ).update({
+        GenerationJob.status: 'running',
+        GenerationJob.started_at: datetime.utcnow(),
+        GenerationJob.attempts: GenerationJob.attempts + 1
+    }, synchronize_session=False)
+    session.commit()
+    return get_generation_job(session, job_id) if claimed else None
+
+def finish_generation_job(session: Session, job: GenerationJob, result: str = None, error: str = None) -> GenerationJob:
+    """Record the outcome of a job; a job with an error is marked failed."""
+    job.status = 'failed' if error else 'done'
+    job.result = result
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    session.commit()
+    session.refresh(job)
+    return job
+
+def requeue_running_generation_jobs(session: Session) -> int:
+    """Put jobs left running by a previous process back in the queue.
+    
+    Returns:
+        Number of jobs requeued
+    """
+    requeued = session.query(GenerationJob).filter(GenerationJob.status == 'running').update(
+        {GenerationJob.status: 'queued', GenerationJob.started_at: None}, synchronize_session=False
+    )
+    session.commit()
+    return requeued
+
+# Outbox operations
+def enqueue_outbox_message(session: Session, ticket_id: int, kind: str, payload: str, idempotency_key: str,
+                           response_id: int = None) -> Tuple[OutboxMessage, bool]:
+    """Add a message to the outbox, unless one with the same idempotency key already exists.
+    
+    Returns:
+        Tuple of (message, created), where created is False for a repeated request
+    """
+    message = session.query(OutboxMessage).filter(OutboxMessage.idempotency_key == idempotency_key).first()
+    if message:
+        return message, False
+    
+    now = datetime.utcnow()
+    message = OutboxMessage(ticket_id=ticket_id, response_id=response_id, kind=kind, payload=payload,
+                            idempotency_key=idempotency_key, status='pending', attempts=0,
+                            created_at=now, next_attempt_at=now)
+    session.add(message)
+    session.commit()
+    session.refresh(message)
+    return message, True
+
+def reset_outbox_message(session: Session, message: OutboxMessage, payload: str) -> OutboxMessage:
+    """Give an undelivered message a new payload and make it due now, clearing a failure.
+    
+    The attempt count starts over, so a message that was given up on gets the
+    full outbox_max_attempts again. total_attempts is kept, so the next attempt
+    still checks whether an earlier one reached Freshdesk.
+    """
+    message.payload = payload
+    message.status = 'pending'
+    message.attempts = 0
+    message.last_error = None
+    message.next_attempt_at = datetime.utcnow()
+    session.commit()
+    session.refresh(message)
+    return message
+
+def get_outbox_message(session: Session, message_id: int) -> Optional[OutboxMessage]:
+    """Get an outbox message by ID."""
+    return session.query(OutboxMessage).filter(OutboxMessage.id == message_id).first()
+
+def get_due_outbox_messages(session: Session, limit: int) -> List[OutboxMessage]:
+    """Get pending messages whose next attempt is due, oldest first."""
+    return session.query(OutboxMessage).filter(
+        OutboxMessage.status == 'pending',
+        OutboxMessage.next_attempt_at <= datetime.utcnow()
+    ).order_by(OutboxMessage.id).limit(limit).all()
+
+def claim_outbox_message(session: Session, message_id: int) -> Optional[OutboxMessage]:
+    """Move a pending message to sending.
+    
+    The status check is part of the UPDATE, so only one sender can claim a message.
+    
+    Returns:
+        The claimed message, or None if it was not pending
+    """
+    claimed = session.query(OutboxMessage).filter(
+        OutboxMessage.id == message_id,
+        OutboxMessage.status == 'pending'
+    ).update({
+        OutboxMessage.status: 'sending',
+        OutboxMessage.attempts: OutboxMessage.attempts + 1,
+        OutboxMessage.total_attempts: func.coalesce(OutboxMessage.total_attempts, 0) + 1
+    }, synchronize_session=False)
+    session.commit()
+    return get_outbox_message(session, message_id) if claimed else None
+
+def finish_outbox_message(session: Session, message: OutboxMessage, result: str = None, error: str = None,
+                          retry_at: datetime = None) -> OutboxMessage:
+    """Record the outcome of a delivery attempt.
+    
+    A message with an error goes back to pending if retry_at is given, and is
+    marked failed otherwise. A delivered reply marks its response as sent in
+    the same commit, so a crash can't leave a sent reply looking unsent.
+    """
+    if error:
+        message.status = 'pending' if retry_at else 'failed'
+        message.last_error = error
+        message.next_attempt_at = retry_at
+    else:
+        message.status = 'sent'
+        message.result = result
+        message.last_error = None
+        message.sent_at = datetime.utcnow()
+        if message.kind == 'reply' and message.response_id:
+            response = session.query(Response).filter(Response.id == message.response_id).first()
+            if response:
+                response.is_sent = True
+                response.sent_at = message.sent_at
+    session.commit()
+    session.refresh(message)
+    return message
+
+def requeue_sending_outbox_messages(session: Session) -> int:
+    """Put messages left sending by a previous process back to pending.
+    
+    Returns:
+        Number of messages requeued
+    """
+    requeued = session.query(OutboxMessage).filter(OutboxMessage.status == 'sending').update(
+        {OutboxMessage.status: 'pending', OutboxMessage.next_attempt_at: datetime.utcnow()}, synchronize_session=False
+    )
+    session.commit()
+    return requeued
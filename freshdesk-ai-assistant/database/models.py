@@ -3,16 +3,90 @@ from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 import datetime
 import os
-import json
+import time
+import threading
 
-# Load configuration
-with open(os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json'), 'r') as f:
-    config = json.load(f)
+from utils.metrics import histogram
+from utils.tracing import ERROR, get_tracer
+from database.query_profiler import record_query
 
-# Create SQLite database engine
+# SQLite database file
 db_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'tickets.db')
-engine = create_engine(f'sqlite:///{db_path}')
-Session = sessionmaker(bind=engine)
+
+# Session factory; bound to the engine the first time get_engine() is called
+Session = sessionmaker()
+
+# Time spent in each SQL statement, by kind of statement
+QUERY_SECONDS = histogram('db_query_seconds', 'Duration of SQL statements', ('operation',))
+QUERY_OPERATIONS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE')
+
+def _statement_operation(statement: str) -> str:
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ''
+    return operation if operation in QUERY_OPERATIONS else 'OTHER'
+
+def _instrument_engine(engine) -> None:
+    """Time every statement the engine executes into QUERY_SECONDS and the active query profile, and trace it under the current span."""
+    from sqlalchemy import event
+    
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # Queries outside any traced operation don't start traces of their own
+        context.trace_span = get_tracer().start_span('db.query', {
+            'db.operation': _statement_operation(statement),
+            'db.statement': statement[:500]
+        }, require_parent=True)
+        context.metrics_started = time.perf_counter()
+    
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.metrics_started
+        QUERY_SECONDS.observe(elapsed, operation=_statement_operation(statement))
+        record_query(statement, elapsed)
+        context.trace_span.end()
+    
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        span = getattr(exception_context.execution_context, 'trace_span', None)
+        if span is not None:
+            span.set_status(ERROR, str(exception_context.original_exception))
+            span.end()
+
+def _instrument_sessions() -> None:
+    """Trace each commit (flush plus database commit) under the current span."""
+    from sqlalchemy import event
+    
+    @event.listens_for(Session, 'before_commit')
+    def before_commit(session):
+        session.info['trace_commit_span'] = get_tracer().start_span('db.commit', require_parent=True)
+    
+    @event.listens_for(Session, 'after_commit')
+    def after_commit(session):
+        span = session.info.pop('trace_commit_span', None)
+        if span is not None:
+            span.end()
+    
+    @event.listens_for(Session, 'after_rollback')
+    def after_rollback(session):
+        span = session.info.pop('trace_commit_span', None)
+        if span is not None:
+            span.set_status(ERROR, 'rolled back')
+            span.end()
+
+# The engine is created lazily so that importing the models has no side effects
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """Get the database engine, creating it and binding Session on first use."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(f'sqlite:///{db_path}')
+                _instrument_engine(_engine)
+                _instrument_sessions()
+                Session.configure(bind=_engine)
+    return _engine
 
 Base = declarative_base()
 
@@ -35,6 +109,9 @@ class Ticket(Base):
     # Relationship with responses
     responses = relationship("Response", back_populates="ticket", cascade="all, delete-orphan")
     
+    # Rolling summary of the older part of the conversation, if one has been made
+    summary = relationship("TicketSummary", back_populates="ticket", uselist=False, cascade="all, delete-orphan")
+    
     def __repr__(self):
         return f"<Ticket(id={self.freshdesk_id}, subject='{self.subject}')>"
 
@@ -70,6 +147,9 @@ class Conversation(Base):
     ticket_id = Column(Integer, ForeignKey('tickets.id'), nullable=False)
     freshdesk_id = Column(Integer)
     body = Column(Text)
+    body_text = Column(Text)  # Plain-text version of body, normalized at import time
+    is_customer = Column(Boolean)  # Whether the ticket requester wrote this entry
+    token_count = Column(Integer)  # Estimated model tokens in body_text
     from_email = Column(String(100))
     user_id = Column(Integer)
     created_at = Column(DateTime)
@@ -81,9 +161,109 @@ class Conversation(Base):
         return f"<Conversation(id={self.id}, ticket_id={self.ticket_id})>"
 
 
+class TicketSummary(Base):
+    """Model representing a rolling summary of the older conversation entries of a ticket."""
+    __tablename__ = 'ticket_summaries'
+
+    id = Column(Integer, primary_key=True)
+    ticket_id = Column(Integer, ForeignKey('tickets.id'), nullable=False, unique=True)
+    summary = Column(Text, nullable=False)
+    last_conversation_id = Column(Integer)  # Newest conversation entry covered by the summary
+    conversation_count = Column(Integer, default=0)  # Number of conversation entries covered
+    token_count = Column(Integer)  # Estimated model tokens in summary
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    # Relationship with ticket
+    ticket = relationship("Ticket", back_populates="summary")
+    
+    def __repr__(self):
+        return f"<TicketSummary(ticket_id={self.ticket_id}, conversations={self.conversation_count})>"
+
+
+class LLMCacheEntry(Base):
+    """Model representing a cached OpenAI completion, keyed by a fingerprint of the request."""
+    __tablename__ = 'llm_cache'
+
+    id = Column(Integer, primary_key=True)
+    cache_key = Column(String(64), unique=True, nullable=False, index=True)  # SHA-256 of model, messages and parameters
+    response = Column(Text, nullable=False)  # JSON-encoded API response
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<LLMCacheEntry(key={self.cache_key[:12]}, hits={self.hit_count})>"
+
+
+class HTTPCacheEntry(Base):
+    """Model representing a cached Freshdesk GET response, revalidated with its ETag."""
+    __tablename__ = 'http_cache'
+
+    id = Column(Integer, primary_key=True)
+    url = Column(String(512), unique=True, nullable=False, index=True)  # Full request URL, including the query string
+    etag = Column(String(255))
+    last_modified = Column(String(64))
+    body = Column(Text, nullable=False)  # Raw response body
+    hit_count = Column(Integer, default=0)
+    fetched_at = Column(DateTime, default=datetime.datetime.utcnow)  # When the body was last downloaded
+    last_validated_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)  # When Freshdesk last confirmed it
+    
+    def __repr__(self):
+        return f"<HTTPCacheEntry(url={self.url}, etag={self.etag}, hits={self.hit_count})>"
+
+
+class GenerationJob(Base):
+    """Model representing a queued AI generation request for a ticket."""
+    __tablename__ = 'generation_jobs'
+
+    id = Column(Integer, primary_key=True)
+    ticket_id = Column(Integer, ForeignKey('tickets.id'), nullable=False, index=True)
+    kind = Column(String(32), nullable=False)  # response, tech_instructions or follow_up_questions
+    status = Column(String(20), nullable=False, default='queued', index=True)  # queued, running, done or failed
+    regenerate = Column(Boolean, default=False)  # Skip the response cache
+    result = Column(Text)  # JSON-encoded result once the job is done
+    error = Column(Text)
+    attempts = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    
+    # Relationship with ticket
+    ticket = relationship("Ticket")
+    
+    def __repr__(self):
+        return f"<GenerationJob(id={self.id}, ticket_id={self.ticket_id}, kind='{self.kind}', status='{self.status}')>"
+
+
+class OutboxMessage(Base):
+    """Model representing a reply, note or ticket update waiting to be delivered to Freshdesk."""
+    __tablename__ = 'outbox_messages'
+
+    id = Column(Integer, primary_key=True)
+    ticket_id = Column(Integer, ForeignKey('tickets.id'), nullable=False, index=True)
+    response_id = Column(Integer, ForeignKey('responses.id'))  # The draft being sent, for replies
+    kind = Column(String(20), nullable=False)  # reply, note or ticket_update
+    payload = Column(Text, nullable=False)  # JSON-encoded request body
+    idempotency_key = Column(String(100), unique=True, nullable=False)
+    status = Column(String(20), nullable=False, default='pending', index=True)  # pending, sending, sent or failed
+    attempts = Column(Integer, default=0)  # Attempts since the message was last (re-)sent by an agent
+    total_attempts = Column(Integer, default=0)  # Every attempt ever made; never reset, so a re-send still checks for an earlier delivery
+    last_error = Column(Text)
+    result = Column(Text)  # JSON-encoded Freshdesk response once sent
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    next_attempt_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    sent_at = Column(DateTime)
+    
+    # Relationship with ticket
+    ticket = relationship("Ticket")
+    
+    def __repr__(self):
+        return f"<OutboxMessage(id={self.id}, ticket_id={self.ticket_id}, kind='{self.kind}', status='{self.status}')>"
+
+
 def init_db():
     """Initialize the database by creating all tables."""
-    Base.metadata.create_all(engine)
+    Base.metadata.create_all(get_engine())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+import re
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.metrics import counter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Number of repeats of one statement shape in a request or job that is reported as a likely N+1
+DEFAULT_REPEAT_THRESHOLD = 5
+
+# Worst offenders listed in logs and budget errors
+REPORT_LIMIT = 3
+
+REPEATED_STATEMENTS = counter('db_repeated_statements_total', 'Likely N+1 statement shapes found by the query profiler', ('label',))
+
+# Profile that queries on the current thread (or a copied context) are counted into
+_active_profile = contextvars.ContextVar('query_profile', default=None)
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """Reduce a SQL statement to its shape: literals and parameter lists become '?'.
+
+    Two statements with the same shape differ only in their values, so many of
+    them in one request usually means a query inside a loop.
+    """
+    shape = _STRING_LITERAL.sub('?', statement)
+    shape = _NUMBER_LITERAL.sub('?', shape)
+    shape = _PLACEHOLDER_LIST.sub('(?)', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class QueryProfile:
+    """Counts and times the SQL statements run while the profile is active.
+
+    Profiles nest: a statement is counted in the active profile and in every
+    profile that was active when it started.
+    """
+
+    def __init__(self, label: str, parent: Optional['QueryProfile'] = None):
+        """Initialize an empty profile.
+
+        Args:
+            label: Name of the request or job being profiled, used in logs
+            parent: Enclosing profile, which also counts this profile's statements
+        """
+        self.label = label
+        self.parent = parent
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.total_seconds = 0.0
+        self._shapes: Dict[str, List[float]] = {}  # shape -> [count, seconds]
+
+    def record(self, statement: str, seconds: float) -> None:
+        """Count one statement in this profile and its parents."""
+        shape = statement_shape(statement)
+        profile = self
+        while profile is not None:
+            with profile._lock:
+                profile.queries += 1
+                profile.total_seconds += seconds
+                stats = profile._shapes.setdefault(shape, [0, 0.0])
+                stats[0] += 1
+                stats[1] += seconds
+            profile = profile.parent
+
+    def top_statements(self, limit: int = REPORT_LIMIT) -> List[Dict[str, Any]]:
+        """Get the most frequently repeated statement shapes, slowest first among equals."""
+        with self._lock:
+            shapes = [(shape, int(count), seconds) for shape, (count, seconds) in self._shapes.items()]
+        shapes.sort(key=lambda item: (-item[1], -item[2]))
+        return [
+            {'statement': shape, 'count': count, 'total_ms': round(seconds * 1000, 2)}
+            for shape, count, seconds in shapes[:limit]
+        ]
+
+    def repeated_statements(self, threshold: int = DEFAULT_REPEAT_THRESHOLD) -> List[Dict[str, Any]]:
+        """Get statement shapes run at least `threshold` times, the likely N+1 queries."""
+        with self._lock:
+            shape_count = len(self._shapes)
+        return [item for item in self.top_statements(shape_count) if item['count'] >= threshold]
+
+    def summary(self) -> Dict[str, Any]:
+        """Get the totals and worst offenders of the profile."""
+        with self._lock:
+            queries, total_seconds, shape_count = self.queries, self.total_seconds, len(self._shapes)
+        return {
+            'label': self.label,
+            'queries': queries,
+            'distinct_statements': shape_count,
+            'total_ms': round(total_seconds * 1000, 2),
+            'top_statements': self.top_statements()
+        }
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised by query_budget() when a block runs more statements than allowed."""
+
+    def __init__(self, profile: QueryProfile, max_queries: int):
+        worst = "; ".join(f"{item['count']}x {item['statement'][:120]}" for item in profile.top_statements())
+        super().__init__(f"{profile.label} ran {profile.queries} queries (budget {max_queries}). Most repeated: {worst}")
+        self.profile = profile
+        self.max_queries = max_queries
+
+
+def record_query(statement: str, seconds: float) -> None:
+    """Count a statement in the active profile, if any (called from the engine hooks)."""
+    profile = _active_profile.get()
+    if profile is not None:
+        profile.record(statement, seconds)
+
+
+def current_profile() -> Optional[QueryProfile]:
+    """Get the active profile, or None when queries aren't being profiled."""
+    return _active_profile.get()
+
+
+def start_profile(label: str) -> contextvars.Token:
+    """Activate a new profile until end_profile() is called with the returned token.
+
+    For code that can't wrap the profiled work in a with block, such as a pair
+    of request hooks.
+    """
+    return _active_profile.set(QueryProfile(label, _active_profile.get()))
+
+
+def end_profile(token: contextvars.Token) -> QueryProfile:
+    """Deactivate the profile started with the token and return it."""
+    profile = _active_profile.get()
+    _active_profile.reset(token)
+    return profile
+
+
+@contextmanager
+def profile_queries(label: str, threshold: Optional[int] = None, report: bool = True) -> Iterator[QueryProfile]:
+    """Count and time the statements run inside the block.
+
+    Args:
+        label: Name of the profiled work, used in logs
+        threshold: Repeats of one statement shape reported as a likely N+1
+            (defaults to app.query_repeat_threshold)
+        report: Log the totals and any likely N+1 queries when the block ends
+
+    Yields:
+        The QueryProfile, which keeps counting until the block ends
+    """
+    token = start_profile(label)
+    try:
+        yield _active_profile.get()
+    finally:
+        profile = end_profile(token)
+        if report:
+            report_profile(profile, threshold)
+
+
+@contextmanager
+def query_budget(max_queries: int, label: str = 'block') -> Iterator[QueryProfile]:
+    """Fail if the block runs more than max_queries SQL statements.
+
+    Meant for tests, e.g. to keep the dashboard from growing a query per ticket:
+
+        with query_budget(10, 'dashboard'):
+            client.get('/')
+
+    Raises:
+        QueryBudgetExceeded: If the budget was exceeded, listing the most repeated statements
+    """
+    with profile_queries(label, report=False) as profile:
+        yield profile
+    if profile.queries > max_queries:
+        raise QueryBudgetExceeded(profile, max_queries)
+
+
+def repeat_threshold() -> int:
+    """Repeats of one statement shape that are reported as a likely N+1 (app.query_repeat_threshold)."""
+    from utils.config import get_config
+    return int(get_config().app.get('query_repeat_threshold', DEFAULT_REPEAT_THRESHOLD))
+
+
+def profiling_enabled() -> bool:
+    """Whether requests and background jobs are profiled (app.query_profiling, off by default)."""
+    from utils.config import get_config
+    return bool(get_config().app.get('query_profiling', False))
+
+
+def report_profile(profile: QueryProfile, threshold: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Log a profile's totals, and a warning for each statement shape repeated threshold times or more.
+
+    Returns:
+        The repeated statement shapes
+    """
+    threshold = threshold if threshold is not None else repeat_threshold()
+    repeated = profile.repeated_statements(threshold)
+
+    logger.debug(f"{profile.label}: {profile.queries} queries in {profile.total_seconds * 1000:.1f} ms")
+    for item in repeated[:REPORT_LIMIT]:
+        logger.warning(f"Possible N+1 in {profile.label}: {item['count']} queries ({item['total_ms']} ms) of {item['statement'][:300]}")
+    if repeated:
+        REPEATED_STATEMENTS.inc(len(repeated), label=profile.label)
+    return repeated
+
+
+def profiled(label: str) -> Callable:
+    """Decorator that profiles every call of a function while app.query_profiling is on."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiling_enabled():
+                return func(*args, **kwargs)
+            with profile_queries(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -1,25 +1,54 @@
-import os
+import re
 import json
+import contextvars
 import logging
 import time
-from typing import Dict, List, Optional, Any
+import threading
+from typing import Dict, Iterator, List, Optional, Any
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import requests
 from requests.auth import HTTPBasicAuth
 
+from utils.config import get_config
+from utils.rate_limiter import PriorityRateLimiter, current_priority, request_priority
+from utils.circuit_breaker import CircuitOpenError, get_circuit_breaker
+from utils.metrics import add_collector, counter, gauge, histogram
+from utils.tracing import get_current_span, start_as_current_span, traced
+
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Request metrics, labelled by endpoint with numeric IDs collapsed (e.g. /tickets/:id/conversations)
+REQUEST_SECONDS = histogram('freshdesk_request_seconds', 'Latency of Freshdesk API requests', ('method', 'endpoint'))
+RESPONSES = counter('freshdesk_responses_total', 'Freshdesk API responses by status code', ('method', 'endpoint', 'status'))
+RATE_LIMITED = counter('freshdesk_rate_limited_total', 'Freshdesk API requests answered with 429 Too Many Requests', ('endpoint',))
+RATE_LIMIT_SLEEP = counter('freshdesk_rate_limit_sleep_seconds_total', 'Seconds spent waiting before Freshdesk requests', ('reason',))
+RATE_LIMIT_WAITING = gauge('freshdesk_rate_limit_waiting', 'Freshdesk requests waiting for a rate limit slot', ('lane',))
+
+ID_PATTERN = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_label(url: str) -> str:
+    """Get the API path of a URL with query string and numeric IDs removed, for metric labels."""
+    path = url.split('?', 1)[0].split('/api/v2', 1)[-1]
+    return ID_PATTERN.sub('/:id', path) or '/'
+
+
+class FreshdeskUnavailableError(requests.exceptions.RequestException):
+    """Raised without calling Freshdesk while its circuit breaker is open."""
+
+
 class FreshdeskClient:
     """Client for interacting with the Freshdesk API."""
     
-    def __init__(self, domain: str, api_key: str):
+    def __init__(self, domain: str, api_key: str, check_connection: bool = True):
         """Initialize the Freshdesk API client.
         
         Args:
             domain: Freshdesk domain (e.g., 'yourcompany.freshdesk.com')
             api_key: Freshdesk API key
+            check_connection: Whether to test the connection immediately
         """
         self.domain = domain
         self.api_key = api_key
@@ -28,32 +57,86 @@ class FreshdeskClient:
         self.headers = {
             'Content-Type': 'application/json',
         }
-        self.last_request_time = 0
-        self.rate_limit_delay = 1.0  # Default delay between API requests in seconds
+        # Minimum spacing between requests, with a lane for interactive calls that
+        # jumps ahead of background traffic (see request_priority)
+        self.rate_limiter = PriorityRateLimiter(min_interval=1.0)
         self.max_retries = 5  # Maximum number of retries for rate-limited requests
         self.retry_delay = 2.0  # Initial retry delay in seconds
+        self.page_retries = 2  # Retries of a ticket list page after a server or connection error
+        
+        # Pooled HTTP connections, shared by every caller of this client
+        self.session = requests.Session()
+        
+        # Optional HTTPCache for conditional GETs of tickets and conversations
+        self.http_cache = None
+        
+        # Cached health state so that callers don't test the connection every time
+        self.healthy = False
+        self.last_health_check = 0.0
+        self._health_lock = threading.Lock()
         
         # Test the connection
+        if check_connection:
+            self.check_health()
+    
+    def check_health(self) -> bool:
+        """Test the connection and record the result as the cached health state.
+        
+        Returns:
+            True if the connection works
+            
+        Raises:
+            Exception: If the connection test fails
+        """
         try:
             self.test_connection()
+            self._mark_healthy()
             logger.info("Successfully connected to Freshdesk API")
+            return True
         except Exception as e:
+            self.healthy = False
             logger.error(f"Failed to connect to Freshdesk API: {str(e)}")
             raise
     
-    def _rate_limit(self):
-        """Apply rate limiting to API requests."""
-        current_time = time.time()
-        elapsed = current_time - self.last_request_time
+    def ensure_healthy(self, ttl: float) -> None:
+        """Re-test the connection only if the last check failed or is older than ttl seconds.
         
-        if elapsed < self.rate_limit_delay:
-            # Sleep to respect rate limit
-            sleep_time = self.rate_limit_delay - elapsed
-            logger.debug(f"Rate limiting: sleeping for {sleep_time:.2f} seconds")
-            time.sleep(sleep_time)
+        Args:
+            ttl: How long a successful health check stays valid, in seconds
+            
+        Raises:
+            Exception: If the connection test fails
+        """
+        if self.healthy and time.time() - self.last_health_check < ttl:
+            return
         
-        self.last_request_time = time.time()
+        with self._health_lock:
+            # Another thread may have re-checked while we waited for the lock
+            if self.healthy and time.time() - self.last_health_check < ttl:
+                return
+            self.check_health()
+    
+    def _mark_healthy(self) -> None:
+        """Record that the API answered successfully just now."""
+        self.healthy = True
+        self.last_health_check = time.time()
+    
+    @property
+    def rate_limit_delay(self) -> float:
+        """Delay between API requests in seconds."""
+        return self.rate_limiter.min_interval
+    
+    @rate_limit_delay.setter
+    def rate_limit_delay(self, value: float) -> None:
+        self.rate_limiter.min_interval = value
+    
+    def _rate_limit(self):
+        """Apply rate limiting to API requests, in the priority class of the calling thread."""
+        priority = current_priority()
+        with start_as_current_span('freshdesk.rate_limit_wait', {'priority': priority}):
+            self.rate_limiter.acquire(priority)
     
+    @traced('freshdesk.request')
     def _make_request(self, method, url, **kwargs):
         """Make a request to the Freshdesk API with retry logic for rate limiting.
         
@@ -66,21 +149,51 @@ class FreshdeskClient:
             Response object
         
         Raises:
+            FreshdeskUnavailableError: If the circuit breaker is open (Freshdesk is known to be down)
             requests.exceptions.RequestException: If the request fails after all retries
         """
         retries = 0
         delay = self.retry_delay
+        breaker = get_circuit_breaker('freshdesk')
+        endpoint = endpoint_label(url)
+        span = get_current_span()
+        span.set_attributes({'http.method': method.upper(), 'freshdesk.endpoint': endpoint})
         
         while True:
+            # Fail fast instead of retrying against an API that is down
+            try:
+                breaker.before_call()
+            except CircuitOpenError as e:
+                raise FreshdeskUnavailableError(str(e))
+            
             # Apply rate limiting
+            started = time.perf_counter()
             self._rate_limit()
+            RATE_LIMIT_SLEEP.inc(time.perf_counter() - started, reason='spacing')
             
             try:
                 # Make the request
-                response = getattr(requests, method)(url, **kwargs)
+                started = time.perf_counter()
+                try:
+                    response = getattr(self.session, method)(url, **kwargs)
+                finally:
+                    REQUEST_SECONDS.observe(time.perf_counter() - started, method=method, endpoint=endpoint)
+                RESPONSES.inc(method=method, endpoint=endpoint, status=response.status_code)
+                span.set_attribute('http.status_code', response.status_code)
+                
+                # Server errors count against the breaker; anything else means Freshdesk is up
+                if response.status_code >= 500:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
                 
                 # If successful or not a rate limit error, return the response
                 if response.status_code != 429:
+                    if response.status_code == 401 or response.status_code >= 500:
+                        # Force a fresh health check before the next shared use
+                        self.healthy = False
+                    elif response.ok:
+                        self._mark_healthy()
                     return response
                 
                 # If we've reached the maximum number of retries, raise the exception
@@ -99,21 +212,64 @@ class FreshdeskClient:
                     # Use exponential backoff
                     delay = min(delay * 2, 60)  # Cap at 60 seconds
                 
+                RATE_LIMITED.inc(endpoint=endpoint)
                 logger.warning(f"Rate limited by Freshdesk API. Retrying in {delay:.2f} seconds (retry {retries+1}/{self.max_retries})")
-                time.sleep(delay)
+                with start_as_current_span('freshdesk.retry_sleep', {'delay': delay}):
+                    time.sleep(delay)
+                RATE_LIMIT_SLEEP.inc(delay, reason='retry_after')
                 retries += 1
                 
             except requests.exceptions.RequestException as e:
                 # If it's not a rate limit error or we've reached the maximum number of retries, raise the exception
                 if not hasattr(e, 'response') or e.response is None or e.response.status_code != 429 or retries >= self.max_retries:
+                    if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+                        self.healthy = False
+                        breaker.record_failure()
                     raise
                 
                 # Use exponential backoff
                 delay = min(delay * 2, 60)  # Cap at 60 seconds
+                RATE_LIMITED.inc(endpoint=endpoint)
                 logger.warning(f"Rate limited by Freshdesk API. Retrying in {delay:.2f} seconds (retry {retries+1}/{self.max_retries})")
-                time.sleep(delay)
+                with start_as_current_span('freshdesk.retry_sleep', {'delay': delay}):
+                    time.sleep(delay)
+                RATE_LIMIT_SLEEP.inc(delay, reason='retry_after')
                 retries += 1
     
+    def _get_json(self, url: str) -> Any:
+        """GET a JSON resource, revalidating a cached copy instead of downloading it again.
+        
+        With an HTTP cache configured, the request carries the stored ETag. If
+        Freshdesk answers 304 Not Modified, the cached body is returned.
+        
+        Args:
+            url: Full URL to request
+            
+        Returns:
+            The decoded JSON body
+            
+        Raises:
+            requests.exceptions.RequestException: If the request fails
+        """
+        cache = self.http_cache
+        cached = cache.lookup(url) if cache else None
+        
+        response = self._make_request(
+            'get',
+            url,
+            auth=self.auth,
+            headers=dict(self.headers, **cache.conditional_headers(cached)) if cached else self.headers
+        )
+        
+        if response.status_code == 304 and cached:
+            cache.record_not_modified(url, cached)
+            return json.loads(cached['body'])
+        
+        response.raise_for_status()
+        if cache:
+            cache.store(url, response)
+        return response.json()
+    
     def test_connection(self) -> bool:
         """Test the connection to the Freshdesk API."""
         # Check if domain is still the default value
@@ -138,8 +294,8 @@ class FreshdeskClient:
                 raise ValueError("Invalid Freshdesk API credentials. Please check your API key in config.json")
             raise
     
-    def get_tickets(self, updated_since: Optional[datetime] = None, page: int = 1, per_page: int = 100) -> List[Dict[str, Any]]:
-        """Get tickets from Freshdesk, optionally filtered by update time.
+    def fetch_ticket_page(self, updated_since: Optional[datetime] = None, page: int = 1, per_page: int = 100) -> List[Dict[str, Any]]:
+        """Fetch one page of tickets, retrying server errors and dropped connections.
         
         Args:
             updated_since: Only return tickets updated since this time
@@ -147,7 +303,10 @@ class FreshdeskClient:
             per_page: Number of tickets per page
             
         Returns:
-            List of ticket dictionaries
+            List of ticket dictionaries (fewer than per_page on the last page)
+            
+        Raises:
+            requests.exceptions.RequestException: If the page still fails after page_retries retries
         """
         params = {
             'page': page,
@@ -159,55 +318,119 @@ class FreshdeskClient:
             # Format datetime to ISO 8601 format
             params['updated_since'] = updated_since.isoformat()
         
+        retries = 0
+        delay = self.retry_delay
+        while True:
+            try:
+                response = self._make_request(
+                    'get',
+                    f"{self.base_url}/tickets",
+                    auth=self.auth,
+                    headers=self.headers,
+                    params=params
+                )
+                response.raise_for_status()
+                return response.json()
+            except FreshdeskUnavailableError:
+                raise
+            except requests.exceptions.RequestException as e:
+                # Client errors (bad request, auth, exhausted 429 retries) won't fix themselves
+                status = e.response.status_code if getattr(e, 'response', None) is not None else None
+                if retries >= self.page_retries or (status is not None and status < 500):
+                    raise
+                
+                retries += 1
+                logger.warning(f"Error fetching ticket page {page}: {str(e)}. Retrying in {delay:.2f} seconds (retry {retries}/{self.page_retries})")
+                time.sleep(delay)
+                delay = min(delay * 2, 60)  # Cap at 60 seconds
+    
+    def get_tickets(self, updated_since: Optional[datetime] = None, page: int = 1, per_page: int = 100) -> List[Dict[str, Any]]:
+        """Get tickets from Freshdesk, optionally filtered by update time.
+        
+        Args:
+            updated_since: Only return tickets updated since this time
+            page: Page number for pagination
+            per_page: Number of tickets per page
+            
+        Returns:
+            List of ticket dictionaries, or an empty list if the request fails
+        """
         try:
-            response = self._make_request(
-                'get',
-                f"{self.base_url}/tickets",
-                auth=self.auth,
-                headers=self.headers,
-                params=params
-            )
-            response.raise_for_status()
-            return response.json()
+            return self.fetch_ticket_page(updated_since, page, per_page)
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching tickets: {str(e)}")
             if hasattr(e, 'response') and e.response is not None:
                 logger.error(f"Response content: {e.response.content}")
             return []
     
+    def iter_tickets(self, updated_since: Optional[datetime] = None, limit: int = None, per_page: int = 100) -> Iterator[Dict[str, Any]]:
+        """Yield tickets as their pages arrive, fetching the next page in the background.
+        
+        While the caller works through one page, the next one is already being
+        requested, so processing starts with the first page and only one page
+        is held in memory at a time. The background request is made in the
+        caller's priority class.
+        
+        Args:
+            updated_since: Only return tickets updated since this time
+            limit: Maximum number of tickets to yield (default: None, yields all tickets)
+            per_page: Number of tickets per page
+            
+        Yields:
+            Ticket dictionaries, in the order Freshdesk returns them
+            
+        Raises:
+            requests.exceptions.RequestException: If a page fails (see fetch_ticket_page);
+                tickets from earlier pages have already been yielded
+        """
+        priority = current_priority()
+        
+        def fetch(page):
+            with request_priority(priority):
+                return self.fetch_ticket_page(updated_since, page, per_page)
+        
+        def submit(page):
+            # Run in a copy of the caller's context so the request is traced under the caller's span
+            return executor.submit(contextvars.copy_context().run, fetch, page)
+        
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='freshdesk-pages')
+        try:
+            page = 1
+            yielded = 0
+            pending = submit(page)
+            while pending is not None:
+                tickets = pending.result()
+                remaining = limit - yielded if limit else None
+                
+                # Request the next page before handing this one to the caller
+                pending = None
+                if len(tickets) >= per_page and (remaining is None or remaining > len(tickets)):
+                    page += 1
+                    pending = submit(page)
+                
+                for ticket in tickets[:remaining]:
+                    yield ticket
+                    yielded += 1
+        finally:
+            # A caller that stops early doesn't wait for a prefetched page it won't use
+            executor.shutdown(wait=False)
+    
     def get_all_tickets(self, updated_since: Optional[datetime] = None, limit: int = None) -> List[Dict[str, Any]]:
         """Get all tickets, handling pagination automatically.
         
+        Prefer iter_tickets() for large result sets; this collects every page in memory.
+        
         Args:
             updated_since: Only return tickets updated since this time
             limit: Maximum number of tickets to return (default: None, returns all tickets)
             
         Returns:
             List of all ticket dictionaries
-        """
-        all_tickets = []
-        page = 1
-        per_page = 100
-        
-        while True:
-            tickets = self.get_tickets(updated_since, page, per_page)
-            if not tickets:
-                break
-                
-            all_tickets.extend(tickets)
             
-            # If we have enough tickets or there are no more pages, break
-            if limit and len(all_tickets) >= limit:
-                # Trim to the exact limit
-                all_tickets = all_tickets[:limit]
-                break
-                
-            if len(tickets) < per_page:
-                break
-                
-            page += 1
-        
-        return all_tickets
+        Raises:
+            requests.exceptions.RequestException: If a page fails, rather than returning a partial list
+        """
+        return list(self.iter_tickets(updated_since, limit))
     
     def get_ticket(self, ticket_id: int) -> Optional[Dict[str, Any]]:
         """Get a specific ticket by ID.
@@ -219,14 +442,7 @@ class FreshdeskClient:
             Ticket dictionary or None if not found
         """
         try:
-            response = self._make_request(
-                'get',
-                f"{self.base_url}/tickets/{ticket_id}",
-                auth=self.auth,
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+            return self._get_json(f"{self.base_url}/tickets/{ticket_id}")
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching ticket {ticket_id}: {str(e)}")
             return None
@@ -241,18 +457,36 @@ class FreshdeskClient:
             List of conversation dictionaries
         """
         try:
-            response = self._make_request(
-                'get',
-                f"{self.base_url}/tickets/{ticket_id}/conversations",
-                auth=self.auth,
-                headers=self.headers
-            )
-            response.raise_for_status()
-            return response.json()
+            return self._get_json(f"{self.base_url}/tickets/{ticket_id}/conversations")
         except requests.exceptions.RequestException as e:
             logger.error(f"Error fetching conversations for ticket {ticket_id}: {str(e)}")
             return []
     
+    def iter_ticket_conversations(self, ticket_id: int, per_page: int = 100) -> Iterator[Dict[str, Any]]:
+        """Yield every conversation of a ticket, oldest first, fetching one page at a time.
+        
+        Unlike get_ticket_conversations, this reads past the first page and
+        raises on failure, for callers that must not mistake an error or a long
+        thread for a missing conversation.
+        
+        Args:
+            ticket_id: The Freshdesk ticket ID
+            per_page: Conversations per page (Freshdesk allows at most 100)
+            
+        Yields:
+            Conversation dictionaries
+            
+        Raises:
+            requests.exceptions.RequestException: If a page can't be fetched
+        """
+        page = 1
+        while True:
+            conversations = self._get_json(f"{self.base_url}/tickets/{ticket_id}/conversations?page={page}&per_page={per_page}")
+            yield from conversations
+            if len(conversations) < per_page:
+                return
+            page += 1
+    
     def add_note_to_ticket(self, ticket_id: int, body: str, private: bool = False) -> Optional[Dict[str, Any]]:
         """Add a note to a ticket.
         
@@ -343,31 +577,115 @@ class FreshdeskClient:
             return None
 
 
-def create_client_from_config() -> FreshdeskClient:
-    """Create a Freshdesk client using the configuration file."""
-    config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
-    
-    with open(config_path, 'r') as f:
-        config = json.load(f)
-    
-    domain = config['freshdesk']['domain']
-    api_key = config['freshdesk']['api_key']
-    
-    client = FreshdeskClient(domain, api_key)
-    
+def _apply_config_settings(client: FreshdeskClient, config) -> None:
+    """Apply the rate limit, retry and HTTP cache settings from the configuration to a client."""
     # Set rate limit delay from config if available
     if 'rate_limit_delay' in config['freshdesk']:
         client.rate_limit_delay = float(config['freshdesk']['rate_limit_delay'])
         logger.info(f"Setting API rate limit delay to {client.rate_limit_delay} seconds")
     
+    # Share of the request budget kept free for interactive calls
+    if 'interactive_reserve' in config['freshdesk']:
+        client.rate_limiter.interactive_reserve = float(config['freshdesk']['interactive_reserve'])
+    
+    # Conditional requests for tickets and conversations; imported here to keep this module free of the DB layer at import time
+    if config['freshdesk'].get('http_cache_enabled', True):
+        from freshdesk.http_cache import HTTPCache
+        
+        if client.http_cache is None:
+            client.http_cache = HTTPCache()
+        client.http_cache.max_entries = int(config['freshdesk'].get('http_cache_max_entries', 5000))
+    else:
+        client.http_cache = None
+    
     # Set retry delay from config if available
     if 'retry_delay' in config['freshdesk']:
         client.retry_delay = float(config['freshdesk']['retry_delay'])
         logger.info(f"Setting API retry delay to {client.retry_delay} seconds")
     
+    # Retries of a failed ticket list page
+    if 'page_retries' in config['freshdesk']:
+        client.page_retries = int(config['freshdesk']['page_retries'])
+    
     # Set max retries from config if available
     if 'max_retries' in config['freshdesk']:
         client.max_retries = int(config['freshdesk']['max_retries'])
         logger.info(f"Setting API max retries to {client.max_retries}")
+
+
+def create_client_from_config() -> FreshdeskClient:
+    """Create a new Freshdesk client using the configuration file.
+    
+    Most callers should use get_freshdesk_client() instead, which shares one
+    client (and its connection pool and rate budget) across the process.
+    """
+    config = get_config()
+    
+    domain = config['freshdesk']['domain']
+    api_key = config['freshdesk']['api_key']
+    
+    client = FreshdeskClient(domain, api_key)
+    _apply_config_settings(client, config)
+    
+    return client
+
+
+# Shared client instance and the config version its settings came from
+_client = None
+_client_config_version = None
+_client_lock = threading.Lock()
+
+def get_shared_freshdesk_client() -> Optional[FreshdeskClient]:
+    """Get the process-wide Freshdesk client if one has been created, without testing its connection.
+    
+    For monitoring endpoints, which must keep working while Freshdesk is down.
+    
+    Returns:
+        The shared FreshdeskClient, or None if nothing has used Freshdesk yet
+    """
+    return _client
+
+def _collect_metrics() -> None:
+    """Copy the rate limiter queue of the shared client into gauges at scrape time."""
+    client = _client
+    if client is None:
+        return
+    for lane, stats in client.rate_limiter.get_stats().items():
+        RATE_LIMIT_WAITING.set(stats['waiting'], lane=lane)
+
+add_collector(_collect_metrics)
+
+def get_freshdesk_client() -> FreshdeskClient:
+    """Get the process-wide Freshdesk client.
+    
+    The client is created on first use and rebuilt only if the domain or API key
+    changes. Its connection is re-tested only when the last request failed or
+    the cached health state is older than freshdesk.health_check_ttl seconds.
+    
+    Returns:
+        The shared FreshdeskClient
+        
+    Raises:
+        Exception: If the connection test fails
+    """
+    global _client, _client_config_version
+    
+    config = get_config()
+    
+    with _client_lock:
+        domain = config['freshdesk']['domain']
+        api_key = config['freshdesk']['api_key']
+        
+        if _client is None or _client.domain != domain or _client.api_key != api_key:
+            _client = FreshdeskClient(domain, api_key, check_connection=False)
+            _client_config_version = None
+        
+        # Pick up rate limit changes from a reloaded config
+        if _client_config_version != config.version:
+            _apply_config_settings(_client, config)
+            _client_config_version = config.version
+        
+        client = _client
     
+    client.ensure_healthy(float(config['freshdesk'].get('health_check_ttl', 300)))
     return client
@@ -0,0 +1,149 @@
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+from database.db_operations import (
+    get_session,
+    get_http_cache_entry,
+    touch_http_cache_entry,
+    save_http_cache_entry,
+    delete_http_cache_entry,
+    evict_http_cache_entries
+)
+from utils.metrics import counter
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = counter('freshdesk_http_cache_requests_total', 'Cached Freshdesk GETs by outcome', ('result',))
+CACHE_BYTES = counter('freshdesk_http_cache_bytes_total', 'Response body bytes downloaded or served from cache', ('source',))
+
+
+class HTTPCache:
+    """Persistent cache of Freshdesk GET responses, stored in the app database.
+
+    Responses that carry an ETag (or Last-Modified) header are stored with it.
+    The next request for the same URL is sent as a conditional request, and a
+    304 Not Modified answer is served from the stored body instead of being
+    downloaded again. Entries are evicted least recently validated first once
+    the cache grows beyond max_entries.
+    """
+
+    def __init__(self, max_entries: int = 5000):
+        """Initialize the cache.
+
+        Args:
+            max_entries: Maximum number of cached responses
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.not_modified = 0
+        self.misses = 0
+        self.uncacheable = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+
+    def _count(self, **amounts: int) -> None:
+        with self._lock:
+            for name, amount in amounts.items():
+                setattr(self, name, getattr(self, name) + amount)
+
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        """Get the validators and body stored for a URL.
+
+        Args:
+            url: Full request URL, including the query string
+
+        Returns:
+            Dict with etag, last_modified and body, or None if nothing is cached
+        """
+        session = get_session()
+        try:
+            entry = get_http_cache_entry(session, url)
+            if entry is None:
+                return None
+            return {'etag': entry.etag, 'last_modified': entry.last_modified, 'body': entry.body}
+        except Exception as e:
+            # A broken cache must never break an import; fall back to a plain request
+            logger.error(f"Error reading HTTP cache: {str(e)}")
+            return None
+        finally:
+            session.close()
+
+    @staticmethod
+    def conditional_headers(cached: Optional[Dict[str, Any]]) -> Dict[str, str]:
+        """Build the If-None-Match / If-Modified-Since headers for a cached response."""
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached and cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+        return headers
+
+    def record_not_modified(self, url: str, cached: Dict[str, Any]) -> None:
+        """Count a 304 answer served from the cache."""
+        self._count(not_modified=1, bytes_saved=len(cached['body']))
+        CACHE_REQUESTS.inc(result='not_modified')
+        CACHE_BYTES.inc(len(cached['body']), source='cache')
+        session = get_session()
+        try:
+            entry = get_http_cache_entry(session, url)
+            if entry is not None:
+                touch_http_cache_entry(session, entry)
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error updating HTTP cache: {str(e)}")
+        finally:
+            session.close()
+
+    def store(self, url: str, response) -> None:
+        """Store a full response if Freshdesk sent validators for it.
+
+        Args:
+            url: Full request URL, including the query string
+            response: The successful requests.Response
+        """
+        body = response.text
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+
+        session = get_session()
+        try:
+            if not etag and not last_modified:
+                # Nothing to revalidate against, so a stored copy could never be reused
+                self._count(uncacheable=1, bytes_downloaded=len(body))
+                CACHE_REQUESTS.inc(result='uncacheable')
+                CACHE_BYTES.inc(len(body), source='download')
+                delete_http_cache_entry(session, url)
+                return
+
+            self._count(misses=1, bytes_downloaded=len(body))
+            CACHE_REQUESTS.inc(result='miss')
+            CACHE_BYTES.inc(len(body), source='download')
+            save_http_cache_entry(session, url, etag, last_modified, body)
+            removed = evict_http_cache_entries(session, self.max_entries)
+            if removed:
+                logger.debug(f"Evicted {removed} HTTP cache entries")
+        except Exception as e:
+            session.rollback()
+            logger.error(f"Error writing HTTP cache: {str(e)}")
+        finally:
+            session.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get conditional request counters for this process.
+
+        A 304 costs a request against the rate limit like any other, but no body
+        is transferred or parsed, so it is counted apart from a full download.
+        """
+        with self._lock:
+            revalidations = self.not_modified + self.misses
+            return {
+                'not_modified': self.not_modified,
+                'misses': self.misses,
+                'uncacheable': self.uncacheable,
+                'hit_rate': round(self.not_modified / revalidations, 3) if revalidations else 0.0,
+                'bytes_downloaded': self.bytes_downloaded,
+                'bytes_saved': self.bytes_saved,
+                'max_entries': self.max_entries
+            }
@@ -0,0 +1,304 @@
+import re
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from freshdesk.api_client import get_freshdesk_client
+from database.db_operations import (
+    get_session,
+    enqueue_outbox_message,
+    reset_outbox_message,
+    get_outbox_message,
+    get_due_outbox_messages,
+    claim_outbox_message,
+    finish_outbox_message,
+    requeue_sending_outbox_messages
+)
+from utils.config import get_config
+from utils.rate_limiter import INTERACTIVE, request_priority
+from utils.circuit_breaker import OPEN, get_circuit_breaker
+from utils.text_processing import html_to_text
+from utils.tracing import get_current_span, traced
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Kinds of message the outbox can deliver
+OUTBOX_KINDS = ('reply', 'note', 'ticket_update')
+
+# Longest wait between delivery attempts
+MAX_RETRY_DELAY = 3600
+
+
+def serialize_message(message) -> Dict[str, Any]:
+    """Convert an outbox message to a JSON-serializable dictionary."""
+    return {
+        'id': message.id,
+        'ticket_id': message.ticket_id,
+        'response_id': message.response_id,
+        'kind': message.kind,
+        'status': message.status,
+        'attempts': message.attempts,
+        'total_attempts': message.total_attempts,
+        'last_error': message.last_error,
+        'created_at': message.created_at.isoformat() if message.created_at else None,
+        'next_attempt_at': message.next_attempt_at.isoformat() if message.next_attempt_at else None,
+        'sent_at': message.sent_at.isoformat() if message.sent_at else None
+    }
+
+
+def reply_idempotency_key(response_id: int) -> str:
+    """Idempotency key for sending a stored response as a reply; a response is sent at most once."""
+    return f"reply:response:{response_id}"
+
+
+def _normalize(body: Optional[str]) -> str:
+    return re.sub(r'\s+', ' ', html_to_text(body)).strip()
+
+
+class OutboxSender:
+    """Delivers outbox messages to Freshdesk in the background.
+
+    Messages are stored before anything is sent, so a slow or rate-limited
+    Freshdesk never blocks a web request and a crash mid-send loses nothing.
+    Each message has an idempotency key: enqueueing the same key twice returns
+    the existing message, and a retry of a reply or note that may already have
+    reached Freshdesk checks the ticket's conversations before posting again.
+    """
+
+    def __init__(self):
+        """Initialize the sender; deliveries run on a single background thread."""
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+        self._lock = threading.Lock()
+        self._drain_pending = False
+
+    def enqueue(self, ticket_id: int, kind: str, payload: Dict[str, Any], idempotency_key: str,
+                response_id: Optional[int] = None, kick: bool = True) -> Dict[str, Any]:
+        """Store a message for delivery and start draining the outbox.
+
+        A message that already exists for the key is returned as it is, except a
+        failed or still pending one, which is updated with the new payload and
+        retried right away.
+
+        Args:
+            ticket_id: The database ID of the ticket
+            kind: One of OUTBOX_KINDS
+            payload: Request body ('body' for replies and notes, plus 'private' for notes;
+                the fields to change for ticket updates)
+            idempotency_key: Key that identifies this delivery
+            response_id: The response being sent, for replies
+            kick: Start a background drain; callers that deliver the message themselves pass False
+
+        Returns:
+            The serialized message, with 'deduplicated' set if it already existed
+        """
+        if kind not in OUTBOX_KINDS:
+            raise ValueError(f"Unknown outbox message kind: {kind}")
+
+        session = get_session()
+        try:
+            with self._lock:
+                message, created = enqueue_outbox_message(session, ticket_id, kind, json.dumps(payload),
+                                                          idempotency_key, response_id)
+                if not created and message.status in ('pending', 'failed'):
+                    message = reset_outbox_message(session, message, json.dumps(payload))
+
+            if created:
+                logger.info(f"Queued {kind} {message.id} for ticket {ticket_id}")
+            result = dict(serialize_message(message), deduplicated=not created)
+        finally:
+            session.close()
+
+        if kick:
+            self.kick()
+        return result
+
+    def get_message(self, message_id: int) -> Optional[Dict[str, Any]]:
+        """Get the serialized status of a message, or None if it doesn't exist."""
+        session = get_session()
+        try:
+            message = get_outbox_message(session, message_id)
+            return serialize_message(message) if message else None
+        finally:
+            session.close()
+
+    def kick(self) -> None:
+        """Drain the outbox on the sender thread, unless a drain is already waiting to run."""
+        with self._lock:
+            if self._drain_pending:
+                return
+            self._drain_pending = True
+        self._executor.submit(self._drain_from_kick)
+
+    def _drain_from_kick(self) -> None:
+        with self._lock:
+            self._drain_pending = False
+        self.drain()
+
+    def recover(self) -> int:
+        """Return messages interrupted by a restart to pending and deliver everything due.
+
+        Returns:
+            Number of messages requeued
+        """
+        session = get_session()
+        try:
+            requeued = requeue_sending_outbox_messages(session)
+        finally:
+            session.close()
+
+        if requeued:
+            logger.info(f"Requeued {requeued} interrupted outbox messages")
+        self.kick()
+        return requeued
+
+    def drain(self) -> int:
+        """Deliver a batch of due messages, oldest first (app.outbox_batch_size, default 20).
+
+        The Freshdesk client spaces the requests out to stay within its rate limit.
+
+        Returns:
+            Number of messages delivered
+        """
+        if get_circuit_breaker('freshdesk').state == OPEN:
+            # Don't use up delivery attempts while Freshdesk is known to be down
+            logger.info("Freshdesk circuit is open, leaving the outbox for the next run")
+            return 0
+
+        batch_size = int(get_config().app.get('outbox_batch_size', 20))
+
+        session = get_session()
+        try:
+            message_ids = [message.id for message in get_due_outbox_messages(session, batch_size)]
+        except Exception as e:
+            logger.error(f"Error reading the outbox: {str(e)}")
+            return 0
+        finally:
+            session.close()
+
+        delivered = 0
+        for message_id in message_ids:
+            message = self.deliver(message_id)
+            if message and message['status'] == 'sent':
+                delivered += 1
+        return delivered
+
+    @traced('outbox.deliver')
+    def deliver(self, message_id: int) -> Optional[Dict[str, Any]]:
+        """Claim and send one message now.
+
+        Returns:
+            The serialized message after the attempt, or None if another sender had it
+        """
+        session = get_session()
+        try:
+            message = claim_outbox_message(session, message_id)
+            if message is None:
+                return None
+            get_current_span().set_attributes({'outbox.id': message_id, 'outbox.kind': message.kind, 'ticket.id': message.ticket_id})
+
+            try:
+                # Deliveries are agent actions, so they go ahead of polling and other background calls
+                with request_priority(INTERACTIVE):
+                    result = self._send(message)
+            except Exception as e:
+                session.rollback()
+                message = finish_outbox_message(session, message, error=str(e), retry_at=self._retry_at(message))
+                if message.status == 'failed':
+                    logger.error(f"Giving up on outbox message {message_id} after {message.attempts} attempts: {str(e)}")
+                else:
+                    logger.warning(f"Outbox message {message_id} failed, retrying at {message.next_attempt_at}: {str(e)}")
+                return serialize_message(message)
+
+            message = finish_outbox_message(session, message, result=json.dumps(result))
+            if message.kind == 'reply' and message.response_id:
+                self._index_reply(session, message)
+            logger.info(f"Delivered outbox message {message_id} ({message.kind}) for ticket {message.ticket_id}")
+            return serialize_message(message)
+        except Exception as e:
+            logger.error(f"Error delivering outbox message {message_id}: {str(e)}")
+            return None
+        finally:
+            session.close()
+
+    def _retry_at(self, message) -> Optional[datetime]:
+        """When to try a failed message again, or None once app.outbox_max_attempts is reached."""
+        settings = get_config().app
+        if message.attempts >= int(settings.get('outbox_max_attempts', 5)):
+            return None
+        delay = float(settings.get('outbox_retry_seconds', 30)) * (2 ** (message.attempts - 1))
+        return datetime.utcnow() + timedelta(seconds=min(delay, MAX_RETRY_DELAY))
+
+    def _send(self, message) -> Dict[str, Any]:
+        """Make the Freshdesk call for a message and return Freshdesk's response."""
+        client = get_freshdesk_client()
+        payload = json.loads(message.payload)
+        freshdesk_id = message.ticket.freshdesk_id
+
+        if message.kind == 'ticket_update':
+            # Setting the same fields twice is harmless, so updates need no duplicate check
+            result = client.update_ticket(freshdesk_id, payload)
+        else:
+            if (message.total_attempts or 0) > 1:
+                # An earlier attempt (even one made before an agent re-sent the message)
+                # may have reached Freshdesk before failing or crashing
+                existing = self._find_delivered(client, freshdesk_id, payload['body'])
+                if existing:
+                    logger.info(f"Outbox message {message.id} was already delivered, not sending it again")
+                    return existing
+
+            if message.kind == 'reply':
+                result = client.reply_to_ticket(freshdesk_id, payload['body'])
+            else:
+                result = client.add_note_to_ticket(freshdesk_id, payload['body'], bool(payload.get('private')))
+
+        if not result:
+            raise RuntimeError(f"Freshdesk did not accept the {message.kind.replace('_', ' ')}")
+        return result
+
+    def _find_delivered(self, client, freshdesk_id: int, body: str) -> Optional[Dict[str, Any]]:
+        """Find a conversation on the ticket with the same text as a message.
+
+        Every page of the thread is read, and a failed lookup raises, so the
+        message stays pending rather than being posted a second time.
+        """
+        expected = _normalize(body)
+        for conversation in client.iter_ticket_conversations(freshdesk_id):
+            if _normalize(conversation.get('body_text') or conversation.get('body')) == expected:
+                return conversation
+        return None
+
+    def _index_reply(self, session, message) -> None:
+        """Index the ticket of a delivered reply so its answer can be reused."""
+        try:
+            from ai.similarity_index import index_ticket
+            index_ticket(session, message.ticket_id)
+        except Exception as e:
+            logger.error(f"Error indexing ticket {message.ticket_id}: {str(e)}")
+
+
+# Process-wide sender, shared by all requests
+_sender = None
+_sender_lock = threading.Lock()
+
+
+def get_outbox_sender() -> OutboxSender:
+    """Get the process-wide outbox sender."""
+    global _sender
+
+    with _sender_lock:
+        if _sender is None:
+            _sender = OutboxSender()
+        return _sender
+
+
+def run_outbox() -> int:
+    """Deliver due outbox messages once (scheduled job).
+
+    Returns:
+        Number of messages delivered
+    """
+    return get_outbox_sender().drain()
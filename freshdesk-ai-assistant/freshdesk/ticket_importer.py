@@ -1,23 +1,35 @@
-import os
-import json
 import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 
-from freshdesk.api_client import FreshdeskClient, create_client_from_config
+import requests
+
+from freshdesk.api_client import FreshdeskClient, get_freshdesk_client
+from utils.config import get_config
+from utils.metrics import counter, histogram
+from utils.tracing import get_current_span, traced
+from database.query_profiler import profiled
 from database.db_operations import (
     get_session, 
     create_ticket, 
     get_ticket_by_freshdesk_id, 
     update_ticket,
     add_conversation,
-    get_conversation_by_freshdesk_id
+    get_conversation_freshdesk_ids
 )
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Import metrics; per-poll counts use count buckets rather than seconds
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000)
+POLL_SECONDS = histogram('import_poll_seconds', 'Duration of a ticket import poll')
+POLL_TICKETS = histogram('import_poll_tickets', 'Tickets fetched per import poll', buckets=COUNT_BUCKETS)
+POLL_CONVERSATIONS = histogram('import_poll_conversations', 'New conversation entries stored per import poll', buckets=COUNT_BUCKETS)
+POLL_FAILURES = counter('import_poll_failures_total', 'Import polls stopped by a failed ticket page')
+TICKETS_IMPORTED = counter('import_tickets_total', 'Tickets imported or refreshed', ('result',))
+CONVERSATIONS_IMPORTED = counter('import_conversations_total', 'New conversation entries stored')
+
 class TicketImporter:
     """Class for importing tickets from Freshdesk into the local database."""
     
@@ -25,19 +37,19 @@ class TicketImporter:
         """Initialize the ticket importer.
         
         Args:
-            freshdesk_client: Optional FreshdeskClient instance. If not provided, one will be created.
+            freshdesk_client: Optional FreshdeskClient instance. If not provided, the shared client is used.
         """
-        self.freshdesk_client = freshdesk_client or create_client_from_config()
+        self.freshdesk_client = freshdesk_client or get_freshdesk_client()
         self.last_poll_time = None
-        
-        # Load configuration
-        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
-        
-        # Get ticket limit from config (default to 25)
-        self.ticket_limit = self.config.get('freshdesk', {}).get('ticket_limit', 25)
+        self.conversations_added = 0
     
+    @property
+    def ticket_limit(self) -> int:
+        """Maximum number of tickets to import on the first poll (default 25), read from the live config."""
+        return int(get_config().freshdesk.get('ticket_limit', 25))
+    
+    @traced('import.poll')
+    @profiled('import.poll')
     def poll_for_tickets(self) -> int:
         """Poll Freshdesk for new or updated tickets.
         
@@ -54,22 +66,58 @@ class TicketImporter:
             # Subsequent polls, get tickets since last poll
             updated_since = self.last_poll_time
         
-        # Get tickets from Freshdesk, limited to the most recent ones
-        tickets = self.freshdesk_client.get_all_tickets(updated_since, limit=self.ticket_limit)
-        logger.info(f"Found {len(tickets)} new or updated tickets (limited to {self.ticket_limit})")
+        # Tickets updated while this poll runs are picked up by the next one
+        poll_started = datetime.utcnow()
+        
+        # The first poll is limited to the most recent tickets. Later polls fetch everything
+        # changed since the last one: the poll time advances past every ticket in the window,
+        # so a ticket left out by the limit would never be fetched again.
+        limit = self.ticket_limit if self.last_poll_time is None else None
         
-        # Process each ticket
+        # Process tickets as their page arrives
+        found_count = 0
         processed_count = 0
-        for ticket_data in tickets:
-            if self._process_ticket(ticket_data):
-                processed_count += 1
+        self.conversations_added = 0
+        try:
+            with POLL_SECONDS.time():
+                for ticket_data in self.freshdesk_client.iter_tickets(updated_since, limit=limit):
+                    found_count += 1
+                    if self._process_ticket(ticket_data):
+                        processed_count += 1
+        except requests.exceptions.RequestException as e:
+            # Keep the old poll time so the next poll fetches the same window again
+            POLL_FAILURES.inc()
+            logger.error(f"Error fetching tickets after {found_count} tickets, retrying on the next poll: {str(e)}")
+            return processed_count
+        finally:
+            POLL_TICKETS.observe(found_count)
+            POLL_CONVERSATIONS.observe(self.conversations_added)
+        
+        if limit:
+            logger.info(f"Found {found_count} new or updated tickets (limited to {limit})")
+        else:
+            logger.info(f"Found {found_count} new or updated tickets")
+        get_current_span().set_attributes({'tickets': found_count, 'conversations': self.conversations_added})
         
         # Update last poll time
-        self.last_poll_time = datetime.utcnow()
+        self.last_poll_time = poll_started
         
         logger.info(f"Processed {processed_count} tickets")
         return processed_count
     
+    def refresh_ticket(self, freshdesk_id: int) -> bool:
+        """Re-import a single ticket and its conversations.
+        
+        Args:
+            freshdesk_id: The Freshdesk ticket ID
+            
+        Returns:
+            True if the ticket was successfully refreshed, False otherwise
+        """
+        logger.info(f"Refreshing ticket {freshdesk_id}")
+        return self._process_ticket({'id': freshdesk_id})
+    
+    @traced('import.ticket')
     def _process_ticket(self, ticket_data: Dict[str, Any]) -> bool:
         """Process a single ticket.
         
@@ -79,6 +127,7 @@ class TicketImporter:
         Returns:
             True if the ticket was successfully processed, False otherwise
         """
+        get_current_span().set_attribute('freshdesk.ticket_id', ticket_data.get('id'))
         try:
             # Get a database session
             session = get_session()
@@ -115,28 +164,52 @@ class TicketImporter:
                 logger.info(f"Updating existing ticket: {ticket_data['id']}")
                 update_ticket(session, existing_ticket, ticket_data)
                 ticket_id = existing_ticket.id
+                requester_email = existing_ticket.requester_email
             else:
                 # Create new ticket
                 logger.info(f"Creating new ticket: {ticket_data['id']}")
                 new_ticket = create_ticket(session, ticket_data)
                 ticket_id = new_ticket.id
+                requester_email = new_ticket.requester_email
             
             # Get and store conversation history
-            self._process_conversations(ticket_id, ticket_data['id'])
+            self._process_conversations(ticket_id, ticket_data['id'], requester_email)
+            
+            # Keep the similar-ticket and cluster indexes current
+            self._update_indexes(session, ticket_id, ticket_data['id'])
             
             session.close()
+            TICKETS_IMPORTED.inc(result='processed')
             return True
         except Exception as e:
             logger.error(f"Error processing ticket {ticket_data.get('id', 'unknown')}: {str(e)}")
+            TICKETS_IMPORTED.inc(result='failed')
             return False
     
-    def _process_conversations(self, ticket_id: int, freshdesk_id: int) -> None:
+    def _update_indexes(self, session, ticket_id: int, freshdesk_id: int) -> None:
+        """Refresh a ticket in the in-memory similarity and cluster indexes.
+        
+        A failure here is logged but doesn't fail the import.
+        """
+        from ai.similarity_index import index_ticket
+        from ai.clustering import cluster_ticket
+        
+        for update in (index_ticket, cluster_ticket):
+            try:
+                update(session, ticket_id)
+            except Exception as e:
+                logger.error(f"Error indexing ticket {freshdesk_id}: {str(e)}")
+    
+    @traced('import.conversations')
+    def _process_conversations(self, ticket_id: int, freshdesk_id: int, requester_email: Optional[str] = None) -> None:
         """Process and store conversation history for a ticket.
         
         Args:
             ticket_id: Local database ticket ID
             freshdesk_id: Freshdesk ticket ID
+            requester_email: Email of the ticket requester, used to tag customer messages
         """
+        get_current_span().set_attribute('freshdesk.ticket_id', freshdesk_id)
         try:
             # Get conversations from Freshdesk
             conversations = self.freshdesk_client.get_ticket_conversations(freshdesk_id)
@@ -151,31 +224,53 @@ class TicketImporter:
             session = get_session()
             
             # Store each conversation, but only if it doesn't already exist
+            existing_ids = get_conversation_freshdesk_ids(session, ticket_id)
+            added = 0
             for conversation_data in conversations:
                 # Check if this conversation already exists
                 if 'id' in conversation_data and conversation_data['id']:
-                    existing_conversation = get_conversation_by_freshdesk_id(session, ticket_id, conversation_data['id'])
-                    if existing_conversation:
+                    if conversation_data['id'] in existing_ids:
                         logger.debug(f"Conversation {conversation_data['id']} already exists, skipping")
                         continue
                 
                 # Add the new conversation
-                add_conversation(session, ticket_id, conversation_data)
+                add_conversation(session, ticket_id, conversation_data, requester_email)
+                added += 1
             
             session.close()
+            self.conversations_added += added
+            CONVERSATIONS_IMPORTED.inc(added)
+            
+            # Long threads get their rolling summary brought up to date in the background
+            summarize_after = int(get_config().openai.get('summarize_after_messages', 6))
+            if added and summarize_after and len(conversations) > summarize_after:
+                from ai.generation_queue import get_generation_queue
+                get_generation_queue().submit(ticket_id, 'summary')
         except Exception as e:
             logger.error(f"Error processing conversations for ticket {freshdesk_id}: {str(e)}")
 
 
+# Start of the last complete poll, kept across runs so each poll only fetches what changed since
+_last_poll_time = None
+
+
 def run_importer() -> int:
     """Run the ticket importer once.
     
     Returns:
         Number of tickets imported or updated
     """
+    global _last_poll_time
+    
     importer = TicketImporter()
-    return importer.poll_for_tickets()
+    importer.last_poll_time = _last_poll_time
+    processed_count = importer.poll_for_tickets()
+    _last_poll_time = importer.last_poll_time
+    return processed_count
 
 
 if __name__ == "__main__":
+    from utils.logger import setup_logger
+    
+    setup_logger()
     run_importer()
@@ -0,0 +1,60 @@
+import pytest
+import requests
+
+import freshdesk.api_client as api_client
+from freshdesk.api_client import FreshdeskClient, get_freshdesk_client, get_shared_freshdesk_client
+
+
+@pytest.fixture
+def connection_tests(monkeypatch):
+    """Count connection tests instead of calling Freshdesk, starting from no shared client."""
+    calls = []
+    monkeypatch.setattr(api_client, '_client', None)
+    monkeypatch.setattr(api_client, '_client_config_version', None)
+    monkeypatch.setattr(FreshdeskClient, 'test_connection', lambda self: calls.append(self.api_key) or True)
+    return calls
+
+
+def test_shared_client_is_reused_and_health_checked_once(config, connection_tests):
+    config.freshdesk['health_check_ttl'] = 300
+
+    first = get_freshdesk_client()
+    second = get_freshdesk_client()
+
+    assert first is second is get_shared_freshdesk_client()
+    assert connection_tests == ['test-key']
+
+
+def test_shared_client_is_rebuilt_when_credentials_change(config, connection_tests):
+    first = get_freshdesk_client()
+
+    config.freshdesk['api_key'] = 'new-key'
+    config.version += 1
+    second = get_freshdesk_client()
+
+    assert second is not first
+    assert second.api_key == 'new-key'
+    assert connection_tests == ['test-key', 'new-key']
+
+
+def test_reloaded_settings_apply_to_the_shared_client(config, connection_tests):
+    client = get_freshdesk_client()
+
+    config.freshdesk.update({'rate_limit_delay': 0.25, 'max_retries': 1})
+    config.version += 1
+
+    assert get_freshdesk_client() is client
+    assert (client.rate_limit_delay, client.max_retries) == (0.25, 1)
+
+
+def test_failed_health_check_is_retried_on_next_use(config, monkeypatch, connection_tests):
+    def unreachable(self):
+        raise requests.exceptions.ConnectionError("unreachable")
+
+    monkeypatch.setattr(FreshdeskClient, 'test_connection', unreachable)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        get_freshdesk_client()
+
+    monkeypatch.setattr(FreshdeskClient, 'test_connection', lambda self: connection_tests.append('retry') or True)
+    assert get_freshdesk_client().healthy
+    assert connection_tests == ['retry']
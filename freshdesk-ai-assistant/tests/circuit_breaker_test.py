@@ -0,0 +1,93 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils.circuit_breaker as circuit_breaker
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker('freshdesk', failure_rate=0.5, min_calls=4, window_seconds=60, open_seconds=30)
+
+
+def fail(breaker, times):
+    for _ in range(times):
+        breaker.before_call()
+        breaker.record_failure()
+
+
+def test_opens_once_failure_rate_is_reached_with_enough_calls(breaker):
+    fail(breaker, 3)
+    assert breaker.state == CLOSED
+
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+    # 4 failures out of 5 calls
+    fail(breaker, 1)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    assert breaker.snapshot()['rejected'] == 1
+
+
+def test_old_failures_leave_the_window(breaker, clock):
+    fail(breaker, 3)
+    clock.now += 61
+    fail(breaker, 1)
+
+    assert breaker.state == CLOSED
+
+
+def test_half_open_lets_one_probe_through_and_closes_on_success(breaker, clock):
+    fail(breaker, 4)
+    clock.now += 30
+    assert breaker.state == HALF_OPEN
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    breaker.before_call()
+
+
+def test_failed_probe_opens_the_breaker_again(breaker, clock):
+    fail(breaker, 4)
+    clock.now += 30
+    breaker.before_call()
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert breaker.snapshot()['times_opened'] == 2
+    clock.now += 29
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_stale_probe_does_not_block_probing_for_good(breaker, clock):
+    fail(breaker, 4)
+    clock.now += 30
+    breaker.before_call()
+
+    # The probe never reported back
+    clock.now += 30
+    breaker.before_call()
@@ -0,0 +1,49 @@
+from ai.clustering import MinHashLSH
+from ai.generation_service import fan_out_response
+from database.db_operations import get_session, get_responses_for_ticket, create_response, update_response
+from database.models import Ticket
+
+OUTAGE = "Cannot connect to the VPN since this morning, the client says authentication server unreachable"
+
+
+def test_near_duplicates_are_grouped():
+    index = MinHashLSH(num_perm=128, bands=32, threshold=0.5)
+    index.add(1, OUTAGE)
+    index.add(2, OUTAGE + " please help")
+    index.add(3, "Cannot connect to the VPN since this morning, the client says authentication server unreachable again")
+    index.add(4, "Invoice for March shows the wrong VAT number for our company")
+
+    assert index.clusters() == [[1, 2, 3]]
+    assert index.cluster_of(4) == [4]
+
+
+def test_removed_and_replaced_tickets_leave_their_cluster():
+    index = MinHashLSH()
+    index.add(1, OUTAGE)
+    index.add(2, OUTAGE)
+    index.add(3, OUTAGE)
+
+    index.remove(2)
+    index.add(3, "Printer on the second floor jams on every duplex job")
+
+    assert index.clusters() == []
+    assert len(index) == 2
+
+
+def test_fan_out_keeps_drafts_agents_are_working_on(db):
+    session = get_session()
+    try:
+        source = Ticket(freshdesk_id=1, subject='VPN down', requester_name='Sam Lee')
+        member = Ticket(freshdesk_id=2, subject='VPN down', requester_name='Alex Kim')
+        session.add_all([source, member])
+        session.commit()
+        draft = create_response(session, member.id, 'Hi Alex, generated earlier')
+        update_response(session, draft.id, 'Hi Alex, we are looking into it')
+
+        copied = fan_out_response(session, source, 'Hi Sam, the VPN is back up.', '[]', [source.id, member.id])
+
+        responses = get_responses_for_ticket(session, member.id)
+        assert copied == [member.id]
+        assert [r.final_content for r in responses] == ['Hi Alex, the VPN is back up.', 'Hi Alex, we are looking into it']
+    finally:
+        session.close()
@@ -0,0 +1,92 @@
+import os
+import json
+
+import pytest
+
+from utils.config import ConfigError, ConfigManager, validate_config
+
+
+def write_config(path, mtime, **app):
+    """Write a valid config.json with the given app settings and pin its mtime."""
+    path.write_text(json.dumps({
+        'freshdesk': {'domain': 'test.freshdesk.com', 'api_key': 'key'},
+        'openai': {'api_key': 'key'},
+        'app': app
+    }))
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    path = tmp_path / 'config.json'
+    write_config(path, 1000, poll_interval_seconds=300)
+    return path
+
+
+def test_reload_picks_up_changes_and_notifies_listeners(config_file):
+    manager = ConfigManager(str(config_file), check_interval=0)
+    changes = []
+    manager.add_reload_listener(lambda old, new: changes.append((old.version, new.version)))
+    assert manager.get().app['poll_interval_seconds'] == 300
+
+    write_config(config_file, 2000, poll_interval_seconds=60)
+    config = manager.get()
+
+    assert config.app['poll_interval_seconds'] == 60
+    assert config.version == 2
+    assert changes == [(1, 2)]
+
+
+def test_invalid_edit_keeps_the_last_good_config(config_file):
+    manager = ConfigManager(str(config_file), check_interval=0)
+    good = manager.get()
+    listener_calls = []
+    manager.add_reload_listener(lambda old, new: listener_calls.append(new))
+
+    write_config(config_file, 2000, poll_interval_seconds=-5)
+    assert manager.get() is good
+
+    config_file.write_text('{"freshdesk": ')
+    os.utime(config_file, (3000, 3000))
+    assert manager.get() is good
+    assert listener_calls == []
+
+
+def test_failing_listener_does_not_block_others(config_file):
+    manager = ConfigManager(str(config_file), check_interval=0)
+    manager.get()
+    seen = []
+
+    def broken(old, new):
+        raise RuntimeError("listener bug")
+
+    manager.add_reload_listener(broken)
+    manager.add_reload_listener(lambda old, new: seen.append(new.version))
+    write_config(config_file, 2000, poll_interval_seconds=60)
+    manager.get()
+
+    assert seen == [2]
+
+
+def test_invalid_first_load_raises(tmp_path):
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps({'freshdesk': {}, 'openai': {}, 'app': {}}))
+
+    with pytest.raises(ConfigError, match='freshdesk.domain'):
+        ConfigManager(str(path)).get()
+
+
+def test_reload_interval_is_read_from_the_config(config_file):
+    manager = ConfigManager(str(config_file), check_interval=0)
+    manager.get()
+
+    write_config(config_file, 2000, config_reload_seconds=30)
+    manager.get()
+
+    assert manager.check_interval == 30
+
+
+def test_example_config_is_valid():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config_example.json')
+    with open(path) as f:
+        validate_config(json.load(f))
@@ -0,0 +1,60 @@
+import os
+import sys
+import copy
+
+import pytest
+
+# Make the application packages importable when pytest runs from any directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import config as config_module
+from utils.config import Config, ConfigManager
+
+# Smallest valid configuration; tests add the settings they exercise. No section may be
+# empty, or Config.app and friends hand out a fresh dict and edits to it are lost.
+TEST_CONFIG = {
+    'freshdesk': {'domain': 'test.freshdesk.com', 'api_key': 'test-key'},
+    'openai': {'api_key': 'test-key'},
+    'app': {'debug': False}
+}
+
+
+@pytest.fixture(autouse=True)
+def config(monkeypatch):
+    """Serve every test a fixed configuration instead of config.json.
+
+    Tests change settings by editing the sections of the returned Config.
+    """
+    manager = ConfigManager(path=os.devnull)
+    manager._config = Config(copy.deepcopy(TEST_CONFIG))
+    manager._last_check = float('inf')
+    monkeypatch.setattr(config_module, '_manager', manager)
+    return manager._config
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the database layer at an empty SQLite file for the duration of a test."""
+    from sqlalchemy import create_engine
+    import database.models as models
+
+    original = models._engine
+    engine = create_engine(f"sqlite:///{tmp_path / 'tickets.db'}")
+    models._instrument_engine(engine)
+    monkeypatch.setattr(models, '_engine', engine)
+    models.Session.configure(bind=engine)
+    models.init_db()
+    yield engine
+    models.Session.configure(bind=original)
+    engine.dispose()
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    """Flask test client for the app, on the test database and without log files."""
+    import app as app_module
+
+    monkeypatch.setattr(app_module, 'setup_logger', lambda: None)
+    flask_app = app_module.create_app()
+    flask_app.config['TESTING'] = True
+    return flask_app.test_client()
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+import requests
+
+from freshdesk.api_client import FreshdeskClient
+from freshdesk.http_cache import HTTPCache
+
+URL = 'https://test.freshdesk.com/api/v2/tickets/7'
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None, headers=None):
+        self.status_code = status_code
+        self.text = json.dumps(body) if body is not None else ''
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error")
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    """Client with an HTTP cache whose requests are answered from the `answers` list."""
+    client = FreshdeskClient('test.freshdesk.com', 'key', check_connection=False)
+    client.http_cache = HTTPCache(max_entries=10)
+    client.answers = []
+    client.sent_headers = []
+
+    def make_request(method, url, **kwargs):
+        client.sent_headers.append(kwargs['headers'])
+        return client.answers.pop(0)
+
+    monkeypatch.setattr(client, '_make_request', make_request)
+    return client
+
+
+def test_not_modified_is_served_from_the_cache(client):
+    client.answers = [FakeResponse(200, {'id': 7, 'subject': 'VPN down'}, {'ETag': 'W/"v1"'}),
+                      FakeResponse(304)]
+
+    assert client._get_json(URL) == {'id': 7, 'subject': 'VPN down'}
+    assert client._get_json(URL) == {'id': 7, 'subject': 'VPN down'}
+
+    assert 'If-None-Match' not in client.sent_headers[0]
+    assert client.sent_headers[1]['If-None-Match'] == 'W/"v1"'
+    stats = client.http_cache.get_stats()
+    assert (stats['misses'], stats['not_modified']) == (1, 1)
+    assert stats['bytes_saved'] > 0
+
+
+def test_changed_resource_replaces_the_cached_copy(client):
+    client.answers = [FakeResponse(200, {'subject': 'old'}, {'ETag': '"v1"'}),
+                      FakeResponse(200, {'subject': 'new'}, {'ETag': '"v2"'}),
+                      FakeResponse(304)]
+
+    client._get_json(URL)
+    assert client._get_json(URL) == {'subject': 'new'}
+    assert client._get_json(URL) == {'subject': 'new'}
+    assert client.sent_headers[2]['If-None-Match'] == '"v2"'
+
+
+def test_responses_without_validators_are_not_cached(client):
+    client.answers = [FakeResponse(200, {'subject': 'VPN down'}), FakeResponse(200, {'subject': 'VPN down'})]
+
+    client._get_json(URL)
+    client._get_json(URL)
+
+    assert 'If-None-Match' not in client.sent_headers[1]
+    assert client.http_cache.get_stats()['uncacheable'] == 2
+
+
+def test_least_recently_validated_entries_are_evicted(client):
+    client.http_cache.max_entries = 2
+    for ticket_id in (1, 2, 3):
+        client.answers.append(FakeResponse(200, {'id': ticket_id}, {'ETag': f'"{ticket_id}"'}))
+        client._get_json(f'{URL[:-1]}{ticket_id}')
+
+    assert client.http_cache.lookup(f'{URL[:-1]}1') is None
+    assert client.http_cache.lookup(f'{URL[:-1]}3')['etag'] == '"3"'
@@ -0,0 +1,73 @@
+import pytest
+
+from utils.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_counters_and_gauges_render_one_sample_per_label_set(registry):
+    requests_total = registry.counter('requests_total', 'Requests', ('lane',))
+    requests_total.inc(lane='interactive')
+    requests_total.inc(2, lane='background')
+    registry.gauge('queue_depth', 'Queued jobs').set(3)
+
+    assert registry.render().splitlines() == [
+        '# HELP queue_depth Queued jobs',
+        '# TYPE queue_depth gauge',
+        'queue_depth 3',
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{lane="background"} 2',
+        'requests_total{lane="interactive"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert lines[2:] == [
+        'latency_seconds_bucket{le="0.1"} 2',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 2.65',
+        'latency_seconds_count 4',
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    registry.counter('errors_total', 'Errors', ('message',)).inc(message='bad "quote"\nline')
+
+    assert 'errors_total{message="bad \\"quote\\"\\nline"} 1' in registry.render()
+
+
+def test_metrics_are_registered_once(registry):
+    jobs_total = registry.counter('jobs_total', 'Jobs', ('kind',))
+
+    assert registry.counter('jobs_total', 'Jobs', ('kind',)) is jobs_total
+    with pytest.raises(ValueError):
+        registry.gauge('jobs_total', 'Jobs', ('kind',))
+
+
+def test_collectors_run_on_scrape_and_failures_are_contained(registry):
+    depth = registry.gauge('queue_depth', 'Queued jobs')
+    registry.add_collector(lambda: 1 / 0)
+    registry.add_collector(lambda: depth.set(7))
+
+    assert 'queue_depth 7' in registry.render()
+
+
+def test_metrics_endpoint_serves_the_text_format(client):
+    client.get('/api/cache/stats')
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/plain; version=0.0.4')
+    assert 'http_request_seconds_count{method="GET",endpoint="main.cache_stats_api",status="200"}' in response.get_data(as_text=True)
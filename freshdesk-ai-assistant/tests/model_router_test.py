@@ -0,0 +1,66 @@
+import pytest
+
+import ai.model_router as model_router
+from ai.openai_client import OpenAIClient
+from ai.response_cache import ResponseCache
+from utils.config import Config
+
+
+class DictCache:
+    """In-memory stand-in for ResponseCache."""
+
+    make_key = staticmethod(ResponseCache.make_key)
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def set(self, key, response):
+        self.entries[key] = response
+
+    def record_bypass(self):
+        pass
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """An OpenAI client with a cache whose small model answers 'bad' and large model 'good' by default."""
+    config = Config({'freshdesk': {}, 'openai': {'small_model': 'small', 'large_model': 'large'}, 'app': {}})
+    client = OpenAIClient('key', response_cache=DictCache())
+    client.calls = []
+    client.answers = {'small': 'bad', 'large': 'good'}
+
+    def post(payload):
+        client.calls.append(payload['model'])
+        content = client.answers[payload['model']]
+        return {'choices': [{'message': {'role': 'assistant', 'content': content}}], 'usage': {}}
+
+    monkeypatch.setattr(client, '_post', post)
+    monkeypatch.setattr(model_router, 'get_config', lambda: config)
+    monkeypatch.setattr(model_router, 'get_openai_client', lambda: client)
+    return client
+
+
+def test_rejected_small_model_output_is_not_cached(client):
+    def validate(text):
+        return text == 'good'
+
+    assert model_router.complete_task('summary', 'prompt', validate=validate) == 'good'
+    assert model_router.complete_task('summary', 'prompt', validate=validate) == 'good'
+
+    # The small model is asked again on the retry; the escalated answer comes from the cache
+    assert client.calls == ['small', 'large', 'small']
+    cached = [data['choices'][0]['message']['content'] for data in client.response_cache.entries.values()]
+    assert cached == ['good']
+
+
+def test_rejected_escalated_output_is_not_cached(client):
+    client.answers['large'] = 'bad'
+
+    assert model_router.complete_task('summary', 'prompt', validate=lambda text: text == 'good') == 'bad'
+    assert model_router.complete_task('summary', 'prompt', validate=lambda text: text == 'good') == 'bad'
+
+    assert client.calls == ['small', 'large', 'small', 'large']
+    assert client.response_cache.entries == {}
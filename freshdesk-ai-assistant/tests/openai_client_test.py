@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ai.openai_client as openai_client
+from ai.openai_client import OpenAIClient, OpenAIError
+from utils.rate_limiter import RateLimiter
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """A client with a 10k tokens/minute budget and no retry delay, whose circuit breaker is always closed."""
+    breaker = SimpleNamespace(before_call=lambda: None, record_failure=lambda: None, record_success=lambda: None)
+    monkeypatch.setattr(openai_client, 'get_circuit_breaker', lambda name: breaker)
+    client = OpenAIClient('key', max_retries=3, rate_limiter=RateLimiter(tokens_per_minute=10000))
+    monkeypatch.setattr(client, '_retry_delay', lambda attempt, response=None: 0)
+    return client
+
+
+def respond_with(client, monkeypatch, *status_codes):
+    responses = iter(SimpleNamespace(status_code=code, text='', headers={}) for code in status_codes)
+    monkeypatch.setattr(client.session, 'post', lambda *args, **kwargs: next(responses))
+
+
+def test_retries_reserve_tokens_once(client, monkeypatch):
+    respond_with(client, monkeypatch, 500, 500, 200)
+
+    client._send({'model': 'gpt-4o-mini'}, 3000)
+
+    assert client.rate_limiter.tokens.level == pytest.approx(7000, abs=5)
+
+
+def test_failed_request_gives_its_tokens_back(client, monkeypatch):
+    respond_with(client, monkeypatch, 500, 500, 500, 500)
+
+    with pytest.raises(OpenAIError):
+        client._send({'model': 'gpt-4o-mini'}, 3000)
+
+    assert client.rate_limiter.tokens.level == pytest.approx(10000, abs=5)
+
+
+def stream_with(client, monkeypatch, lines):
+    response = SimpleNamespace(status_code=200, text='', headers={}, closed=False)
+    response.iter_lines = lambda decode_unicode=True: iter(lines)
+    response.close = lambda: setattr(response, 'closed', True)
+    monkeypatch.setattr(client.session, 'post', lambda *args, **kwargs: response)
+    return response
+
+
+def chunk(text):
+    return 'data: {"choices": [{"delta": {"content": "%s"}}]}' % text
+
+
+MESSAGES = [{'role': 'user', 'content': 'x' * 400}]
+
+
+def test_completed_stream_settles_with_the_reported_usage(client, monkeypatch):
+    stream_with(client, monkeypatch, [chunk('Hi '), chunk('Sam'),
+                                      'data: {"choices": [], "usage": {"total_tokens": 250}}', 'data: [DONE]'])
+
+    assert ''.join(client.stream_chat(MESSAGES, max_tokens=3000)) == 'Hi Sam'
+    assert client.rate_limiter.tokens.level == pytest.approx(10000 - 250, abs=5)
+
+
+def test_disconnected_stream_releases_the_unused_reservation(client, monkeypatch):
+    response = stream_with(client, monkeypatch, [chunk('Hi '), chunk('Sam'), 'data: [DONE]'])
+
+    stream = client.stream_chat(MESSAGES, max_tokens=3000)
+    assert next(stream) == 'Hi '
+    assert client.rate_limiter.tokens.level == pytest.approx(10000 - 3100, abs=5)
+    # The web client goes away: the generator is closed before the stream ends
+    stream.close()
+
+    assert response.closed
+    assert client.rate_limiter.tokens.level == pytest.approx(10000 - 101, abs=5)
@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+import freshdesk.outbox as outbox
+from database.db_operations import get_session, claim_outbox_message, get_outbox_message
+from database.models import Ticket, Response
+from freshdesk.api_client import FreshdeskClient
+from freshdesk.outbox import OutboxSender, reply_idempotency_key
+
+
+class FakeFreshdesk:
+    """Freshdesk stand-in that keeps posted replies as the ticket's conversations."""
+
+    def __init__(self):
+        self.conversations = []
+        self.posts = 0
+        self.lookups = 0
+        # Callables run in place of the next reply_to_ticket / lookup calls
+        self.reply_failures = []
+        self.lookup_failures = []
+
+    def reply_to_ticket(self, freshdesk_id, body):
+        self.posts += 1
+        self.conversations.append({'id': len(self.conversations) + 1, 'body': body})
+        if self.reply_failures:
+            return self.reply_failures.pop(0)()
+        return {'id': len(self.conversations), 'body': body}
+
+    def iter_ticket_conversations(self, freshdesk_id):
+        self.lookups += 1
+        if self.lookup_failures:
+            self.lookup_failures.pop(0)()
+        return iter(list(self.conversations))
+
+
+def timed_out():
+    """A POST that reached Freshdesk but whose answer was lost."""
+    return None
+
+
+def connection_error():
+    raise requests.exceptions.ConnectionError("Freshdesk unreachable")
+
+
+@pytest.fixture
+def freshdesk(db, config, monkeypatch):
+    config.app.update({'outbox_max_attempts': 1, 'outbox_retry_seconds': 30})
+    client = FakeFreshdesk()
+    monkeypatch.setattr(outbox, 'get_freshdesk_client', lambda: client)
+    return client
+
+
+@pytest.fixture
+def response_id(db):
+    session = get_session()
+    try:
+        ticket = Ticket(freshdesk_id=501, subject='Printer offline')
+        session.add(ticket)
+        session.flush()
+        response = Response(ticket_id=ticket.id, draft_content='Please restart the printer.')
+        session.add(response)
+        session.commit()
+        return response.id
+    finally:
+        session.close()
+
+
+def send_reply(sender, response_id, body='Please restart the printer.'):
+    return sender.enqueue(1, 'reply', {'body': body}, reply_idempotency_key(response_id),
+                          response_id=response_id, kick=False)
+
+
+def test_enqueue_is_idempotent(freshdesk, response_id):
+    sender = OutboxSender()
+
+    first = send_reply(sender, response_id)
+    second = send_reply(sender, response_id)
+
+    assert second['id'] == first['id']
+    assert (first['deduplicated'], second['deduplicated']) == (False, True)
+
+
+def test_failed_delivery_is_retried_with_backoff(freshdesk, response_id, config):
+    config.app['outbox_max_attempts'] = 2
+    freshdesk.reply_failures.append(connection_error)
+    sender = OutboxSender()
+    message = send_reply(sender, response_id)
+
+    retried = sender.deliver(message['id'])
+    assert retried['status'] == 'pending'
+    assert datetime.fromisoformat(retried['next_attempt_at']) > datetime.utcnow() + timedelta(seconds=25)
+
+    # Not due yet, so a drain leaves it alone
+    assert sender.drain() == 0
+
+    sent = sender.deliver(message['id'])
+    assert sent['status'] == 'sent'
+    assert sent['attempts'] == 2
+
+
+def test_interrupted_sends_are_requeued(freshdesk, response_id):
+    sender = OutboxSender()
+    message = send_reply(sender, response_id)
+    session = get_session()
+    try:
+        claim_outbox_message(session, message['id'])
+    finally:
+        session.close()
+
+    assert outbox.requeue_sending_outbox_messages(get_session()) == 1
+    assert sender.get_message(message['id'])['status'] == 'pending'
+
+
+def test_resend_after_partial_failure_does_not_post_twice(freshdesk, response_id):
+    sender = OutboxSender()
+    freshdesk.reply_failures.append(timed_out)
+
+    message = send_reply(sender, response_id)
+    assert sender.deliver(message['id'])['status'] == 'failed'
+
+    # The agent sends the reply again; it had in fact reached Freshdesk the first time
+    send_reply(sender, response_id)
+    resent = sender.deliver(message['id'])
+
+    assert resent['status'] == 'sent'
+    assert (freshdesk.posts, freshdesk.lookups) == (1, 1)
+    session = get_session()
+    try:
+        assert get_outbox_message(session, message['id']).total_attempts == 2
+        assert session.get(Response, response_id).is_sent
+    finally:
+        session.close()
+
+
+def test_failed_duplicate_check_keeps_the_message_queued(freshdesk, response_id, config):
+    config.app['outbox_max_attempts'] = 3
+    freshdesk.reply_failures.append(timed_out)
+    freshdesk.lookup_failures.append(connection_error)
+    sender = OutboxSender()
+    message = send_reply(sender, response_id)
+
+    assert sender.deliver(message['id'])['status'] == 'pending'
+    # The lookup fails: the message must stay queued rather than be posted again
+    assert sender.deliver(message['id'])['status'] == 'pending'
+    assert freshdesk.posts == 1
+
+
+def test_conversation_lookup_reads_every_page(monkeypatch):
+    client = FreshdeskClient('test.freshdesk.com', 'key', check_connection=False)
+    pages = {1: [{'id': i} for i in range(100)], 2: [{'id': 100}]}
+    requested = []
+
+    def get_json(url):
+        page = int(url.split('page=')[1].split('&')[0])
+        requested.append(page)
+        return pages[page]
+
+    monkeypatch.setattr(client, '_get_json', get_json)
+
+    assert [c['id'] for c in client.iter_ticket_conversations(7)][-1] == 100
+    assert requested == [1, 2]
+
+
+def test_conversation_lookup_raises_on_error(monkeypatch):
+    client = FreshdeskClient('test.freshdesk.com', 'key', check_connection=False)
+
+    def get_json(url):
+        raise requests.exceptions.HTTPError("500 Server Error")
+
+    monkeypatch.setattr(client, '_get_json', get_json)
+
+    with pytest.raises(requests.exceptions.RequestException):
+        list(client.iter_ticket_conversations(7))
@@ -0,0 +1,50 @@
+from types import SimpleNamespace
+
+import pytest
+
+import ai.generation_queue
+import ai.pregeneration as pregeneration
+from utils.circuit_breaker import CLOSED
+from utils.config import Config
+
+# Size of a typical combined draft: ~700 tokens of system message, the ticket and 1500 completion tokens
+DRAFT_TOKENS = 2800
+
+
+class FakeQueue:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, ticket_id, kind):
+        self.submitted.append((ticket_id, kind))
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    """Run pre-generation against five waiting tickets with the default budget and a fresh bucket."""
+    config = Config({'freshdesk': {}, 'openai': {}, 'app': {'pregenerate_enabled': True}})
+    tickets = [SimpleNamespace(id=i, freshdesk_id=100 + i) for i in range(1, 6)]
+    fake_queue = FakeQueue()
+
+    monkeypatch.setattr(pregeneration, '_budget', None)
+    monkeypatch.setattr(pregeneration, 'get_config', lambda: config)
+    monkeypatch.setattr(pregeneration, 'get_circuit_breaker', lambda name: SimpleNamespace(state=CLOSED))
+    monkeypatch.setattr(pregeneration, 'get_session', lambda: SimpleNamespace(close=lambda: None))
+    monkeypatch.setattr(pregeneration, 'get_tickets_for_pregeneration', lambda session, limit: tickets[:limit])
+    monkeypatch.setattr(pregeneration, 'get_conversations_for_ticket', lambda session, ticket_id: [])
+    monkeypatch.setattr(pregeneration, 'estimate_draft_tokens', lambda ticket, conversations: DRAFT_TOKENS)
+    monkeypatch.setattr(ai.generation_queue, 'get_generation_queue', lambda: fake_queue)
+    return fake_queue
+
+
+def test_default_budget_queues_a_full_batch(queue):
+    assert pregeneration.run_pregeneration() == 5
+    assert [ticket_id for ticket_id, _ in queue.submitted] == [1, 2, 3, 4, 5]
+
+
+def test_budget_is_hourly_not_per_minute(queue):
+    budget = pregeneration._get_budget(100000)
+
+    # 35 drafts of 2,800 tokens fit in 100k tokens an hour; the 36th has to wait for the refill
+    assert [pregeneration._take_from_budget(budget, DRAFT_TOKENS) for _ in range(36)] == [True] * 35 + [False]
+    assert pregeneration.run_pregeneration() == 0
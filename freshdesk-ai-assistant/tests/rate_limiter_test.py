@@ -0,0 +1,69 @@
+from types import SimpleNamespace
+
+import pytest
+
+import utils.rate_limiter as rate_limiter
+from utils.rate_limiter import BACKGROUND, INTERACTIVE, PriorityRateLimiter, current_priority, request_priority
+
+
+class Clock:
+    """Fake clock whose sleep advances time and can run a callback, like another thread would."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.on_sleep = None
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+        if self.on_sleep is not None:
+            callback, self.on_sleep = self.on_sleep, None
+            callback()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, 'time', SimpleNamespace(monotonic=clock.monotonic, sleep=clock.sleep))
+    return clock
+
+
+def test_background_requests_leave_the_reserve_free(clock):
+    limiter = PriorityRateLimiter(min_interval=1.0, interactive_reserve=0.5)
+    limiter.acquire(INTERACTIVE)
+
+    start = clock.now
+    limiter.acquire(INTERACTIVE)
+    assert clock.now - start == pytest.approx(1.0)
+
+    start = clock.now
+    limiter.acquire(BACKGROUND)
+    assert clock.now - start == pytest.approx(2.0)
+
+
+def test_interactive_request_overtakes_a_waiting_background_request(clock):
+    limiter = PriorityRateLimiter(min_interval=1.0, interactive_reserve=0.5)
+    limiter.acquire(BACKGROUND)
+    order = []
+
+    def interactive_arrives():
+        limiter.acquire(INTERACTIVE)
+        order.append(INTERACTIVE)
+
+    clock.on_sleep = interactive_arrives
+    limiter.acquire(BACKGROUND)
+    order.append(BACKGROUND)
+
+    assert order == [INTERACTIVE, BACKGROUND]
+    stats = limiter.get_stats()
+    assert (stats[INTERACTIVE]['requests'], stats[BACKGROUND]['requests']) == (1, 2)
+    assert stats[BACKGROUND]['waiting'] == 0
+
+
+def test_request_priority_is_scoped_to_the_block():
+    assert current_priority() == BACKGROUND
+    with request_priority(INTERACTIVE):
+        assert current_priority() == INTERACTIVE
+    assert current_priority() == BACKGROUND
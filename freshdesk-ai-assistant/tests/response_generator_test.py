@@ -0,0 +1,138 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import ai.response_generator as response_generator
+from ai.openai_client import OpenAIError
+from ai.response_generator import format_conversation_history, generate_combined_response, parse_combined_response
+from utils.text_processing import estimate_tokens
+
+
+@pytest.mark.parametrize('text', [
+    'not json',
+    '["a list"]',
+    '{"response": "Hi Sam"}',
+    '{"response": "Hi Sam", "follow_up_questions": [], "extra": 1}',
+    '{"response": "  ", "follow_up_questions": []}',
+    '{"response": "Hi Sam", "follow_up_questions": "Which printer?"}',
+    '{"response": "Hi Sam", "follow_up_questions": [42]}',
+])
+def test_parse_rejects_malformed_output(text):
+    assert parse_combined_response(text) is None
+
+
+def test_parse_accepts_exactly_the_requested_fields():
+    text = json.dumps({'response': '**Hi Sam**, please restart the router.', 'follow_up_questions': ['Which model?', ' '],
+                       'tech_instructions': 'Check the DHCP lease.'})
+
+    result = parse_combined_response(text, include_tech_instructions=True)
+
+    assert result == {
+        'response': 'Hi Sam, please restart the router.',
+        'follow_up_questions': '["Which model?"]',
+        'tech_instructions': 'Check the DHCP lease.'
+    }
+    assert parse_combined_response(text) is None
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    """Answer complete_task() per task from a dict, recording the tasks asked for."""
+    answers = {}
+    tasks = []
+
+    def complete_task(task, prompt, system_message, validate=None, **kwargs):
+        tasks.append(task)
+        return answers[task]
+
+    for name in ('create_combined_prompt', 'create_prompt', 'create_follow_up_questions_prompt'):
+        monkeypatch.setattr(response_generator, name, lambda *args, **kwargs: 'prompt')
+    monkeypatch.setattr(response_generator, 'complete_task', complete_task)
+    return answers, tasks
+
+
+def test_combined_generation_uses_one_call_when_valid(completions):
+    answers, tasks = completions
+    answers['combined'] = json.dumps({'response': 'Hi Sam', 'follow_up_questions': ['Which model?']})
+
+    result = generate_combined_response(None, [])
+
+    assert result['response'] == 'Hi Sam'
+    assert tasks == ['combined']
+
+
+def test_invalid_combined_output_falls_back_to_single_calls(completions):
+    answers, tasks = completions
+    answers.update({
+        'combined': '{"response": "Hi Sam"',
+        'response': 'Hi Sam, please restart the router.',
+        'follow_up_questions': '["Which model?"]'
+    })
+
+    result = generate_combined_response(None, [])
+
+    assert tasks == ['combined', 'response', 'follow_up_questions']
+    assert result['response'] == 'Hi Sam, please restart the router.'
+    assert json.loads(result['follow_up_questions']) == ['Which model?']
+    assert result['tech_instructions'] is None
+
+
+def test_failed_combined_call_falls_back_to_single_calls(completions, monkeypatch):
+    answers, tasks = completions
+    answers.update({'response': 'Hi Sam', 'follow_up_questions': '[]'})
+    complete_task = response_generator.complete_task
+
+    def combined_fails(task, *args, **kwargs):
+        if task == 'combined':
+            raise OpenAIError("OpenAI API error: 500", 500)
+        return complete_task(task, *args, **kwargs)
+
+    monkeypatch.setattr(response_generator, 'complete_task', combined_fails)
+
+    assert generate_combined_response(None, [])['response'] == 'Hi Sam'
+
+
+def conversation(number, words=20):
+    return SimpleNamespace(id=number, from_email='sam@example.com', is_customer=True,
+                           body_text=f"message{number} " + 'word ' * words, body=None)
+
+
+@pytest.fixture
+def ticket():
+    return SimpleNamespace(requester_email='sam@example.com', summary=None)
+
+
+def test_history_without_budget_keeps_every_message(ticket):
+    history = format_conversation_history(ticket, [conversation(n) for n in range(1, 11)])
+
+    assert all(f"message{n} " in history for n in range(1, 11))
+    assert 'omitted' not in history
+
+
+def test_history_fits_the_token_budget_newest_first(ticket):
+    conversations = [conversation(n, words=100) for n in range(1, 21)]
+
+    history = format_conversation_history(ticket, conversations, max_tokens=800)
+
+    assert estimate_tokens(history) <= 800
+    assert 'message20 ' in history and 'message19 ' in history
+    assert 'message1 ' not in history
+    assert 'earlier messages omitted]' in history
+    assert history.index('message19 ') < history.index('message20 ')
+
+
+def test_history_condenses_older_messages_before_dropping_them(ticket, config):
+    config.openai['prompt_keep_recent_messages'] = 1
+    conversations = [conversation(1, words=1000), conversation(2, words=20)]
+
+    history = format_conversation_history(ticket, conversations, max_tokens=600)
+
+    assert 'message1 ' in history and ' [...]' in history
+    assert history.count('word') < 1000
+
+
+def test_history_always_includes_the_newest_message(ticket):
+    history = format_conversation_history(ticket, [conversation(1, words=2000)], max_tokens=10)
+
+    assert 'message1 ' in history
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database.db_operations import get_session
+from database.models import Ticket, Response, Conversation, GenerationJob
+from database.query_profiler import query_budget
+
+
+@pytest.fixture
+def tickets(db):
+    """Add tickets that each have a few conversation entries and two drafts; returns a function."""
+    def add(count):
+        session = get_session()
+        try:
+            now = datetime.utcnow()
+            for i in range(count):
+                ticket = Ticket(freshdesk_id=1000 + i, subject=f"VPN drops every hour ({i})", status='open',
+                                requester_name='Sam', requester_email='sam@example.com')
+                session.add(ticket)
+                session.flush()
+                for j in range(3):
+                    session.add(Conversation(ticket_id=ticket.id, freshdesk_id=10000 + i * 10 + j, body=f"Entry {j}",
+                                             body_text=f"Entry {j}", created_at=now + timedelta(minutes=j)))
+                session.add(Response(ticket_id=ticket.id, draft_content='First draft', final_content='First draft', created_at=now))
+                session.add(Response(ticket_id=ticket.id, draft_content='Second draft', final_content='Second draft',
+                                     created_at=now + timedelta(seconds=1)))
+            session.commit()
+        finally:
+            session.close()
+    return add
+
+
+@pytest.mark.parametrize('count', [3, 30])
+def test_dashboard_query_budget(client, tickets, count):
+    tickets(count)
+
+    # The query count must not grow with the number of tickets
+    with query_budget(5, 'dashboard'):
+        response = client.get('/')
+
+    assert response.status_code == 200
+
+
+def test_ticket_detail_query_budget(client, tickets):
+    tickets(1)
+
+    with query_budget(5, 'ticket detail'):
+        response = client.get('/ticket/1000')
+
+    assert response.status_code == 200
+    assert b'Second draft' in response.data
+
+
+def test_job_status_query_budget(client, tickets):
+    tickets(1)
+    session = get_session()
+    try:
+        job = GenerationJob(ticket_id=1, kind='response', status='queued')
+        session.add(job)
+        session.commit()
+        job_id = job.id
+    finally:
+        session.close()
+
+    with query_budget(2, 'job status'):
+        response = client.get(f'/api/jobs/{job_id}')
+
+    assert response.json['job']['status'] == 'queued'
+
+
+@pytest.mark.parametrize('source_response_id', ['abc', None, [1]])
+def test_reuse_response_rejects_invalid_source_id(client, tickets, source_response_id):
+    tickets(1)
+    response = client.post('/api/tickets/1/reuse_response',
+                           json={'source_response_id': source_response_id})
+
+    assert response.status_code == 400
+
+
+def test_reuse_response_unknown_source_is_not_found(client, tickets):
+    tickets(1)
+    response = client.post('/api/tickets/1/reuse_response', json={'source_response_id': 999999})
+
+    assert response.status_code == 404
@@ -0,0 +1,46 @@
+from ai.similarity_index import SimilarityIndex, tokenize
+
+
+def build_index():
+    index = SimilarityIndex(dimensions=1024)
+    index.add(1, "Printer offline after firmware update, printer shows error E42", resolved=True)
+    index.add(2, "Cannot log in, password reset email never arrives", resolved=True)
+    index.add(3, "Invoice for March shows the wrong VAT number", resolved=True)
+    index.add(4, "Printer offline again since the firmware update", resolved=False)
+    return index
+
+
+def test_tokenize_drops_stop_words_and_adds_word_pairs():
+    assert tokenize("Please reset the Password") == ['reset', 'password', 'reset password']
+
+
+def test_query_ranks_the_closest_ticket_first():
+    results = build_index().query("My printer went offline after the firmware update", k=3)
+
+    assert results[0]['ticket_id'] == 1
+    assert all(first['score'] >= second['score'] for first, second in zip(results, results[1:]))
+
+
+def test_query_filters_unresolved_and_excluded_tickets():
+    index = build_index()
+    text = "Printer offline after firmware update"
+
+    assert 4 not in [r['ticket_id'] for r in index.query(text)]
+    assert 4 in [r['ticket_id'] for r in index.query(text, resolved_only=False)]
+    assert 1 not in [r['ticket_id'] for r in index.query(text, exclude_ticket_id=1)]
+
+
+def test_query_drops_unrelated_tickets_below_min_score():
+    results = build_index().query("Printer offline", min_score=0.1)
+
+    assert [r['ticket_id'] for r in results] == [1]
+
+
+def test_readding_a_ticket_replaces_its_entry():
+    index = build_index()
+    index.add(3, "Password reset link expired before I could log in", resolved=True)
+
+    results = index.query("password reset link", k=2)
+
+    assert len(index) == 4
+    assert {r['ticket_id'] for r in results} == {2, 3}
@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime
+
+import pytest
+import requests
+
+from freshdesk.api_client import FreshdeskClient
+from freshdesk.ticket_importer import TicketImporter
+
+
+@pytest.fixture
+def pages(monkeypatch):
+    """Client whose ticket pages come from a dict; records the pages requested."""
+    client = FreshdeskClient('test.freshdesk.com', 'key', check_connection=False)
+    client.pages = {}
+    client.requested = []
+
+    def fetch_ticket_page(updated_since=None, page=1, per_page=100):
+        client.requested.append(page)
+        result = client.pages[page]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(client, 'fetch_ticket_page', fetch_ticket_page)
+    return client
+
+
+def test_iter_tickets_prefetches_the_next_page(pages):
+    page_two_requested = threading.Event()
+    pages.pages = {1: [{'id': 1}, {'id': 2}], 2: [{'id': 3}]}
+    original = pages.fetch_ticket_page
+
+    def fetch(updated_since=None, page=1, per_page=100):
+        if page == 2:
+            page_two_requested.set()
+        return original(updated_since, page, per_page)
+
+    pages.fetch_ticket_page = fetch
+    tickets = pages.iter_tickets(per_page=2)
+
+    assert next(tickets) == {'id': 1}
+    # Page 2 is on its way while the caller is still working on page 1
+    assert page_two_requested.wait(timeout=5)
+    assert [ticket['id'] for ticket in tickets] == [2, 3]
+
+
+def test_iter_tickets_raises_when_a_page_fails(pages):
+    pages.pages = {1: [{'id': 1}, {'id': 2}], 2: requests.exceptions.ConnectionError("dropped")}
+    seen = []
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        for ticket in pages.iter_tickets(per_page=2):
+            seen.append(ticket['id'])
+
+    assert seen == [1, 2]
+
+
+def test_iter_tickets_does_not_fetch_past_the_limit(pages):
+    pages.pages = {1: [{'id': 1}, {'id': 2}], 2: [{'id': 3}, {'id': 4}]}
+
+    assert [ticket['id'] for ticket in pages.iter_tickets(limit=2, per_page=2)] == [1, 2]
+    assert pages.requested == [1]
+
+
+class FakeClient:
+    def __init__(self, tickets, error=None):
+        self.tickets = tickets
+        self.error = error
+        self.calls = []
+
+    def iter_tickets(self, updated_since=None, limit=None):
+        self.calls.append((updated_since, limit))
+        yield from self.tickets[:limit]
+        if self.error:
+            raise self.error
+
+
+@pytest.fixture
+def importer(monkeypatch):
+    monkeypatch.setattr(TicketImporter, '_process_ticket', lambda self, ticket_data: True)
+    return lambda client: TicketImporter(client)
+
+
+def test_only_the_first_poll_is_limited(importer, config):
+    config.freshdesk['ticket_limit'] = 2
+    client = FakeClient([{'id': i} for i in range(5)])
+    ticket_importer = importer(client)
+
+    assert ticket_importer.poll_for_tickets() == 2
+    last_poll_time = ticket_importer.last_poll_time
+    assert ticket_importer.poll_for_tickets() == 5
+    assert client.calls[1] == (last_poll_time, None)
+
+
+def test_failed_page_keeps_the_poll_window(importer):
+    client = FakeClient([{'id': 1}], error=requests.exceptions.ConnectionError("dropped"))
+    ticket_importer = importer(client)
+    ticket_importer.last_poll_time = datetime(2026, 1, 1)
+
+    assert ticket_importer.poll_for_tickets() == 1
+    assert ticket_importer.last_poll_time == datetime(2026, 1, 1)
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import utils.tracing as tracing
+from utils.tracing import ERROR, NON_RECORDING_SPAN, Tracer, waterfall_rows
+
+
+@pytest.fixture
+def tracer():
+    return Tracer(buffer_size=2)
+
+
+def test_nested_spans_form_one_trace(tracer):
+    with tracer.start_as_current_span('poll') as root:
+        with tracer.start_as_current_span('ticket', {'freshdesk.ticket_id': 7}) as child:
+            with tracer.start_as_current_span('conversations'):
+                pass
+
+    trace = tracer.get_traces()[0]
+    spans = {span['name']: span for span in trace['spans']}
+    assert (trace['name'], trace['span_count']) == ('poll', 3)
+    assert spans['ticket']['parent_id'] == root.context.span_id
+    assert spans['conversations']['parent_id'] == child.context.span_id
+    assert spans['ticket']['attributes'] == {'freshdesk.ticket_id': 7}
+    assert {span['trace_id'] for span in trace['spans']} == {trace['trace_id']}
+
+
+def test_exceptions_mark_the_span_as_failed(tracer):
+    with pytest.raises(ValueError):
+        with tracer.start_as_current_span('generate'):
+            raise ValueError("model refused")
+
+    span = tracer.get_traces()[0]['spans'][0]
+    assert (span['status'], span['status_description']) == (ERROR, 'model refused')
+    assert span['events'][0]['attributes']['exception.type'] == 'ValueError'
+
+
+def test_require_parent_does_not_start_a_trace(tracer):
+    with tracer.start_as_current_span('db.query', require_parent=True) as span:
+        assert span is NON_RECORDING_SPAN
+
+    assert tracer.get_traces() == []
+
+
+def test_only_the_most_recent_traces_are_kept(tracer, tmp_path):
+    tracer.export_path = str(tmp_path / 'traces.jsonl')
+    for name in ('first', 'second', 'third'):
+        with tracer.start_as_current_span(name):
+            pass
+
+    assert [trace['name'] for trace in tracer.get_traces()] == ['third', 'second']
+    assert tracer.get_trace(tracer.get_traces()[1]['trace_id'])['name'] == 'second'
+    exported = [json.loads(line)['name'] for line in (tmp_path / 'traces.jsonl').read_text().splitlines()]
+    assert exported == ['first', 'second', 'third']
+
+
+def test_waterfall_rows_follow_the_span_tree(tracer):
+    with tracer.start_as_current_span('request'):
+        with tracer.start_as_current_span('db'):
+            pass
+        with tracer.start_as_current_span('model'):
+            with tracer.start_as_current_span('http'):
+                pass
+
+    rows = waterfall_rows(tracer.get_traces()[0])
+
+    assert [(row['name'], row['depth']) for row in rows] == [('request', 0), ('db', 1), ('model', 1), ('http', 2)]
+    assert rows[0]['left'] == 0
+    assert all(0 <= row['left'] <= 100 and 0 < row['width'] <= 100 for row in rows)
+
+
+def test_web_requests_are_traced(client, monkeypatch):
+    monkeypatch.setattr(tracing, '_tracer', None)
+    monkeypatch.setattr(tracing, '_tracer_config_version', None)
+
+    client.get('/api/cache/stats')
+    traces = client.get('/api/traces').get_json()
+
+    assert traces[0]['name'] == 'GET /api/cache/stats'
+    assert 'spans' not in traces[0]
+    spans = client.get(f"/api/traces/{traces[0]['trace_id']}").get_json()['spans']
+    assert spans[0]['attributes']['http.status_code'] == 200
+    assert client.get('/admin/traces').status_code == 200
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import os
+import sys
+import sqlite3
+import logging
+
+# Add the current directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from utils.text_processing import html_to_text, estimate_tokens, is_customer_sender
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+NEW_COLUMNS = [
+    ('body_text', 'TEXT'),
+    ('is_customer', 'BOOLEAN'),
+    ('token_count', 'INTEGER'),
+]
+
+def update_database():
+    """Add the plain-text body, sender role and token count columns to the conversations table.
+
+    Existing conversations are backfilled so prompt assembly never has to fall back
+    to parsing HTML at generation time.
+    """
+    # Get the database path
+    db_path = os.path.join(os.path.dirname(__file__), 'tickets.db')
+
+    # Check if the database exists
+    if not os.path.exists(db_path):
+        logger.error(f"Database file not found: {db_path}")
+        return False
+
+    try:
+        # Connect to the database
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+
+        # Add any columns that don't exist yet
+        cursor.execute("PRAGMA table_info(conversations)")
+        column_names = [column[1] for column in cursor.fetchall()]
+
+        for column_name, column_type in NEW_COLUMNS:
+            if column_name not in column_names:
+                logger.info(f"Adding {column_name} column to conversations table")
+                cursor.execute(f"ALTER TABLE conversations ADD COLUMN {column_name} {column_type}")
+            else:
+                logger.info(f"{column_name} column already exists in conversations table")
+
+        # Backfill rows that were imported before these columns existed
+        cursor.execute("""
+            SELECT c.id, c.body, c.from_email, t.requester_email
+            FROM conversations c
+            JOIN tickets t ON t.id = c.ticket_id
+            WHERE c.body_text IS NULL
+        """)
+        rows = cursor.fetchall()
+
+        for conversation_id, body, from_email, requester_email in rows:
+            body_text = html_to_text(body)
+            cursor.execute(
+                "UPDATE conversations SET body_text = ?, is_customer = ?, token_count = ? WHERE id = ?",
+                (body_text, is_customer_sender(from_email, requester_email), estimate_tokens(body_text), conversation_id)
+            )
+
+        conn.commit()
+        logger.info(f"Backfilled {len(rows)} existing conversations")
+
+        # Close the connection
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error updating database schema: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    if update_database():
+        print("Database schema updated successfully.")
+    else:
+        print("Failed to update database schema. Check the logs for details.")
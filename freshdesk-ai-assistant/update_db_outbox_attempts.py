@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+import os
+import sys
+import sqlite3
+import logging
+
+# Add the current directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def update_database():
+    """Update the database schema to add the total_attempts column to the outbox_messages table."""
+    # Get the database path
+    db_path = os.path.join(os.path.dirname(__file__), 'tickets.db')
+    
+    # Check if the database exists
+    if not os.path.exists(db_path):
+        logger.error(f"Database file not found: {db_path}")
+        return False
+    
+    try:
+        # Connect to the database
+        conn = sqlite3.connect(db_path)
+        cursor = conn.cursor()
+        
+        # Check if the table exists; init_db() creates it with the column
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='outbox_messages'")
+        if not cursor.fetchone():
+            logger.info("outbox_messages table does not exist yet, nothing to update")
+            conn.close()
+            return True
+        
+        # Check if the column already exists
+        cursor.execute("PRAGMA table_info(outbox_messages)")
+        columns = cursor.fetchall()
+        column_names = [column[1] for column in columns]
+        
+        if 'total_attempts' not in column_names:
+            # Add the new column, starting from the attempts made so far
+            logger.info("Adding total_attempts column to outbox_messages table")
+            cursor.execute("ALTER TABLE outbox_messages ADD COLUMN total_attempts INTEGER DEFAULT 0")
+            cursor.execute("UPDATE outbox_messages SET total_attempts = COALESCE(attempts, 0)")
+            conn.commit()
+            logger.info("Database schema updated successfully")
+        else:
+            logger.info("total_attempts column already exists in outbox_messages table")
+        
+        # Close the connection
+        conn.close()
+        return True
+    except Exception as e:
+        logger.error(f"Error updating database schema: {str(e)}")
+        return False
+
+if __name__ == "__main__":
+    if update_database():
+        print("Database schema updated successfully.")
+    else:
+        print("Failed to update database schema. Check the logs for details.")
@@ -0,0 +1,201 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import Any, Dict, List
+
+from utils.config import get_config
+from utils.metrics import add_collector, gauge
+
+logger = logging.getLogger(__name__)
+
+# Breaker states
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Breaker state as a number for metrics: 0 closed, 1 half-open, 2 open
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+BREAKER_STATE = gauge('circuit_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)', ('name',))
+BREAKER_REJECTED = gauge('circuit_breaker_rejected', 'Calls failed fast by the circuit breaker since startup', ('name',))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose circuit breaker is open."""
+
+    def __init__(self, name: str, retry_in: float):
+        super().__init__(f"{name} is unavailable (circuit open, next attempt in {retry_in:.0f} seconds)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one upstream API.
+
+    Calls are recorded in a sliding time window. Once the window holds at least
+    `min_calls` calls and the share of failures reaches `failure_rate`, the
+    breaker opens and calls fail immediately for `open_seconds`. After that a
+    single probe call is let through (half-open): success closes the breaker,
+    failure opens it again.
+    """
+
+    def __init__(self, name: str, failure_rate: float = 0.5, min_calls: int = 5,
+                 window_seconds: float = 60.0, open_seconds: float = 30.0):
+        """Initialize a closed breaker.
+
+        Args:
+            name: Name of the upstream, used in errors and stats
+            failure_rate: Share of failed calls in the window that opens the breaker
+            min_calls: Minimum calls in the window before the failure rate is judged
+            window_seconds: Length of the sliding window
+            open_seconds: How long the breaker stays open before probing
+        """
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+
+        self._lock = threading.Lock()
+        self._calls = deque()  # (timestamp, succeeded)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def _prune(self, now: float) -> None:
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state = HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def before_call(self) -> None:
+        """Check that a call may go ahead.
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half-open with its probe already in flight
+        """
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == CLOSED:
+                return
+            # A probe that never reported back (e.g. an unexpected error) doesn't block probing for good
+            probe_stale = self._probe_in_flight and now - self._probe_started >= self.open_seconds
+            if state == HALF_OPEN and (not self._probe_in_flight or probe_stale):
+                self._probe_in_flight = True
+                self._probe_started = now
+                logger.info(f"Circuit for {self.name} half-open, sending a probe request")
+                return
+
+            self.rejected += 1
+            retry_in = max(0.0, self._opened_at + self.open_seconds - now)
+            raise CircuitOpenError(self.name, retry_in)
+
+    def record_success(self) -> None:
+        """Record a call that reached a working upstream."""
+        with self._lock:
+            now = time.monotonic()
+            if self._current_state(now) == HALF_OPEN:
+                logger.info(f"Circuit for {self.name} closed, probe succeeded")
+                self._state = CLOSED
+                self._calls.clear()
+            self._calls.append((now, True))
+            self._prune(now)
+
+    def record_failure(self) -> None:
+        """Record a call that failed because the upstream is down or erroring."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                self._open(now, "probe failed")
+                return
+
+            self._calls.append((now, False))
+            self._prune(now)
+            failures = sum(1 for _, succeeded in self._calls if not succeeded)
+            if state == CLOSED and len(self._calls) >= self.min_calls and failures / len(self._calls) >= self.failure_rate:
+                self._open(now, f"{failures} of the last {len(self._calls)} calls failed")
+
+    def _open(self, now: float, reason: str) -> None:
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_in_flight = False
+        self.times_opened += 1
+        logger.warning(f"Circuit for {self.name} opened ({reason}); failing fast for {self.open_seconds:.0f} seconds")
+
+    def reset(self) -> None:
+        """Close the breaker and forget recorded calls."""
+        with self._lock:
+            self._state = CLOSED
+            self._calls.clear()
+            self._probe_in_flight = False
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Get the state and counters of the breaker."""
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            self._prune(now)
+            failures = sum(1 for _, succeeded in self._calls if not succeeded)
+            return {
+                'name': self.name,
+                'state': state,
+                'calls': len(self._calls),
+                'failures': failures,
+                'failure_rate': round(failures / len(self._calls), 3) if self._calls else 0.0,
+                'retry_in': round(max(0.0, self._opened_at + self.open_seconds - now), 1) if state == OPEN else 0.0,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+
+# One breaker per upstream, shared by the whole process
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name: str) -> CircuitBreaker:
+    """Get the process-wide breaker for an upstream, applying the live app.breaker_* settings."""
+    settings = get_config().app
+
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+
+    breaker.failure_rate = float(settings.get('breaker_failure_rate', 0.5))
+    breaker.min_calls = int(settings.get('breaker_min_calls', 5))
+    breaker.window_seconds = float(settings.get('breaker_window_seconds', 60))
+    breaker.open_seconds = float(settings.get('breaker_open_seconds', 30))
+    return breaker
+
+
+def get_breaker_states() -> List[Dict[str, Any]]:
+    """Get a snapshot of every breaker created so far."""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return [breaker.snapshot() for breaker in breakers]
+
+
+def _collect_metrics() -> None:
+    """Copy the breaker states into gauges at scrape time."""
+    for breaker in get_breaker_states():
+        BREAKER_STATE.set(STATE_VALUES[breaker['state']], name=breaker['name'])
+        BREAKER_REJECTED.set(breaker['rejected'], name=breaker['name'])
+
+
+add_collector(_collect_metrics)
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Default location of the configuration file
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
+
+# Minimum number of seconds between mtime checks of the config file (app.config_reload_seconds)
+RELOAD_CHECK_INTERVAL = 2.0
+
+# Numeric settings that are validated when present: (section, key, type, minimum)
+NUMERIC_SETTINGS = [
+    ('freshdesk', 'rate_limit_delay', float, 0),
+    ('freshdesk', 'retry_delay', float, 0),
+    ('freshdesk', 'max_retries', int, 0),
+    ('freshdesk', 'page_retries', int, 0),
+    ('freshdesk', 'ticket_limit', int, 1),
+    ('freshdesk', 'health_check_ttl', float, 0),
+    ('freshdesk', 'interactive_reserve', float, 0),
+    ('freshdesk', 'http_cache_max_entries', int, 1),
+    ('openai', 'connect_timeout', float, 0),
+    ('openai', 'read_timeout', float, 0),
+    ('openai', 'max_retries', int, 0),
+    ('openai', 'requests_per_minute', float, 0),
+    ('openai', 'tokens_per_minute', float, 0),
+    ('openai', 'cache_ttl_seconds', float, 0),
+    ('openai', 'cache_max_entries', int, 1),
+    ('openai', 'max_prompt_tokens', int, 1),
+    ('openai', 'prompt_keep_recent_messages', int, 1),
+    ('openai', 'summarize_after_messages', int, 0),
+    ('openai', 'summary_max_tokens', int, 1),
+    ('openai', 'large_model_min_prompt_tokens', int, 0),
+    ('openai', 'large_model_min_messages', int, 0),
+    ('openai', 'similar_context_count', int, 0),
+    ('app', 'poll_interval_seconds', int, 1),
+    ('app', 'config_reload_seconds', float, 0),
+    ('app', 'generation_workers', int, 1),
+    ('app', 'pregenerate_interval_seconds', int, 1),
+    ('app', 'pregenerate_tokens_per_hour', float, 0),
+    ('app', 'pregenerate_batch_size', int, 1),
+    ('app', 'pregenerate_start_hour', int, 0),
+    ('app', 'pregenerate_end_hour', int, 0),
+    ('app', 'similarity_dimensions', int, 1),
+    ('app', 'similarity_min_score', float, 0),
+    ('app', 'cluster_num_perm', int, 1),
+    ('app', 'cluster_bands', int, 1),
+    ('app', 'cluster_threshold', float, 0),
+    ('app', 'outbox_interval_seconds', int, 1),
+    ('app', 'outbox_batch_size', int, 1),
+    ('app', 'outbox_max_attempts', int, 1),
+    ('app', 'outbox_retry_seconds', float, 0),
+    ('app', 'breaker_failure_rate', float, 0),
+    ('app', 'breaker_min_calls', int, 1),
+    ('app', 'breaker_window_seconds', float, 1),
+    ('app', 'breaker_open_seconds', float, 0),
+    ('app', 'trace_buffer_size', int, 1),
+    ('app', 'query_repeat_threshold', int, 1),
+]
+
+
+class ConfigError(ValueError):
+    """Raised when the configuration file is missing or invalid."""
+
+
+class Config:
+    """A parsed, validated snapshot of config.json.
+
+    Snapshots are never mutated; a reload produces a new snapshot with a
+    higher version number, so callers can cheaply detect changes.
+    """
+
+    def __init__(self, data: Dict[str, Any], version: int = 1, mtime: float = 0.0):
+        self.data = data
+        self.version = version
+        self.mtime = mtime
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.data
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Get a top-level value, like dict.get."""
+        return self.data.get(key, default)
+
+    def section(self, name: str) -> Dict[str, Any]:
+        """Get a configuration section, or an empty dict if it is missing."""
+        return self.data.get(name) or {}
+
+    @property
+    def freshdesk(self) -> Dict[str, Any]:
+        return self.section('freshdesk')
+
+    @property
+    def openai(self) -> Dict[str, Any]:
+        return self.section('openai')
+
+    @property
+    def app(self) -> Dict[str, Any]:
+        return self.section('app')
+
+    def __repr__(self):
+        return f"<Config(version={self.version}, sections={sorted(self.data.keys())})>"
+
+
+def validate_config(data: Any) -> None:
+    """Validate the structure of a parsed configuration.
+
+    Args:
+        data: The parsed JSON document
+
+    Raises:
+        ConfigError: If a required value is missing or has the wrong type
+    """
+    if not isinstance(data, dict):
+        raise ConfigError("config.json must contain a JSON object")
+
+    for section in ('freshdesk', 'openai', 'app'):
+        if not isinstance(data.get(section), dict):
+            raise ConfigError(f"config.json is missing the '{section}' section")
+
+    for section, key in (('freshdesk', 'domain'), ('freshdesk', 'api_key'), ('openai', 'api_key')):
+        value = data[section].get(key)
+        if not isinstance(value, str) or not value.strip():
+            raise ConfigError(f"config.json is missing '{section}.{key}'")
+
+    for section, key, value_type, minimum in NUMERIC_SETTINGS:
+        if key not in data[section]:
+            continue
+        value = data[section][key]
+        try:
+            # bool is an int subclass, but "true" is never a sensible delay or limit
+            if isinstance(value, bool):
+                raise TypeError
+            converted = value_type(value)
+        except (TypeError, ValueError):
+            raise ConfigError(f"'{section}.{key}' must be a number")
+        if converted < minimum:
+            raise ConfigError(f"'{section}.{key}' must be at least {minimum}")
+
+
+class ConfigManager:
+    """Loads config.json once and reloads it when the file changes."""
+
+    def __init__(self, path: str = CONFIG_PATH, check_interval: float = RELOAD_CHECK_INTERVAL):
+        """Initialize the config manager.
+
+        Args:
+            path: Path to the JSON configuration file
+            check_interval: Minimum seconds between checks of the file's mtime, unless
+                app.config_reload_seconds sets it
+        """
+        self.path = path
+        self.check_interval = check_interval
+        self._default_check_interval = check_interval
+        self._config = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def get(self) -> Config:
+        """Get the current configuration, reloading it if the file has changed.
+
+        Returns:
+            The current Config snapshot
+
+        Raises:
+            ConfigError: If the configuration has never been loaded successfully
+        """
+        config = self._config
+        now = time.monotonic()
+        if config is not None and now - self._last_check < self.check_interval:
+            return config
+
+        with self._lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._config is not None and now - self._last_check < self.check_interval:
+                return self._config
+            self._last_check = now
+            return self._refresh()
+
+    def reload(self) -> Config:
+        """Force a reload of the configuration file."""
+        with self._lock:
+            self._last_check = time.monotonic()
+            return self._refresh(force=True)
+
+    def add_reload_listener(self, callback: Callable[[Config, Config], None]) -> None:
+        """Register a callback that is called with (old, new) after a reload."""
+        self._listeners.append(callback)
+
+    def _refresh(self, force: bool = False) -> Config:
+        """Reload the file if its mtime changed. Must be called with the lock held."""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            if self._config is None:
+                raise ConfigError(f"Could not read {self.path}: {str(e)}")
+            logger.error(f"Could not stat {self.path}, keeping previous configuration: {str(e)}")
+            return self._config
+
+        if not force and self._config is not None and mtime == self._config.mtime:
+            return self._config
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            validate_config(data)
+        except (OSError, ValueError) as e:
+            if self._config is None:
+                if isinstance(e, ConfigError):
+                    raise
+                raise ConfigError(f"Could not load {self.path}: {str(e)}")
+            # Keep serving the last good configuration rather than breaking running jobs
+            logger.error(f"Invalid configuration in {self.path}, keeping previous version: {str(e)}")
+            return self._config
+
+        old_config = self._config
+        version = old_config.version + 1 if old_config else 1
+        self._config = Config(data, version=version, mtime=mtime)
+        self.check_interval = float(self._config.app.get('config_reload_seconds', self._default_check_interval))
+
+        if old_config is not None:
+            logger.info(f"Reloaded configuration from {self.path} (version {version})")
+            self._notify(old_config, self._config)
+
+        return self._config
+
+    def _notify(self, old_config: Config, new_config: Config) -> None:
+        """Call reload listeners, isolating their failures."""
+        for callback in list(self._listeners):
+            try:
+                callback(old_config, new_config)
+            except Exception as e:
+                logger.error(f"Error in config reload listener: {str(e)}")
+
+
+# Global config manager instance
+_manager = None
+_manager_lock = threading.Lock()
+
+def get_config_manager() -> ConfigManager:
+    """Get the global config manager instance."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = ConfigManager()
+    return _manager
+
+
+def get_config() -> Config:
+    """Get the current application configuration."""
+    return get_config_manager().get()
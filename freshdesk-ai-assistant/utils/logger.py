@@ -1,5 +1,4 @@
 import os
-import json
 import logging
 from logging.handlers import RotatingFileHandler
 import sys
@@ -57,11 +56,9 @@ def get_logger(name: str = None) -> logging.Logger:
     """
     return logging.getLogger(name)
 
-# Set up the root logger when this module is imported
-setup_logger()
-
 if __name__ == "__main__":
     # Test the logger
+    setup_logger()
     logger = get_logger(__name__)
     logger.info("This is an info message")
     logger.warning("This is a warning message")
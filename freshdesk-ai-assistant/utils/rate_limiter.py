@@ -0,0 +1,224 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """A token bucket that refills continuously up to a fixed capacity.
+
+    The level may go negative when usage is corrected after the fact (for
+    example when a completion used more tokens than estimated); later callers
+    then wait until the debt has been refilled.
+    """
+
+    def __init__(self, capacity: float, refill_per_second: float):
+        """Initialize the bucket.
+
+        Args:
+            capacity: Maximum number of tokens the bucket can hold
+            refill_per_second: Tokens added per second
+        """
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Get the number of seconds until `amount` tokens are available."""
+        self._refill(now)
+        # Never ask for more than the bucket can hold, or the caller would wait forever
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        if self.refill_per_second <= 0:
+            return float('inf')
+        return (amount - self.level) / self.refill_per_second
+
+    def consume(self, amount: float, now: float) -> None:
+        """Take tokens out of the bucket (the level may go negative)."""
+        self._refill(now)
+        self.level = min(self.capacity, self.level - amount)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limiter shared by all callers.
+
+    A limit of 0 (or None) disables that dimension.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        """Initialize the limiter.
+
+        Args:
+            requests_per_minute: Maximum requests per minute
+            tokens_per_minute: Maximum tokens (prompt + completion) per minute
+        """
+        self._lock = threading.Lock()
+        self.requests = None
+        self.tokens = None
+        self.configure(requests_per_minute, tokens_per_minute)
+
+    def configure(self, requests_per_minute: Optional[float], tokens_per_minute: Optional[float]) -> None:
+        """Change the limits, keeping the current bucket levels where possible."""
+        with self._lock:
+            self.requests = self._resize(self.requests, requests_per_minute)
+            self.tokens = self._resize(self.tokens, tokens_per_minute)
+
+    @staticmethod
+    def _resize(bucket: Optional[TokenBucket], per_minute: Optional[float]) -> Optional[TokenBucket]:
+        if not per_minute:
+            return None
+        if bucket is None:
+            return TokenBucket(per_minute, per_minute / 60.0)
+        bucket.capacity = float(per_minute)
+        bucket.refill_per_second = per_minute / 60.0
+        bucket.level = min(bucket.level, bucket.capacity)
+        return bucket
+
+    def acquire(self, tokens: int = 0, timeout: Optional[float] = None) -> bool:
+        """Block until one request using about `tokens` tokens is allowed.
+
+        Args:
+            tokens: Estimated number of tokens the request will use
+            timeout: Maximum number of seconds to wait (None waits indefinitely)
+
+        Returns:
+            True if the request may proceed, False if the timeout expired
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = 0.0
+                if self.requests is not None:
+                    wait = max(wait, self.requests.wait_time(1, now))
+                if self.tokens is not None:
+                    wait = max(wait, self.tokens.wait_time(tokens, now))
+
+                if wait <= 0:
+                    if self.requests is not None:
+                        self.requests.consume(1, now)
+                    if self.tokens is not None:
+                        self.tokens.consume(tokens, now)
+                    return True
+
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+
+            logger.debug(f"Rate limiter: waiting {wait:.2f} seconds")
+            time.sleep(min(wait, 1.0))
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token budget once the real usage of a request is known."""
+        with self._lock:
+            if self.tokens is not None:
+                self.tokens.consume(actual_tokens - estimated_tokens, time.monotonic())
+
+
+# Priority classes for shared API budgets: agents waiting on a result go first
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+_priority = threading.local()
+
+
+@contextmanager
+def request_priority(priority: str):
+    """Run the enclosed API calls of this thread in the given priority class."""
+    previous = getattr(_priority, 'value', BACKGROUND)
+    _priority.value = priority
+    try:
+        yield
+    finally:
+        _priority.value = previous
+
+
+def current_priority() -> str:
+    """Get the priority class of this thread's API calls (background unless set)."""
+    return getattr(_priority, 'value', BACKGROUND)
+
+
+class PriorityRateLimiter:
+    """Minimum-interval limiter with an interactive lane and a background lane.
+
+    Interactive requests may start once min_interval has passed since the last
+    request of either lane. Background requests only get a slot while no
+    interactive request is waiting, and they are spaced further apart so that
+    `interactive_reserve` of the capacity stays free for interactive traffic.
+    """
+
+    def __init__(self, min_interval: float = 1.0, interactive_reserve: float = 0.25):
+        """Initialize the limiter.
+
+        Args:
+            min_interval: Minimum number of seconds between two requests
+            interactive_reserve: Share of the capacity background requests leave unused (0 to 0.9)
+        """
+        self._lock = threading.Lock()
+        self.min_interval = min_interval
+        self.interactive_reserve = interactive_reserve
+        self.last_request_time = 0.0
+        self._waiting = {INTERACTIVE: 0, BACKGROUND: 0}
+        self._stats = {lane: {'requests': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+                       for lane in (INTERACTIVE, BACKGROUND)}
+
+    def _interval(self, priority: str) -> float:
+        if priority == INTERACTIVE:
+            return self.min_interval
+        reserve = min(max(self.interactive_reserve, 0.0), 0.9)
+        return self.min_interval / (1.0 - reserve)
+
+    def acquire(self, priority: str = BACKGROUND) -> None:
+        """Block until a request in the given priority class may start."""
+        if priority not in self._waiting:
+            priority = BACKGROUND
+        start = time.monotonic()
+
+        with self._lock:
+            self._waiting[priority] += 1
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    if priority == BACKGROUND and self._waiting[INTERACTIVE]:
+                        # Let the waiting interactive requests go first
+                        wait = self.min_interval
+                    else:
+                        wait = self.last_request_time + self._interval(priority) - now
+
+                    if wait <= 0:
+                        self.last_request_time = now
+                        stats = self._stats[priority]
+                        stats['requests'] += 1
+                        stats['wait_seconds'] += now - start
+                        stats['max_wait_seconds'] = max(stats['max_wait_seconds'], now - start)
+                        return
+
+                logger.debug(f"Rate limiting ({priority}): waiting {wait:.2f} seconds")
+                # Background requests re-check often, so a new interactive request can overtake them
+                time.sleep(min(wait, 0.1) if priority == BACKGROUND else wait)
+        finally:
+            with self._lock:
+                self._waiting[priority] -= 1
+
+    def get_stats(self) -> dict:
+        """Get requests, waiting time and current waiters per priority class."""
+        with self._lock:
+            return {
+                lane: dict(
+                    stats,
+                    wait_seconds=round(stats['wait_seconds'], 3),
+                    max_wait_seconds=round(stats['max_wait_seconds'], 3),
+                    waiting=self._waiting[lane]
+                )
+                for lane, stats in self._stats.items()
+            }
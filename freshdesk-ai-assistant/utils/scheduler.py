@@ -1,14 +1,11 @@
-import os
-import json
 import logging
 import time
 from datetime import datetime
 from typing import Callable, Dict, Any
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+
+from utils.config import get_config, get_config_manager
 
 # Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class TaskScheduler:
@@ -16,17 +13,34 @@ class TaskScheduler:
     
     def __init__(self):
         """Initialize the task scheduler."""
+        # APScheduler is only imported once a scheduler is actually needed
+        from apscheduler.schedulers.background import BackgroundScheduler
+        
         self.scheduler = BackgroundScheduler()
         self.scheduler.start()
         logger.info("Task scheduler initialized")
         
-        # Load configuration
-        config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config.json')
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+        # Jobs that follow the configured poll interval rather than a fixed one
+        self.poll_interval_jobs = set()
+        get_config_manager().add_reload_listener(self._on_config_reload)
+    
+    @property
+    def poll_interval(self) -> int:
+        """Poll interval in seconds from the live config (default 5 minutes)."""
+        return int(get_config().app.get('poll_interval_seconds', 300))
+    
+    def _on_config_reload(self, old_config, new_config) -> None:
+        """Reschedule poll-interval jobs when the configured interval changes."""
+        from apscheduler.triggers.interval import IntervalTrigger
+        
+        old_interval = old_config.app.get('poll_interval_seconds', 300)
+        new_interval = new_config.app.get('poll_interval_seconds', 300)
+        if old_interval == new_interval:
+            return
         
-        # Get poll interval from config (default to 5 minutes)
-        self.poll_interval = self.config.get('app', {}).get('poll_interval_seconds', 300)
+        for job_id in list(self.poll_interval_jobs):
+            self.scheduler.reschedule_job(job_id, trigger=IntervalTrigger(seconds=int(new_interval)))
+            logger.info(f"Rescheduled job '{job_id}' with interval {new_interval} seconds")
     
     def add_job(self, func: Callable, job_id: str, seconds: int = None, **kwargs) -> None:
         """Add a job to the scheduler.
@@ -37,8 +51,13 @@ class TaskScheduler:
             seconds: Interval in seconds (defaults to poll_interval from config)
             **kwargs: Additional arguments to pass to the function
         """
+        from apscheduler.triggers.interval import IntervalTrigger
+        
         if seconds is None:
             seconds = self.poll_interval
+            self.poll_interval_jobs.add(job_id)
+        else:
+            self.poll_interval_jobs.discard(job_id)
         
         trigger = IntervalTrigger(seconds=seconds)
         self.scheduler.add_job(
@@ -58,6 +77,7 @@ class TaskScheduler:
         """
         try:
             self.scheduler.remove_job(job_id)
+            self.poll_interval_jobs.discard(job_id)
             logger.info(f"Removed job '{job_id}'")
         except Exception as e:
             logger.error(f"Error removing job '{job_id}': {str(e)}")
@@ -82,19 +102,31 @@ def get_scheduler() -> TaskScheduler:
 def setup_ticket_processing_jobs() -> None:
     """Set up jobs for ticket importing and processing."""
     from freshdesk.ticket_importer import run_importer
-    # Removed automatic response generation
+    from ai.pregeneration import run_pregeneration
+    from freshdesk.outbox import run_outbox
     
     scheduler = get_scheduler()
     
-    # Add job for importing tickets only
+    # Add job for importing tickets
     scheduler.add_job(run_importer, 'import_tickets')
     
-    # Note: Response generation is now manual only, triggered by user action
+    # Draft pre-generation is opt-in; the job checks app.pregenerate_enabled on every run,
+    # so it can be switched on and off without a restart
+    scheduler.add_job(run_pregeneration, 'pregenerate_drafts',
+                      seconds=int(get_config().app.get('pregenerate_interval_seconds', 60)))
+    
+    # Retry outbox deliveries that failed or were interrupted; new messages are sent immediately
+    scheduler.add_job(run_outbox, 'deliver_outbox',
+                      seconds=int(get_config().app.get('outbox_interval_seconds', 10)))
     
-    logger.info("Ticket processing jobs set up (automatic response generation disabled)")
+    logger.info("Ticket processing jobs set up")
 
 
 if __name__ == "__main__":
+    from utils.logger import setup_logger
+    
+    setup_logger()
+    
     # Test the scheduler
     def test_job():
         logger.info(f"Test job running at {datetime.now()}")
@@ -0,0 +1,176 @@
+import re
+import html
+from email.utils import parseaddr
+from html.parser import HTMLParser
+from typing import Optional
+
+# Tags that should start a new line when converting HTML to plain text
+BLOCK_TAGS = {
+    'p', 'div', 'br', 'li', 'ul', 'ol', 'tr', 'table', 'blockquote',
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'pre', 'hr'
+}
+
+# Tags whose content is never shown to a reader
+SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
+# Rough number of characters per token for English text
+CHARS_PER_TOKEN = 4
+
+# Lines that introduce quoted history in a reply; the line and everything after it is dropped
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r'^On .{5,200}wrote:\s*$'),  # Gmail, Apple Mail, Thunderbird
+    re.compile(r'^-{2,}\s*Original Message\s*-{2,}\s*$', re.IGNORECASE),  # Outlook
+    re.compile(r'^_{10,}\s*$'),  # Outlook separator line
+    re.compile(r'^From: .*(@|<).*$'),  # Quoted header block with a sender address
+]
+
+# Lines that start an email signature; the line and everything after it is dropped
+SIGNATURE_PATTERNS = [
+    re.compile(r'^-- ?$'),  # RFC 3676 signature delimiter
+    re.compile(r'^Sent from my \w+', re.IGNORECASE),
+    re.compile(r'^Get Outlook for \w+', re.IGNORECASE),
+]
+
+
+class _TextExtractor(HTMLParser):
+    """HTML parser that collects the visible text of a document."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self.skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append('\n')
+            if tag == 'li':
+                self.parts.append('- ')
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS and tag != 'li':
+            self.parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            self.parts.append('\n')
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.parts.append(data)
+
+
+def html_to_text(body: Optional[str]) -> str:
+    """Convert an HTML body into normalized plain text.
+
+    Args:
+        body: HTML (or plain text) content
+
+    Returns:
+        Plain text with tags removed, entities decoded and whitespace collapsed
+    """
+    if not body:
+        return ''
+
+    extractor = _TextExtractor()
+    try:
+        extractor.feed(body)
+        extractor.close()
+        text = ''.join(extractor.parts)
+    except Exception:
+        # Fall back to a crude tag strip if the markup is badly broken
+        text = html.unescape(re.sub(r'<[^>]+>', ' ', body))
+
+    # Collapse runs of spaces/tabs and trim each line
+    text = text.replace('\xa0', ' ')
+    lines = [re.sub(r'[ \t\r\f\v]+', ' ', line).strip() for line in text.split('\n')]
+    text = '\n'.join(lines)
+
+    # Keep at most one blank line between paragraphs
+    text = re.sub(r'\n{3,}', '\n\n', text)
+
+    return text.strip()
+
+
+def estimate_tokens(text: Optional[str]) -> int:
+    """Estimate the number of model tokens in a piece of text.
+
+    Args:
+        text: Text to estimate
+
+    Returns:
+        Approximate token count (roughly four characters per token)
+    """
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def strip_quoted_text(text: Optional[str]) -> str:
+    """Remove quoted earlier messages and the signature from an email reply.
+
+    Drops ">"-prefixed lines, everything from a reply header such as
+    "On <date>, <name> wrote:" onwards and everything from a signature
+    delimiter onwards. The original text is returned if nothing would be left.
+
+    Args:
+        text: Plain-text body of a message
+
+    Returns:
+        The new content of the message only
+    """
+    if not text:
+        return ''
+
+    kept = []
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if any(pattern.match(stripped) for pattern in QUOTE_HEADER_PATTERNS + SIGNATURE_PATTERNS):
+            break
+        if stripped.startswith('>'):
+            continue
+        kept.append(line)
+
+    result = re.sub(r'\n{3,}', '\n\n', '\n'.join(kept)).strip()
+    return result or text.strip()
+
+
+def truncate_to_tokens(text: Optional[str], max_tokens: int) -> str:
+    """Cut text down to roughly max_tokens, ending on a word boundary.
+
+    Args:
+        text: Text to shorten
+        max_tokens: Token budget for the result
+
+    Returns:
+        The text unchanged if it fits, otherwise its beginning followed by " [...]"
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text or ''
+
+    limit = max(0, max_tokens * CHARS_PER_TOKEN)
+    cut = text[:limit]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip() + ' [...]'
+
+
+def is_customer_sender(from_email: Optional[str], requester_email: Optional[str], incoming: Optional[bool] = None) -> bool:
+    """Work out whether a conversation entry was written by the customer.
+
+    Args:
+        from_email: Sender address of the conversation entry
+        requester_email: Email address of the ticket requester
+        incoming: Freshdesk 'incoming' flag, used when the emails can't be compared
+
+    Returns:
+        True if the sender is the ticket requester
+    """
+    if from_email and requester_email:
+        # Freshdesk sometimes sends "Name <address>" in from_email
+        sender_address = parseaddr(from_email)[1] or from_email
+        return sender_address.strip().lower() == requester_email.strip().lower()
+    return bool(incoming)
@@ -0,0 +1,361 @@
+import json
+import time
+import logging
+import secrets
+import threading
+import functools
+import contextvars
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.config import get_config
+
+logger = logging.getLogger(__name__)
+
+# Span status codes, as in OpenTelemetry
+UNSET = 'UNSET'
+OK = 'OK'
+ERROR = 'ERROR'
+
+# Spans kept per trace; a very long poll keeps its first spans and counts the rest as dropped
+MAX_SPANS_PER_TRACE = 2000
+
+# Traces whose root span hasn't ended yet; the oldest are dropped beyond this
+MAX_OPEN_TRACES = 1000
+
+SpanContext = namedtuple('SpanContext', ['trace_id', 'span_id'])
+
+# Span that work on the current thread (or asyncio task) belongs to
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """One timed operation in a trace, with attributes and a status.
+
+    Mirrors the part of the OpenTelemetry Span API this app uses
+    (set_attribute, set_status, record_exception, end), so the tracer can be
+    swapped for the OpenTelemetry SDK without touching instrumented code.
+    """
+
+    def __init__(self, tracer: 'Tracer', name: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Optional[Dict[str, Any]] = None):
+        self._tracer = tracer
+        self.name = name
+        self.context = SpanContext(trace_id, secrets.token_hex(8))
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = UNSET
+        self.status_description = None
+        self.events: List[Dict[str, Any]] = []
+        self.start_time = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration = None
+        self.thread = threading.current_thread().name
+
+    def get_span_context(self) -> SpanContext:
+        return self.context
+
+    def is_recording(self) -> bool:
+        return self.duration is None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        self.attributes.update(attributes)
+
+    def set_status(self, status: str, description: Optional[str] = None) -> None:
+        self.status = status
+        self.status_description = description
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.events.append({
+            'name': 'exception',
+            'offset': round(time.perf_counter() - self._start_perf, 6),
+            'attributes': {'exception.type': type(exception).__name__, 'exception.message': str(exception)}
+        })
+
+    def end(self) -> None:
+        """Stop the clock and hand the span to the tracer; later calls do nothing."""
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._start_perf
+        self._tracer._on_end(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'start_time': self.start_time,
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+            'status': self.status,
+            'status_description': self.status_description,
+            'attributes': self.attributes,
+            'events': self.events,
+            'thread': self.thread
+        }
+
+
+class _NonRecordingSpan:
+    """Stand-in returned while tracing is off, so callers never need to check."""
+
+    context = SpanContext(None, None)
+
+    def get_span_context(self) -> SpanContext:
+        return self.context
+
+    def is_recording(self) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def set_attributes(self, attributes: Dict[str, Any]) -> None:
+        pass
+
+    def set_status(self, status: str, description: Optional[str] = None) -> None:
+        pass
+
+    def record_exception(self, exception: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+
+NON_RECORDING_SPAN = _NonRecordingSpan()
+
+
+class Tracer:
+    """Records spans and keeps the most recent finished traces in a ring buffer.
+
+    The parent of a new span is the current span of the calling thread.
+    Spans are grouped by trace until the root span ends; the finished trace
+    then goes into the ring buffer and, if a file is configured, is appended
+    to it as one JSON line.
+    """
+
+    def __init__(self, buffer_size: int = 100, export_path: Optional[str] = None, enabled: bool = True):
+        """Initialize the tracer.
+
+        Args:
+            buffer_size: Number of finished traces kept in memory
+            export_path: File that finished traces are appended to as JSON lines, or None
+            enabled: Whether spans are recorded at all
+        """
+        self.enabled = enabled
+        self.export_path = export_path
+        self._lock = threading.Lock()
+        self._open: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self._finished = deque(maxlen=buffer_size)
+        self.dropped_spans = 0
+
+    def resize(self, buffer_size: int) -> None:
+        with self._lock:
+            if self._finished.maxlen != buffer_size:
+                self._finished = deque(self._finished, maxlen=buffer_size)
+
+    def start_span(self, name: str, attributes: Optional[Dict[str, Any]] = None, require_parent: bool = False):
+        """Start a span under the current span without making it current.
+
+        Args:
+            name: Operation name
+            attributes: Initial attributes
+            require_parent: Don't start a new trace; return a non-recording span if there is no current span
+
+        Returns:
+            The started span; call end() on it when the operation is done
+        """
+        parent = _current_span.get()
+        if not self.enabled or (require_parent and parent is None):
+            return NON_RECORDING_SPAN
+        if parent is not None and parent.is_recording():
+            return Span(self, name, parent.context.trace_id, parent.context.span_id, attributes)
+        return Span(self, name, secrets.token_hex(16), None, attributes)
+
+    @contextmanager
+    def start_as_current_span(self, name: str, attributes: Optional[Dict[str, Any]] = None,
+                              require_parent: bool = False) -> Iterator[Any]:
+        """Run a block in a new span that is current for the block's duration.
+
+        An exception escaping the block is recorded on the span, which is marked as an error.
+        """
+        span = self.start_span(name, attributes, require_parent)
+        if span is NON_RECORDING_SPAN:
+            yield span
+            return
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            span.set_status(ERROR, str(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def _on_end(self, span: Span) -> None:
+        trace_id = span.context.trace_id
+        finished = None
+        with self._lock:
+            trace = self._open.get(trace_id)
+            if trace is None:
+                trace = self._open[trace_id] = {'trace_id': trace_id, 'spans': [], 'dropped': 0}
+                while len(self._open) > MAX_OPEN_TRACES:
+                    self._open.popitem(last=False)
+
+            if len(trace['spans']) < MAX_SPANS_PER_TRACE:
+                trace['spans'].append(span)
+            else:
+                trace['dropped'] += 1
+                self.dropped_spans += 1
+
+            if span.parent_id is None:
+                # The root span ends last; the trace is complete
+                del self._open[trace_id]
+                finished = self._finish(trace, span)
+                self._finished.append(finished)
+
+        if finished is not None and self.export_path:
+            self._export(finished)
+
+    @staticmethod
+    def _finish(trace: Dict[str, Any], root: Span) -> Dict[str, Any]:
+        spans = sorted((span.to_dict() for span in trace['spans']), key=lambda span: span['start_time'])
+        return {
+            'trace_id': trace['trace_id'],
+            'name': root.name,
+            'start_time': root.start_time,
+            'duration': round(root.duration, 6),
+            'status': root.status,
+            'span_count': len(spans),
+            'dropped_spans': trace['dropped'],
+            'spans': spans
+        }
+
+    def _export(self, trace: Dict[str, Any]) -> None:
+        try:
+            with open(self.export_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(trace, default=str) + '\n')
+        except OSError as e:
+            logger.error(f"Error writing trace to {self.export_path}: {str(e)}")
+
+    def get_traces(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Get finished traces, newest first."""
+        with self._lock:
+            traces = list(reversed(self._finished))
+        return traces[:limit] if limit else traces
+
+    def get_trace(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        """Get a finished trace from the ring buffer, or None if it has been evicted."""
+        with self._lock:
+            for trace in self._finished:
+                if trace['trace_id'] == trace_id:
+                    return trace
+        return None
+
+
+def get_current_span():
+    """Get the span that is current on this thread, or a non-recording span."""
+    return _current_span.get() or NON_RECORDING_SPAN
+
+
+def attach_span(span) -> contextvars.Token:
+    """Make a span current until detach_span() is called with the returned token.
+
+    For code that can't wrap the traced work in a with block, such as a pair of
+    request hooks.
+    """
+    return _current_span.set(span)
+
+
+def detach_span(token: contextvars.Token) -> None:
+    """Restore the span that was current before attach_span()."""
+    _current_span.reset(token)
+
+
+def traced(name: str, require_parent: bool = False) -> Callable:
+    """Decorator that runs every call of a function in its own span.
+
+    The function can add attributes with get_current_span().set_attribute().
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with get_tracer().start_as_current_span(name, require_parent=require_parent):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def waterfall_rows(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Lay out the spans of a finished trace for a waterfall chart.
+
+    Returns:
+        One row per span in depth-first order, with its depth in the tree and
+        its start offset and duration in milliseconds and as a percentage of the trace
+    """
+    spans = trace['spans']
+    span_ids = {span['span_id'] for span in spans}
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    for span in spans:
+        # Spans whose parent was dropped hang off the root
+        parent_id = span['parent_id'] if span['parent_id'] in span_ids else None
+        children.setdefault(parent_id, []).append(span)
+
+    start = trace['start_time']
+    total = max(trace['duration'], 1e-6)
+    rows = []
+
+    def visit(span, depth):
+        offset = max(0.0, span['start_time'] - start)
+        duration = span['duration'] or 0.0
+        rows.append(dict(
+            span,
+            depth=depth,
+            offset_ms=round(offset * 1000, 2),
+            duration_ms=round(duration * 1000, 2),
+            left=round(min(offset / total, 1.0) * 100, 2),
+            width=round(max(min(duration / total, 1.0) * 100, 0.2), 2)
+        ))
+        for child in children.get(span['span_id'], []):
+            visit(child, depth + 1)
+
+    for root in children.get(None, []):
+        visit(root, 0)
+    return rows
+
+
+# Process-wide tracer and the config version its settings came from
+_tracer = None
+_tracer_config_version = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer() -> Tracer:
+    """Get the process-wide tracer, applying the live app.tracing_* settings."""
+    global _tracer, _tracer_config_version
+
+    config = get_config()
+    if _tracer is not None and _tracer_config_version == config.version:
+        return _tracer
+
+    with _tracer_lock:
+        settings = config.app
+        if _tracer is None:
+            _tracer = Tracer()
+        _tracer.enabled = bool(settings.get('tracing_enabled', True))
+        _tracer.export_path = settings.get('trace_file') or None
+        _tracer.resize(int(settings.get('trace_buffer_size', 100)))
+        _tracer_config_version = config.version
+        return _tracer
+
+
+def start_as_current_span(name: str, attributes: Optional[Dict[str, Any]] = None, require_parent: bool = False):
+    """Shortcut for get_tracer().start_as_current_span()."""
+    return get_tracer().start_as_current_span(name, attributes, require_parent)
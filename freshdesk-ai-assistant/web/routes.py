@@ -1,24 +1,25 @@
 import os
 import json
+import time
 import logging
 from datetime import datetime
 from typing import Dict, Any, List, Optional
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, stream_with_context
 
 from database.db_operations import (
     get_session,
     get_all_tickets,
     get_ticket_by_freshdesk_id,
     get_responses_for_ticket,
+    get_latest_responses_by_ticket,
     get_conversations_for_ticket,
+    get_response,
     update_response,
-    update_response_full,
-    mark_response_sent,
-    create_response,
-    mark_ticket_processed
+    save_generated_response,
+    mark_ticket_processed,
+    count_http_cache_entries
 )
 from database.models import Ticket
-from freshdesk.api_client import create_client_from_config
 
 # Create blueprint
 bp = Blueprint('main', __name__)
@@ -26,6 +27,9 @@ bp = Blueprint('main', __name__)
 # Set up logging
 logger = logging.getLogger(__name__)
 
+# How often the job stream checks for status changes
+JOB_STREAM_POLL_SECONDS = 1.0
+
 @bp.route('/')
 def index():
     """Render the dashboard page."""
@@ -33,12 +37,13 @@ def index():
     session = get_session()
     tickets = get_all_tickets(session)
     
+    # Latest response of every ticket, in one query rather than one per ticket
+    latest_responses = get_latest_responses_by_ticket(session)
+    
     # Prepare data for the template
     ticket_data = []
     for ticket in tickets:
-        # Get the latest response for this ticket
-        responses = get_responses_for_ticket(session, ticket.id)
-        latest_response = responses[0] if responses else None
+        latest_response = latest_responses.get(ticket.id)
         
         ticket_data.append({
             'id': ticket.id,
@@ -54,7 +59,19 @@ def index():
     
     session.close()
     
-    return render_template('dashboard.html', tickets=ticket_data)
+    # Group near-duplicate open tickets (e.g. from an outage) so they can be answered once
+    clusters = []
+    try:
+        from ai.clustering import get_ticket_clusters
+        tickets_by_id = {ticket['id']: ticket for ticket in ticket_data}
+        for member_ids in get_ticket_clusters():
+            members = [tickets_by_id[member_id] for member_id in member_ids if member_id in tickets_by_id]
+            if len(members) > 1:
+                clusters.append(members)
+    except Exception as e:
+        logger.error(f"Error clustering tickets: {str(e)}")
+    
+    return render_template('dashboard.html', tickets=ticket_data, clusters=clusters)
 
 @bp.route('/ticket/<int:freshdesk_id>')
 def ticket_detail(freshdesk_id):
@@ -106,34 +123,62 @@ def update_response_api(response_id):
 
 @bp.route('/api/response/<int:response_id>/send', methods=['POST'])
 def send_response_api(response_id):
-    """API endpoint to send a response to Freshdesk."""
+    """API endpoint to send a response to Freshdesk.
+    
+    The reply is stored in the outbox and delivered in the background, so this
+    returns 202 straight away; clients poll the outbox status endpoint. Sending
+    the same response again returns the existing message instead of a duplicate.
+    """
+    from freshdesk.outbox import get_outbox_sender, reply_idempotency_key
+    
+    data = request.get_json(silent=True) or {}
+    
     session = get_session()
-    response = update_response(session, response_id, request.json.get('content', ''))
     
-    if not response:
+    try:
+        response = get_response(session, response_id)
+        if not response:
+            return jsonify({'error': 'Response not found'}), 404
+        
+        # Save the agent's final edits before queueing them
+        if 'content' in data and not response.is_sent:
+            response = update_response(session, response_id, data['content'])
+        
+        message = get_outbox_sender().enqueue(
+            response.ticket_id,
+            'reply',
+            {'body': response.final_content},
+            reply_idempotency_key(response.id),
+            response_id=response.id
+        )
+    except Exception as e:
+        logger.error(f"Error queueing response {response_id}: {str(e)}")
+        return jsonify({'error': f"Error queueing response: {str(e)}"}), 500
+    finally:
         session.close()
-        return jsonify({'error': 'Response not found'}), 404
     
-    # Get the ticket for this response
-    ticket = response.ticket
-    
-    # Create Freshdesk client
-    freshdesk_client = create_client_from_config()
+    return jsonify({
+        'success': True,
+        'message': message,
+        'status_url': url_for('main.outbox_status_api', message_id=message['id'])
+    }), 202
+
+@bp.route('/api/outbox/<int:message_id>')
+def outbox_status_api(message_id):
+    """API endpoint with the delivery status of an outbox message."""
+    from freshdesk.outbox import get_outbox_sender
     
-    # Send the response to Freshdesk
-    result = freshdesk_client.reply_to_ticket(
-        ticket.freshdesk_id,
-        response.final_content
-    )
+    message = get_outbox_sender().get_message(message_id)
+    if not message:
+        return jsonify({
+            'success': False,
+            'error': f"Outbox message {message_id} not found"
+        }), 404
     
-    if result:
-        # Mark the response as sent
-        mark_response_sent(session, response_id)
-        session.close()
-        return jsonify({'success': True})
-    else:
-        session.close()
-        return jsonify({'error': 'Failed to send response to Freshdesk'}), 500
+    return jsonify({
+        'success': True,
+        'message': message
+    })
 
 @bp.route('/api/tickets/refresh', methods=['POST'])
 def refresh_tickets_api():
@@ -158,10 +203,158 @@ def refresh_tickets_api():
             'error': f"Error refreshing tickets: {str(e)}"
         }), 500
 
+@bp.route('/api/tickets/<int:ticket_id>/refresh', methods=['POST'])
+def refresh_ticket_api(ticket_id):
+    """API endpoint to re-import one ticket from Freshdesk, ahead of any background polling."""
+    from freshdesk.ticket_importer import TicketImporter
+    from utils.rate_limiter import INTERACTIVE, request_priority
+    
+    session = get_session()
+    ticket = session.query(Ticket).filter(Ticket.id == ticket_id).first()
+    freshdesk_id = ticket.freshdesk_id if ticket else None
+    session.close()
+    
+    if freshdesk_id is None:
+        return jsonify({
+            'success': False,
+            'error': f"Ticket {ticket_id} not found"
+        }), 404
+    
+    try:
+        with request_priority(INTERACTIVE):
+            refreshed = TicketImporter().refresh_ticket(freshdesk_id)
+    except Exception as e:
+        logger.error(f"Error refreshing ticket {freshdesk_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f"Error refreshing ticket: {str(e)}"
+        }), 500
+    
+    if not refreshed:
+        return jsonify({
+            'success': False,
+            'error': f"Ticket {freshdesk_id} could not be refreshed from Freshdesk"
+        }), 502
+    
+    return jsonify({'success': True})
+
+@bp.route('/api/health/breakers')
+def circuit_breakers_api():
+    """API endpoint with the state of the circuit breakers for Freshdesk and OpenAI."""
+    from utils.circuit_breaker import get_breaker_states
+    
+    return jsonify({'breakers': get_breaker_states()})
+
+@bp.route('/api/freshdesk/rate_limit')
+def freshdesk_rate_limit_api():
+    """API endpoint with Freshdesk request counts and waiting times per priority class."""
+    from freshdesk.api_client import get_shared_freshdesk_client
+    
+    # No health check here: the stats must stay readable while Freshdesk is down
+    client = get_shared_freshdesk_client()
+    if client is None:
+        return jsonify({})
+    
+    return jsonify(client.rate_limiter.get_stats())
+
+@bp.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint with request, import, model and database metrics."""
+    from utils.metrics import CONTENT_TYPE, render_metrics
+    
+    return current_app.response_class(render_metrics(), mimetype=None, content_type=CONTENT_TYPE)
+
+@bp.route('/admin/traces')
+def admin_traces():
+    """Page with recent traces drawn as waterfalls."""
+    from utils.tracing import get_tracer, waterfall_rows
+    
+    tracer = get_tracer()
+    name_filter = request.args.get('q', '').strip()
+    limit = request.args.get('limit', 25, type=int)
+    
+    traces = tracer.get_traces()
+    if name_filter:
+        traces = [trace for trace in traces if name_filter.lower() in trace['name'].lower()]
+    traces = traces[:max(1, min(limit, 200))]
+    
+    return render_template(
+        'admin_traces.html',
+        traces=[dict(trace, rows=waterfall_rows(trace), started_at=datetime.utcfromtimestamp(trace['start_time'])) for trace in traces],
+        tracing_enabled=tracer.enabled,
+        name_filter=name_filter
+    )
+
+@bp.route('/api/traces')
+def traces_api():
+    """API endpoint with recent finished traces (without their spans), newest first."""
+    from utils.tracing import get_tracer
+    
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify([
+        {key: value for key, value in trace.items() if key != 'spans'}
+        for trace in get_tracer().get_traces(max(1, limit))
+    ])
+
+@bp.route('/api/traces/<trace_id>')
+def trace_api(trace_id):
+    """API endpoint with all spans of one trace."""
+    from utils.tracing import get_tracer
+    
+    trace = get_tracer().get_trace(trace_id)
+    if trace is None:
+        return jsonify({
+            'success': False,
+            'error': 'Trace not found (it may have been evicted)'
+        }), 404
+    
+    return jsonify(trace)
+
+@bp.route('/api/freshdesk/cache')
+def freshdesk_cache_api():
+    """API endpoint with conditional request counters for the Freshdesk HTTP cache."""
+    from freshdesk.api_client import get_shared_freshdesk_client
+    from utils.config import get_config
+    
+    session = get_session()
+    try:
+        entries = count_http_cache_entries(session)
+    finally:
+        session.close()
+    
+    # No health check here: the stats must stay readable while Freshdesk is down
+    client = get_shared_freshdesk_client()
+    if client is None:
+        # Nothing has used Freshdesk in this process yet, so there are no counters
+        return jsonify({'enabled': bool(get_config().freshdesk.get('http_cache_enabled', True)), 'entries': entries})
+    if client.http_cache is None:
+        return jsonify({'enabled': False, 'entries': entries})
+    
+    return jsonify(dict(client.http_cache.get_stats(), enabled=True, entries=entries))
+
 @bp.route('/api/tickets/<int:ticket_id>/generate_response', methods=['POST'])
 def generate_response_api(ticket_id):
-    """API endpoint to generate an AI response for a specific ticket."""
-    from ai.response_generator import generate_ticket_response, generate_follow_up_questions
+    """API endpoint to queue generation of an AI response for a specific ticket."""
+    return _queue_generation(ticket_id, 'response')
+
+@bp.route('/api/tickets/<int:ticket_id>/generate_cluster_response', methods=['POST'])
+def generate_cluster_response_api(ticket_id):
+    """API endpoint to queue one AI response for a ticket and copy it to every ticket in its cluster."""
+    return _queue_generation(ticket_id, 'cluster_response')
+
+@bp.route('/api/tickets/<int:ticket_id>/generate_follow_up_questions', methods=['POST'])
+def generate_follow_up_questions_api(ticket_id):
+    """API endpoint to queue generation of follow-up questions for a specific ticket."""
+    return _queue_generation(ticket_id, 'follow_up_questions')
+
+def _queue_generation(ticket_id: int, kind: str):
+    """Put a generation job on the queue and return it with a 202 status.
+    
+    The model call runs in a background worker; clients poll the job status
+    endpoint for the result. A pending job for the same ticket and kind is
+    returned instead of queueing a duplicate.
+    """
+    from ai.generation_queue import get_generation_queue
     
     # Get a database session
     session = get_session()
@@ -175,131 +368,286 @@ def generate_response_api(ticket_id):
                 'success': False,
                 'error': f"Ticket {ticket_id} not found"
             }), 404
-        
-        # Get conversations for this ticket
-        conversations = get_conversations_for_ticket(session, ticket.id)
-        
-        # Generate response directly - now returns a simple string
-        response_text = generate_ticket_response(ticket, conversations)
-        
-        # Generate follow-up questions if the ticket lacks clarity
-        follow_up_questions = generate_follow_up_questions(ticket, conversations)
-        
-        # Check if there's an existing response that's not sent
-        existing_responses = get_responses_for_ticket(session, ticket.id)
-        if existing_responses and not existing_responses[0].is_sent:
-            # Update the existing response
-            response = update_response_full(
-                session, 
-                existing_responses[0].id, 
-                final_content=response_text,
-                tech_instructions="", # No tech instructions
-                follow_up_questions=follow_up_questions,
-                is_final_solution=False # Default to false
-            )
-        else:
-            # Store the response as a new one
-            response = create_response(
-                session, 
-                ticket.id, 
-                response_text,
+    finally:
+        session.close()
+    
+    # "Generate New Response" asks for a fresh completion instead of a cached one
+    regenerate = bool((request.get_json(silent=True) or {}).get('regenerate'))
+    
+    try:
+        job = get_generation_queue().submit(ticket_id, kind, regenerate)
+    except Exception as e:
+        logger.error(f"Error queueing {kind} generation: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f"Error queueing generation: {str(e)}"
+        }), 500
+    
+    return jsonify({
+        'success': True,
+        'job': job,
+        'status_url': url_for('main.job_status_api', job_id=job['id'])
+    }), 202
+
+@bp.route('/api/jobs/<int:job_id>')
+def job_status_api(job_id):
+    """API endpoint with the status (and, once done, the result) of a generation job."""
+    from ai.generation_queue import get_generation_queue
+    
+    job = get_generation_queue().get_job(job_id)
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': f"Job {job_id} not found"
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job': job
+    })
+
+@bp.route('/api/tickets/bulk/generate', methods=['POST'])
+def bulk_generate_api():
+    """API endpoint to queue draft generation for several tickets."""
+    return _queue_bulk('response')
+
+@bp.route('/api/tickets/bulk/send', methods=['POST'])
+def bulk_send_api():
+    """API endpoint to queue sending the drafts of several tickets to Freshdesk."""
+    return _queue_bulk('send')
+
+def _queue_bulk(kind: str):
+    """Put one job per ticket on the generation queue and return them with a 202 status.
+    
+    The jobs share the queue's worker pool and the API clients' rate and token
+    budgets. Clients follow progress on the job stream endpoint.
+    """
+    from ai.generation_queue import get_generation_queue
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        ticket_ids = [int(ticket_id) for ticket_id in data.get('ticket_ids', [])]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'ticket_ids must be a list of ticket IDs'}), 400
+    if not ticket_ids:
+        return jsonify({'error': 'Missing ticket_ids field'}), 400
+    
+    queue = get_generation_queue()
+    jobs = []
+    failed = []
+    for ticket_id in dict.fromkeys(ticket_ids):
+        try:
+            jobs.append(queue.submit(ticket_id, kind, bool(data.get('regenerate'))))
+        except Exception as e:
+            logger.error(f"Error queueing {kind} job for ticket {ticket_id}: {str(e)}")
+            failed.append({'ticket_id': ticket_id, 'error': str(e)})
+    
+    job_ids = ",".join(str(job['id']) for job in jobs)
+    return jsonify({
+        'success': True,
+        'jobs': jobs,
+        'failed': failed,
+        'stream_url': url_for('main.job_stream_api', ids=job_ids)
+    }), 202
+
+@bp.route('/api/jobs/stream')
+def job_stream_api():
+    """API endpoint that streams status changes of several jobs as Server-Sent Events.
+    
+    Emits a 'job' event whenever a job changes status, then a 'done' event with
+    the counts once every job has finished or failed.
+    """
+    from ai.generation_queue import get_generation_queue
+    
+    try:
+        job_ids = [int(job_id) for job_id in request.args.get('ids', '').split(',') if job_id]
+    except ValueError:
+        return jsonify({'error': 'ids must be a comma-separated list of job IDs'}), 400
+    
+    def events():
+        queue = get_generation_queue()
+        last_status = {}
+        while True:
+            jobs = queue.get_jobs(job_ids)
+            for job in jobs:
+                if last_status.get(job['id']) != job['status']:
+                    last_status[job['id']] = job['status']
+                    yield _sse_event(job, event='job')
+            
+            if all(job['status'] in ('done', 'failed') for job in jobs):
+                yield _sse_event({
+                    'done': sum(1 for job in jobs if job['status'] == 'done'),
+                    'failed': sum(1 for job in jobs if job['status'] == 'failed')
+                }, event='done')
+                return
+            
+            time.sleep(JOB_STREAM_POLL_SECONDS)
+    
+    return current_app.response_class(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Keep reverse proxies from buffering the stream
+        }
+    )
+
+def _sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format a Server-Sent Events message with a JSON payload."""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data)}\n\n"
+
+@bp.route('/api/tickets/<int:ticket_id>/generate_response/stream')
+def stream_response_api(ticket_id):
+    """API endpoint that streams an AI response for a ticket as Server-Sent Events.
+    
+    Emits a message per chunk of cleaned text, then a 'done' event once the
+    full response has been stored, or a 'failure' event if generation fails.
+    """
+    from ai.response_generator import stream_ticket_response, generate_follow_up_questions
+    
+    # "Generate New Response" asks for a fresh completion instead of a cached one
+    regenerate = request.args.get('regenerate') == '1'
+    
+    # Get a database session; it stays open until the stream finishes
+    session = get_session()
+    
+    ticket = session.query(Ticket).filter(Ticket.id == ticket_id).first()
+    if not ticket:
+        session.close()
+        return jsonify({
+            'success': False,
+            'error': f"Ticket {ticket_id} not found"
+        }), 404
+    
+    conversations = get_conversations_for_ticket(session, ticket.id)
+    
+    def events():
+        parts = []
+        try:
+            for text in stream_ticket_response(ticket, conversations, regenerate):
+                parts.append(text)
+                yield _sse_event({'text': text})
+            
+            # Refresh the follow-up questions once the draft is complete
+            follow_up_questions = generate_follow_up_questions(ticket, conversations, regenerate)
+            
+            response = save_generated_response(
+                session,
+                ticket.id,
+                "".join(parts).strip(),
                 tech_instructions="", # No tech instructions
                 follow_up_questions=follow_up_questions,
                 is_final_solution=False # Default to false
             )
-        
-        # Mark the ticket as processed
-        mark_ticket_processed(session, ticket.id)
-        
-        return jsonify({
-            'success': True,
-            'response': {
+            
+            # Mark the ticket as processed
+            mark_ticket_processed(session, ticket.id)
+            
+            yield _sse_event({
                 'id': response.id,
                 'content': response.final_content,
                 'follow_up_questions': follow_up_questions
-            }
-        })
-    except Exception as e:
-        logger.error(f"Error generating response: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': f"Error generating response: {str(e)}"
-        }), 500
-    finally:
-        # Always close the session
-        session.close()
+            }, event='done')
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            yield _sse_event({'error': f"Error generating response: {str(e)}"}, event='failure')
+        finally:
+            # Always close the session
+            session.close()
+    
+    return current_app.response_class(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'  # Keep reverse proxies from buffering the stream
+        }
+    )
 
 @bp.route('/api/tickets/<int:ticket_id>/generate_tech_instructions', methods=['POST'])
 def generate_tech_instructions_api(ticket_id):
-    """API endpoint to generate technical instructions for a specific ticket."""
-    from ai.response_generator import generate_tech_instructions, generate_follow_up_questions
+    """API endpoint to queue generation of technical instructions for a specific ticket."""
+    return _queue_generation(ticket_id, 'tech_instructions')
+
+@bp.route('/api/tickets/<int:ticket_id>/similar')
+def similar_tickets_api(ticket_id):
+    """API endpoint with resolved tickets similar to a ticket and the answers sent on them."""
+    from ai.similarity_index import find_similar_tickets
+    
+    k = request.args.get('k', 5, type=int)
     
-    # Get a database session
     session = get_session()
     
     try:
-        # Get the ticket
         ticket = session.query(Ticket).filter(Ticket.id == ticket_id).first()
-        
         if not ticket:
             return jsonify({
                 'success': False,
                 'error': f"Ticket {ticket_id} not found"
             }), 404
         
-        # Get conversations for this ticket
-        conversations = get_conversations_for_ticket(session, ticket.id)
-        
-        # Generate tech instructions
-        tech_instructions = generate_tech_instructions(ticket, conversations)
-        
-        # Generate follow-up questions if the ticket lacks clarity
-        follow_up_questions = generate_follow_up_questions(ticket, conversations)
-        
-        # Generate a placeholder response for the customer
-        placeholder_response = "This is a placeholder response. Please edit before sending to the customer."
-        
-        # Check if there's an existing response that's not sent
-        existing_responses = get_responses_for_ticket(session, ticket.id)
-        if existing_responses and not existing_responses[0].is_sent:
-            # Update the existing response
-            response = update_response_full(
-                session, 
-                existing_responses[0].id, 
-                final_content=placeholder_response,
-                tech_instructions=tech_instructions,
-                follow_up_questions=follow_up_questions,
-                is_final_solution=False
-            )
-        else:
-            # Store the response as a new one
-            response = create_response(
-                session, 
-                ticket.id, 
-                placeholder_response,
-                tech_instructions=tech_instructions,
-                follow_up_questions=follow_up_questions,
-                is_final_solution=False
-            )
-        
-        # Mark the ticket as processed
-        mark_ticket_processed(session, ticket.id)
-        
+        return jsonify({
+            'success': True,
+            'similar': find_similar_tickets(session, ticket, max(1, min(k, 20)))
+        })
+    except Exception as e:
+        logger.error(f"Error finding similar tickets: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f"Error finding similar tickets: {str(e)}"
+        }), 500
+    finally:
+        session.close()
+
+@bp.route('/api/tickets/<int:ticket_id>/reuse_response', methods=['POST'])
+def reuse_response_api(ticket_id):
+    """API endpoint to copy an answer sent on a similar ticket into this ticket's draft."""
+    from ai.generation_service import reuse_previous_answer
+    
+    data = request.get_json(silent=True) or {}
+    if 'source_response_id' not in data:
+        return jsonify({'error': 'Missing source_response_id field'}), 400
+    try:
+        source_response_id = int(data['source_response_id'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'source_response_id must be a response ID'}), 400
+    
+    session = get_session()
+    
+    try:
+        response = reuse_previous_answer(session, ticket_id, source_response_id)
         return jsonify({
             'success': True,
             'response': {
                 'id': response.id,
-                'content': placeholder_response,
-                'tech_instructions': tech_instructions,
-                'follow_up_questions': follow_up_questions
+                'content': response.final_content
             }
         })
-    except Exception as e:
-        logger.error(f"Error generating tech instructions: {str(e)}")
+    except ValueError as e:
         return jsonify({
             'success': False,
-            'error': f"Error generating tech instructions: {str(e)}"
-        }), 500
+            'error': str(e)
+        }), 404
     finally:
-        # Always close the session
         session.close()
+
+@bp.route('/api/cache/stats')
+def cache_stats_api():
+    """API endpoint with hit/miss counters for the LLM response cache."""
+    from ai.openai_client import get_openai_client
+    
+    cache = get_openai_client().response_cache
+    if cache is None:
+        return jsonify({'enabled': False})
+    
+    return jsonify(dict(cache.get_stats(), enabled=True))
+
+@bp.route('/api/openai/usage')
+def openai_usage_api():
+    """API endpoint with token usage reported by OpenAI, including prompt-cache hits and per-task stats."""
+    from ai.openai_client import get_openai_client
+    
+    from ai.model_router import get_task_stats
+    
+    return jsonify(dict(get_openai_client().get_usage_stats(), tasks=get_task_stats()))